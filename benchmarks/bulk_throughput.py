@@ -0,0 +1,153 @@
+"""Throughput benchmarks against the local stand-in Bulk Data server.
+
+Every benchmark runs in a fresh process so its peak RSS isn't inflated by the
+ones before it. Run from the repository root:
+
+    python benchmarks/bulk_throughput.py --resources 20000 --padding 500
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import jwcrypto.jwk as jwk
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from fhirpy import emr_smart_scopes  # noqa: E402
+from fhirpy.fhir import FHIRAPI, FHIRRequest, Manifest  # noqa: E402
+from fhirpy.jwks import JWKS  # noqa: E402
+from fhirpy.polling import PollPolicy  # noqa: E402
+from fhirpy.testing import BulkDataServerConfig, FakeBulkDataServer  # noqa: E402
+
+POLL_POLICY = PollPolicy(min_interval=0, max_interval=0.05, jitter=0)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def connect(base_url: str, json_key: str, codec: str) -> FHIRAPI:
+    jwks = JWKS(
+        client_id="bench", jku="https://bench.test/jwks.json", json_key=json_key
+    )
+    fhir_api = FHIRAPI(base_url, jwks, emr_smart_scopes.ECW(), codec=codec)
+    fhir_api.smart_configuration()
+    fhir_api.authorize()
+    return fhir_api
+
+
+def prepared_manifest(fhir_api: FHIRAPI) -> tuple[Manifest, int]:
+    # exports before the timer starts and sizes every file with a HEAD request
+    manifest = fhir_api.wait_for_export(fhir_api.export("bench"), policy=POLL_POLICY)
+    nbytes = 0
+    for output in manifest.output:
+        response = fhir_api.session.head(
+            **FHIRRequest.download_file(output["url"], fhir_api.token.access_token)
+        )
+        nbytes += int(response.headers["Content-Length"])
+    return manifest, nbytes
+
+
+def bench_download_file(fhir_api: FHIRAPI) -> tuple[int, int, float]:
+    manifest, nbytes = prepared_manifest(fhir_api)
+    start = time.perf_counter()
+    resources = 0
+    for output in manifest.output:
+        resources += len(fhir_api.download_file(output["url"], output["type"]).content)
+    return resources, nbytes, time.perf_counter() - start
+
+
+def bench_iter_resources(fhir_api: FHIRAPI) -> tuple[int, int, float]:
+    manifest, nbytes = prepared_manifest(fhir_api)
+    start = time.perf_counter()
+    resources = 0
+    for output in manifest.output:
+        for _ in fhir_api.iter_resources(output["url"], output["type"]):
+            resources += 1
+    return resources, nbytes, time.perf_counter() - start
+
+
+def bench_wait_for_export(fhir_api: FHIRAPI) -> tuple[int, int, float]:
+    start = time.perf_counter()
+    for _ in range(20):
+        fhir_api.wait_for_export(fhir_api.export("bench"), policy=POLL_POLICY)
+    return 0, 0, time.perf_counter() - start
+
+
+def bench_end_to_end(fhir_api: FHIRAPI) -> tuple[int, int, float]:
+    # export, poll and decode every file with four download workers
+    start = time.perf_counter()
+    manifest = fhir_api.wait_for_export(fhir_api.export("bench"), policy=POLL_POLICY)
+    results = list(fhir_api.download_manifest(manifest, max_workers=4))
+    elapsed = time.perf_counter() - start
+    resources = sum(len(result.data.content) for result in results if result.ok)
+    _, nbytes = prepared_manifest(fhir_api)
+    return resources, nbytes, elapsed
+
+
+BENCHMARKS = {
+    "download_file": bench_download_file,
+    "iter_resources": bench_iter_resources,
+    "wait_for_export": bench_wait_for_export,
+    "end_to_end": bench_end_to_end,
+}
+
+
+def run_benchmark(name: str, base_url: str, json_key: str, codec: str) -> dict:
+    fhir_api = connect(base_url, json_key, codec)
+    resources, nbytes, elapsed = BENCHMARKS[name](fhir_api)
+    fhir_api.close()
+    return {
+        "benchmark": name,
+        "seconds": round(elapsed, 3),
+        "resources_per_second": round(resources / elapsed) if resources else None,
+        "mb_per_second": round(nbytes / elapsed / 1e6, 1) if nbytes else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--resources", type=int, default=20000)
+    parser.add_argument("--files", type=int, default=2)
+    parser.add_argument("--padding", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--codec", default="auto")
+    parser.add_argument("--json", action="store_true", help="print json lines")
+    parser.add_argument("benchmarks", nargs="*", default=list(BENCHMARKS))
+    args = parser.parse_args()
+
+    config = BulkDataServerConfig(
+        resources_per_file=args.resources,
+        files_per_type=args.files,
+        resource_padding=args.padding,
+        latency=args.latency,
+    )
+    json_key = jwk.JWK.generate(kty="RSA", alg="RS384", size=2048).export_private()
+    context = multiprocessing.get_context("spawn")
+    with FakeBulkDataServer(config) as server:
+        for name in args.benchmarks:
+            with context.Pool(1) as pool:
+                result = pool.apply(
+                    run_benchmark, (name, server.base_url, json_key, args.codec)
+                )
+            if args.json:
+                print(json.dumps(result))
+            else:
+                print(
+                    f"{name:>16}  {result['seconds']:>8}s  "
+                    f"{result['resources_per_second'] or '-':>10} resources/s  "
+                    f"{result['mb_per_second'] or '-':>8} MB/s  "
+                    f"{result['peak_rss_mb']:>8} MB peak RSS"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ import pyspark.pandas as ps
 import json
 
 from fhirpy.fhir import FHIRAPI, JWKS, ExportJob
+from fhirpy.pipeline import Pipeline
 
 # %%
 base_url = "https://fhir.epic.com/interconnect-fhir-oauth/api/FHIR/R4/"
@@ -34,30 +35,27 @@ export_job = ExportJob(
 mainfest = fhir_api.wait_for_export(export_job)
 
 # %%
-manifest_types = set()
-for _output in mainfest.output:
-    manifest_types.add(_output["type"])
-manifest_types = list(manifest_types)
+manifest_types = mainfest.list_types()
 
 # %%
-patient_files = [
-    fhir_file for fhir_file in mainfest.output if fhir_file["type"] == ("Patient")
-]
+patient_files = mainfest.outputs("Patient")
 
 # %%
-for mainfest_type in manifest_types:
-    print(mainfest_type)
-    resrouce_files = [
-        fhir_file for fhir_file in mainfest.output if fhir_file["type"] == mainfest_type
-    ]
-    fhir_data = []
-    for fhir_file in resrouce_files:
-        fhir_data.append(fhir_api.download_file(**fhir_file))
-
-    with open("data/epic_sandbox_{}.ndjson".format(mainfest_type), "w") as f:
-        for data in fhir_data:
-            for line in data.content:
-                f.write(json.dumps(line) + "\n")
+
+
+def write_ndjson(data):
+    with open("data/epic_sandbox_{}.ndjson".format(data.type), "a") as f:
+        for line in data.content:
+            f.write(json.dumps(line) + "\n")
+
+
+fhir_api.probe_sizes(mainfest)
+stats = (
+    Pipeline.from_manifest(fhir_api, mainfest)
+    .download(workers=8)
+    .sink(write_ndjson)
+    .run()
+)
 
 
 # %%
@@ -0,0 +1,227 @@
+import asyncio
+from typing import AsyncIterator, Optional
+
+from .codec import JSONCodec, NDJSONDecoder, get_codec
+from .compression import Decompressor, decompress
+from .fhir import (
+    ExportJob,
+    FHIRData,
+    FHIRRequest,
+    Manifest,
+    Token,
+    TokenExpired,
+    validate_token,
+)
+from .jwks import JWKS
+from .ndjson import NDJSONContent
+from .polling import ExportPoller, ExportProgress, PollPolicy
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None  # type: ignore[assignment]
+
+
+class AsyncFHIRAPI:
+    def __init__(
+        self,
+        base_url: str,
+        jwks: JWKS,
+        scopes: list[str],
+        session: Optional["aiohttp.ClientSession"] = None,
+        limit: int = 100,
+        limit_per_host: int = 0,
+        codec: str | JSONCodec = "auto",
+    ):
+        if aiohttp is None:
+            raise ImportError("AsyncFHIRAPI requires aiohttp to be installed")
+        self.base_url = (
+            base_url if base_url.endswith("/") else f"{base_url}/"
+        )  # add trailing / if it doesn't exist
+        self.jwks = jwks
+        self.scopes = scopes
+        self._smart_configuration: dict | None = None
+        self.token: Token | None = None
+        self.codec = get_codec(codec)
+        # a session passed in by the caller is used as is and never closed here
+        self._owns_session = session is None
+        self._session = session
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+
+    @property
+    def session(self) -> "aiohttp.ClientSession":
+        # aiohttp sessions must be created inside a running event loop
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self._limit, limit_per_host=self._limit_per_host
+                )
+            )
+        return self._session
+
+    async def close(self):
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def smart_configuration(self) -> dict:
+        async with self.session.get(
+            **FHIRRequest(self.base_url).smart_configuration(),
+            timeout=aiohttp.ClientTimeout(total=1),
+        ) as response:
+            if response.status != 200:
+                raise Exception("Getting Smart configuration failed")
+            smart_configuration = self.codec.loads(await response.read())
+        self._smart_configuration = smart_configuration
+        return smart_configuration
+
+    def token_endpoint(self):
+        return self._smart_configuration["token_endpoint"]
+
+    def authorization_endpoint(self):
+        return self._smart_configuration["authorization_endpoint"]
+
+    async def authorize(self):
+        token_endpoint = self._smart_configuration["token_endpoint"]
+        token = self.jwks.get_jwt(token_endpoint)
+        async with self.session.post(
+            **FHIRRequest(self.base_url).authenticate(
+                token_endpoint=token_endpoint,
+                client_assertion=token,
+                scopes=self.scopes,
+            )
+        ) as response:
+            if response.status != 200:
+                raise Exception(
+                    f"Authorization failed with status code {response.status} "
+                )
+            self.token = Token(**self.codec.loads(await response.read()))
+
+    def validate_token(self) -> bool:
+        return validate_token(self.token)
+
+    async def reauthorize(self):
+        try:
+            self.validate_token()
+        except TokenExpired:
+            await self.authorize()
+
+    async def export(
+        self, group_id: str, params: Optional[dict[str, str]] = None
+    ) -> ExportJob:
+        await self.reauthorize()
+        if self.token and self.token.access_token:
+            async with self.session.get(
+                **FHIRRequest(self.base_url).export(
+                    group_id=group_id, params=params, token=self.token.access_token
+                ),
+                timeout=aiohttp.ClientTimeout(total=500),
+            ) as response:
+                if response.status != 202:
+                    raise Exception("Job not started")
+                return ExportJob.from_headers(response.headers)
+        else:
+            raise Exception("Not authorized")
+
+    async def wait_for_export(
+        self,
+        job: ExportJob,
+        policy: Optional[PollPolicy] = None,
+        progress: Optional[ExportProgress] = None,
+    ) -> Manifest:
+        if self.token is None:
+            raise Exception("Not authorized")
+        if self.token.access_token is None:
+            raise Exception("Not authorized")
+        poller = ExportPoller(policy or PollPolicy(), job.retry_after, progress)
+        while True:
+            if poller.expired():
+                raise Exception("Timed out waiting for export to finish")
+            await self.reauthorize()
+            async with self.session.get(
+                **FHIRRequest.export_job_status(
+                    content_locaion=job.content_location,
+                    client_assertion=self.token.access_token,
+                )
+            ) as response:
+                if response.status == 200:
+                    return Manifest(**self.codec.loads(await response.read()))
+                # without a retry layer here a 429 only asks to poll slower
+                if response.status not in (202, 429):
+                    raise Exception(
+                        f"Export status failed with status code {response.status}"
+                    )
+                delay = poller.next_delay(response.headers)
+            await asyncio.sleep(delay)
+
+    async def download_file(self, url: str, type: str, lazy: bool = False) -> FHIRData:
+        if not lazy:
+            return FHIRData(
+                content=[resource async for resource in self.iter_resources(url, type)],
+                type=type,
+                url=url,
+            )
+        await self.reauthorize()
+        if self.token and self.token.access_token:
+            async with self.session.get(
+                **FHIRRequest.download_file(
+                    url=url, client_assertion=self.token.access_token
+                )
+            ) as response:
+                if response.status != 200:
+                    raise Exception(
+                        f"Download failed with status code {response.status}"
+                    )
+                content = NDJSONContent(decompress(await response.read()), self.codec)
+            return FHIRData(content=content, type=type, url=url)
+        else:
+            raise Exception("Not authorized")
+
+    async def iter_resources(
+        self, url: str, type: str, chunk_size: int = 1024 * 1024
+    ) -> AsyncIterator[dict]:
+        await self.reauthorize()
+        if self.token and self.token.access_token:
+            async with self.session.get(
+                **FHIRRequest.download_file(
+                    url=url, client_assertion=self.token.access_token
+                )
+            ) as response:
+                if response.status != 200:
+                    raise Exception(
+                        f"Download failed with status code {response.status}"
+                    )
+                # single FHIR resources (e.g. DocumentReference attachments) can
+                # exceed aiohttp's readline limit, so lines are split per chunk
+                decoder = NDJSONDecoder(self.codec)
+                decompressor = Decompressor()
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    for resource in decoder.feed(decompressor.feed(chunk)):
+                        yield resource
+                for resource in decoder.feed(decompressor.flush()):
+                    yield resource
+                for resource in decoder.close():
+                    yield resource
+        else:
+            raise Exception("Not authorized")
+
+    async def iter_batches(
+        self, url: str, type: str, batch_size: int = 10000
+    ) -> AsyncIterator[FHIRData]:
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        batch = []
+        async for resource in self.iter_resources(url, type):
+            batch.append(resource)
+            if len(batch) == batch_size:
+                yield FHIRData(content=batch, type=type, url=url)
+                batch = []
+        if batch:
+            yield FHIRData(content=batch, type=type, url=url)
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass, field
+
+from .fhir import DownloadedFile, ExportJob, Manifest
+
+
+@dataclass
+class ExportCheckpoint:
+    key: str
+    job: ExportJob | None = None
+    manifest: Manifest | None = None
+    # completed downloads keyed by manifest output url
+    files: dict[str, DownloadedFile] = field(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        return {
+            "key": self.key,
+            "job": asdict(self.job) if self.job else None,
+            "manifest": asdict(self.manifest) if self.manifest else None,
+            "files": {url: asdict(file) for url, file in self.files.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ExportCheckpoint":
+        return cls(
+            key=data["key"],
+            job=ExportJob(**data["job"]) if data.get("job") else None,
+            manifest=Manifest(**data["manifest"]) if data.get("manifest") else None,
+            files={
+                url: DownloadedFile(**file)
+                for url, file in (data.get("files") or {}).items()
+            },
+        )
+
+
+class CheckpointStore(ABC):
+    @abstractmethod
+    def load(self, key: str) -> ExportCheckpoint | None: ...
+
+    @abstractmethod
+    def save_job(self, key: str, job: ExportJob): ...
+
+    @abstractmethod
+    def save_manifest(self, key: str, manifest: Manifest): ...
+
+    @abstractmethod
+    def save_file(self, key: str, file: DownloadedFile): ...
+
+    @abstractmethod
+    def delete(self, key: str): ...
+
+
+class FileCheckpointStore(CheckpointStore):
+    # one json document per export, rewritten atomically on every change
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{name}.json")
+
+    def _write(self, checkpoint: ExportCheckpoint):
+        path = self._path(checkpoint.key)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(checkpoint.to_dict(), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
+
+    def _update(self, key: str, update):
+        with self._lock:
+            checkpoint = self.load(key) or ExportCheckpoint(key=key)
+            update(checkpoint)
+            self._write(checkpoint)
+
+    def load(self, key: str) -> ExportCheckpoint | None:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return ExportCheckpoint.from_dict(json.load(f))
+
+    def save_job(self, key: str, job: ExportJob):
+        self._update(key, lambda checkpoint: setattr(checkpoint, "job", job))
+
+    def save_manifest(self, key: str, manifest: Manifest):
+        self._update(key, lambda checkpoint: setattr(checkpoint, "manifest", manifest))
+
+    def save_file(self, key: str, file: DownloadedFile):
+        self._update(key, lambda checkpoint: checkpoint.files.update({file.url: file}))
+
+    def delete(self, key: str):
+        with self._lock:
+            if os.path.exists(self._path(key)):
+                os.remove(self._path(key))
+
+
+class SQLiteCheckpointStore(CheckpointStore):
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS export_jobs "
+                "(key TEXT PRIMARY KEY, job TEXT, manifest TEXT)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS export_files "
+                "(key TEXT, url TEXT, file TEXT, PRIMARY KEY (key, url))"
+            )
+
+    def close(self):
+        self._connection.close()
+
+    def load(self, key: str) -> ExportCheckpoint | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT job, manifest FROM export_jobs WHERE key = ?", (key,)
+            ).fetchone()
+            files = self._connection.execute(
+                "SELECT url, file FROM export_files WHERE key = ?", (key,)
+            ).fetchall()
+        if row is None and not files:
+            return None
+        job, manifest = row if row else (None, None)
+        return ExportCheckpoint.from_dict(
+            {
+                "key": key,
+                "job": json.loads(job) if job else None,
+                "manifest": json.loads(manifest) if manifest else None,
+                "files": {url: json.loads(file) for url, file in files},
+            }
+        )
+
+    def _upsert(self, key: str, column: str, value: str):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO export_jobs (key) VALUES (?)", (key,)
+            )
+            self._connection.execute(
+                f"UPDATE export_jobs SET {column} = ? WHERE key = ?", (value, key)
+            )
+
+    def save_job(self, key: str, job: ExportJob):
+        self._upsert(key, "job", json.dumps(asdict(job)))
+
+    def save_manifest(self, key: str, manifest: Manifest):
+        self._upsert(key, "manifest", json.dumps(asdict(manifest)))
+
+    def save_file(self, key: str, file: DownloadedFile):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO export_files (key, url, file) VALUES (?, ?, ?)",
+                (key, file.url, json.dumps(asdict(file))),
+            )
+
+    def delete(self, key: str):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM export_jobs WHERE key = ?", (key,))
+            self._connection.execute("DELETE FROM export_files WHERE key = ?", (key,))
@@ -0,0 +1,120 @@
+import json
+from typing import Any, Iterable, Iterator
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore[assignment]
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover
+    msgspec = None  # type: ignore[assignment]
+
+
+class JSONCodec:
+    name = "json"
+
+    def loads(self, data: bytes | bytearray | memoryview | str) -> Any:
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+    def loads_lines(self, data: bytes | memoryview) -> list:
+        # decodes every non blank line of an ndjson byte chunk
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return [self.loads(line) for line in data.split(b"\n") if line.strip()]
+
+
+class OrjsonCodec(JSONCodec):
+    name = "orjson"
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("OrjsonCodec requires orjson to be installed")
+
+    def loads(self, data: bytes | bytearray | memoryview | str) -> Any:
+        return orjson.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    def loads_lines(self, data: bytes | memoryview) -> list:
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        loads = orjson.loads
+        return [loads(line) for line in data.split(b"\n") if line.strip()]
+
+
+class MsgspecCodec(JSONCodec):
+    name = "msgspec"
+
+    def __init__(self):
+        if msgspec is None:
+            raise ImportError("MsgspecCodec requires msgspec to be installed")
+        self._encoder = msgspec.json.Encoder()
+        self._decoder = msgspec.json.Decoder()
+
+    def loads(self, data: bytes | bytearray | memoryview | str) -> Any:
+        return self._decoder.decode(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._encoder.encode(obj)
+
+    def loads_lines(self, data: bytes | memoryview) -> list:
+        # decodes the whole chunk in one call without splitting it first
+        return self._decoder.decode_lines(data)
+
+
+CODECS: dict[str, type[JSONCodec]] = {
+    "json": JSONCodec,
+    "orjson": OrjsonCodec,
+    "msgspec": MsgspecCodec,
+}
+
+
+def get_codec(codec: str | JSONCodec = "auto") -> JSONCodec:
+    # "auto" picks the fastest installed backend and falls back to json
+    if isinstance(codec, JSONCodec):
+        return codec
+    if codec == "auto":
+        if msgspec is not None:
+            return MsgspecCodec()
+        if orjson is not None:
+            return OrjsonCodec()
+        return JSONCodec()
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec {codec}, expected one of {list(CODECS)}")
+    return CODECS[codec]()
+
+
+class NDJSONDecoder:
+    # incremental decoder for ndjson arriving in arbitrary byte chunks, every
+    # complete line in a chunk is decoded in one loads_lines call
+    def __init__(self, codec: JSONCodec):
+        self.codec = codec
+        self._pending = b""
+
+    def feed(self, chunk: bytes) -> list:
+        data = self._pending + chunk if self._pending else chunk
+        end = data.rfind(b"\n")
+        if end == -1:
+            self._pending = data
+            return []
+        self._pending = data[end + 1 :]
+        return self.codec.loads_lines(memoryview(data)[: end + 1])
+
+    def close(self) -> list:
+        pending, self._pending = self._pending, b""
+        return self.codec.loads_lines(pending) if pending.strip() else []
+
+
+def iter_ndjson(chunks: Iterable[bytes], codec: JSONCodec) -> Iterator[Any]:
+    decoder = NDJSONDecoder(codec)
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+    yield from decoder.close()
@@ -0,0 +1,104 @@
+import gzip
+import hashlib
+import zlib
+from typing import BinaryIO, Iterable, Iterator, Optional, cast
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None  # type: ignore[assignment]
+
+GZIP_MAGIC = b"\x1f\x8b"
+# content codings requests and aiohttp decode on the fly
+ACCEPT_ENCODING = "gzip, deflate"
+COMPRESSIONS = ("gzip", "zstd")
+
+
+def is_gzip(data: bytes) -> bool:
+    # ndjson never starts with 0x1f, so the magic is enough to tell them apart
+    return data[:2] == GZIP_MAGIC
+
+
+def decompress(data: bytes) -> bytes:
+    # bodies of .ndjson.gz output files, plain ndjson is returned as is
+    return gzip.decompress(data) if is_gzip(data) else data
+
+
+class Decompressor:
+    # incremental counterpart of decompress for streamed bodies, the first
+    # two bytes decide whether the stream is gzip (of any number of members)
+    def __init__(self):
+        self._head = b""
+        self._sniffed = False
+        self._gzip: Optional["zlib._Decompress"] = None
+
+    def feed(self, chunk: bytes) -> bytes:
+        if not self._sniffed:
+            self._head += chunk
+            if len(self._head) < 2:
+                return b""
+            chunk, self._head, self._sniffed = self._head, b"", True
+            if is_gzip(chunk):
+                self._gzip = zlib.decompressobj(wbits=47)
+        if self._gzip is None:
+            return chunk
+        output = []
+        while chunk:
+            output.append(self._gzip.decompress(chunk))
+            if not self._gzip.eof:
+                break
+            # concatenated gzip members, start over on the rest
+            chunk = self._gzip.unused_data
+            self._gzip = zlib.decompressobj(wbits=47)
+        return b"".join(output)
+
+    def flush(self) -> bytes:
+        head, self._head = self._head, b""
+        if self._gzip is not None:
+            return self._gzip.flush()
+        return head
+
+
+def iter_decompressed(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    decompressor = Decompressor()
+    for chunk in chunks:
+        data = decompressor.feed(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+class HashingWriter:
+    # sha256 and size of the bytes that actually reach the file
+    def __init__(self, f: BinaryIO, sha256: Optional["hashlib._Hash"] = None):
+        self.f = f
+        self.sha256 = sha256 or hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+def compressing_writer(
+    f: HashingWriter, compression: str
+) -> "gzip.GzipFile | zstandard.ZstdCompressionWriter":
+    # closing the returned writer finishes the compressed stream, not f
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=f, mode="wb", compresslevel=6)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd compression requires zstandard to be installed")
+        # f only needs write and flush
+        return zstandard.ZstdCompressor().stream_writer(
+            cast(BinaryIO, f), closefd=False
+        )
+    raise ValueError(
+        f"Unknown compression {compression}, expected one of {COMPRESSIONS}"
+    )
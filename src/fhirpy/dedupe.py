@@ -0,0 +1,182 @@
+import os
+import sqlite3
+import tempfile
+from datetime import datetime
+from typing import BinaryIO, Iterable, Optional
+
+from .codec import JSONCodec, get_codec
+
+# deduplicates resources spread over many ndjson files without holding them
+# in memory. the first pass records, for every resourceType/id, where the
+# winning line is (file, byte offset, length) in an sqlite index on disk. the
+# second pass reads the winning lines back file by file in offset order and
+# writes one ndjson per resource type.
+#
+# the winner is the highest meta.versionId, then the latest meta.lastUpdated,
+# and on a tie the copy seen last, so files should be added oldest first.
+
+
+def _version(resource: dict) -> int:
+    version = (resource.get("meta") or {}).get("versionId")
+    if version is None:
+        return -1
+    try:
+        return int(version)
+    except (TypeError, ValueError):
+        return -1
+
+
+def _last_updated(resource: dict) -> float:
+    last_updated = (resource.get("meta") or {}).get("lastUpdated")
+    if not last_updated:
+        return float("-inf")
+    try:
+        return datetime.fromisoformat(last_updated.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return float("-inf")
+
+
+class Deduplicator:
+    def __init__(
+        self,
+        index_path: Optional[str] = None,
+        codec: str | JSONCodec = "auto",
+        batch_size: int = 10000,
+    ):
+        self.codec = get_codec(codec)
+        self.batch_size = batch_size
+        self._temporary = index_path is None
+        if index_path is None:
+            fd, index_path = tempfile.mkstemp(suffix=".sqlite")
+            os.close(fd)
+        self.index_path = index_path
+        self.files: list[str] = []
+        # lines read, including duplicates and lines that lost
+        self.lines = 0
+        self._connection = sqlite3.connect(index_path)
+        # a scratch index, it is rebuilt from the inputs if the process dies.
+        # rows left by an earlier run point into that run's files, drop them
+        self._connection.execute("PRAGMA journal_mode = OFF")
+        self._connection.execute("PRAGMA synchronous = OFF")
+        self._connection.execute("DROP TABLE IF EXISTS resources")
+        self._connection.execute(
+            "CREATE TABLE resources ("
+            "type TEXT, id TEXT, version INTEGER, last_updated REAL, "
+            "file INTEGER, offset INTEGER, length INTEGER, "
+            "PRIMARY KEY (type, id)) WITHOUT ROWID"
+        )
+
+    def add_file(self, path: str):
+        if path.endswith(".gz"):
+            raise ValueError(f"{path} is compressed, line offsets need plain ndjson")
+        file = len(self.files)
+        self.files.append(path)
+        batch = []
+        with open(path, "rb") as f:
+            offset = 0
+            for line in f:
+                length = len(line)
+                if line.strip():
+                    resource = self.codec.loads(line)
+                    batch.append(
+                        (
+                            resource["resourceType"],
+                            resource["id"],
+                            _version(resource),
+                            _last_updated(resource),
+                            file,
+                            offset,
+                            len(line.rstrip(b"\r\n")),
+                        )
+                    )
+                    if len(batch) >= self.batch_size:
+                        self._upsert(batch)
+                        batch = []
+                offset += length
+        self._upsert(batch)
+
+    def add_files(self, paths: Iterable[str]):
+        for path in paths:
+            self.add_file(path)
+
+    def _upsert(self, batch: list[tuple]):
+        if not batch:
+            return
+        self.lines += len(batch)
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO resources VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (type, id) DO UPDATE SET "
+                "version = excluded.version, last_updated = excluded.last_updated, "
+                "file = excluded.file, offset = excluded.offset, "
+                "length = excluded.length "
+                "WHERE (excluded.version, excluded.last_updated) "
+                ">= (resources.version, resources.last_updated)",
+                batch,
+            )
+
+    def counts(self) -> dict[str, int]:
+        # unique resources per type
+        return dict(
+            self._connection.execute(
+                "SELECT type, count(*) FROM resources GROUP BY type ORDER BY type"
+            )
+        )
+
+    def types(self) -> list[str]:
+        return list(self.counts())
+
+    def write(self, directory: str) -> dict[str, str]:
+        # writes <directory>/<type>.ndjson for every type and returns the paths
+        os.makedirs(directory, exist_ok=True)
+        return {
+            resource_type: self.write_type(
+                resource_type, os.path.join(directory, f"{resource_type}.ndjson")
+            )
+            for resource_type in self.types()
+        }
+
+    def write_type(self, resource_type: str, path: str) -> str:
+        rows = self._connection.execute(
+            "SELECT file, offset, length FROM resources WHERE type = ? "
+            "ORDER BY file, offset",
+            (resource_type,),
+        )
+        inputs: dict[int, BinaryIO] = {}
+        try:
+            with open(f"{path}.part", "wb") as out:
+                for file, offset, length in rows:
+                    if file not in inputs:
+                        inputs[file] = open(self.files[file], "rb")
+                    f = inputs[file]
+                    f.seek(offset)
+                    out.write(f.read(length))
+                    out.write(b"\n")
+        finally:
+            for f in inputs.values():
+                f.close()
+        os.replace(f"{path}.part", path)
+        return path
+
+    def close(self):
+        self._connection.close()
+        if self._temporary and os.path.exists(self.index_path):
+            os.remove(self.index_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def deduplicate(
+    paths: Iterable[str],
+    directory: str,
+    index_path: Optional[str] = None,
+    codec: str | JSONCodec = "auto",
+) -> dict[str, str]:
+    # paths oldest first, e.g. the files of successive incremental exports
+    with Deduplicator(index_path=index_path, codec=codec) as deduplicator:
+        deduplicator.add_files(paths)
+        return deduplicator.write(directory)
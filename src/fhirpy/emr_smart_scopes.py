@@ -1,3 +1,13 @@
+def resource_types(scopes: list[str]) -> list[str]:
+    # the exportable resource types of system/<Type>.read scopes
+    types = []
+    for scope in scopes:
+        resource_type = scope.split("/")[-1].split(".")[0]
+        if resource_type not in ("Group", "*") and resource_type not in types:
+            types.append(resource_type)
+    return types
+
+
 def Default() -> list[str]:
     scopes = ["system/Group.read"]
     return scopes
@@ -0,0 +1,183 @@
+import logging
+from typing import Mapping, Optional
+from urllib.parse import urlsplit
+
+try:
+    import prometheus_client
+except ImportError:  # pragma: no cover
+    prometheus_client = None  # type: ignore[assignment]
+
+logger = logging.getLogger("fhirpy")
+
+
+class EventHooks:
+    # instrumentation callbacks of FHIRAPI, every event is a no-op except
+    # error responses which are logged. subclass and override what you need
+    def request_start(self, method: str, url: str):
+        pass
+
+    def request_end(
+        self,
+        method: str,
+        url: str,
+        status: int,
+        elapsed: float,
+        nbytes: Optional[int],
+    ):
+        # nbytes is None for streamed bodies, see file_downloaded
+        pass
+
+    def request_error(self, method: str, url: str, error: Exception, elapsed: float):
+        pass
+
+    def request_retry(
+        self,
+        method: str,
+        url: str,
+        attempt: int,
+        delay: float,
+        status: Optional[int],
+        error: Optional[Exception],
+    ):
+        # called before sleeping delay seconds after a retryable failure
+        pass
+
+    def response_error(
+        self,
+        method: str,
+        url: str,
+        status: int,
+        headers: Mapping[str, str],
+        content: bytes,
+    ):
+        logger.warning(
+            "%s %s failed with status %s, headers %s, content %r",
+            method,
+            url,
+            status,
+            dict(headers),
+            content[:1000],
+        )
+
+    def token_refreshed(self, elapsed: float):
+        pass
+
+    def export_started(self, group_id: str, content_location: str):
+        pass
+
+    def export_polled(
+        self,
+        content_location: str,
+        status: int,
+        percent: Optional[float],
+        delay: Optional[float],
+    ):
+        # delay is None once the export is complete
+        pass
+
+    def export_completed(self, content_location: str, elapsed: float, files: int):
+        pass
+
+    def file_downloaded(
+        self,
+        url: str,
+        type: Optional[str],
+        nbytes: int,
+        elapsed: float,
+        resources: Optional[int],
+    ):
+        # resources is None when the file is written to disk undecoded
+        pass
+
+
+class PrometheusHooks(EventHooks):
+    # exports the events as prometheus counters and histograms, hosts are
+    # used as labels instead of urls to keep the label cardinality bounded
+    def __init__(self, registry=None, namespace: str = "fhirpy"):
+        if prometheus_client is None:
+            raise ImportError(
+                "PrometheusHooks requires prometheus_client to be installed"
+            )
+        registry = registry or prometheus_client.REGISTRY
+        Counter, Histogram = prometheus_client.Counter, prometheus_client.Histogram
+        options = {"namespace": namespace, "registry": registry}
+        self.requests = Counter(
+            "requests", "HTTP requests", ["method", "host", "status"], **options
+        )
+        self.request_errors = Counter(
+            "request_errors",
+            "HTTP requests without a response",
+            ["method", "host"],
+            **options,
+        )
+        self.retries = Counter(
+            "retries", "Requests retried", ["method", "host", "reason"], **options
+        )
+        self.request_seconds = Histogram(
+            "request_seconds", "HTTP request latency", ["method", "host"], **options
+        )
+        self.response_bytes = Counter(
+            "response_bytes", "Bytes received in response bodies", ["host"], **options
+        )
+        self.token_refreshes = Counter(
+            "token_refreshes", "Access tokens requested", **options
+        )
+        self.token_seconds = Histogram(
+            "token_seconds", "Token request latency", **options
+        )
+        self.exports = Counter("exports", "Export jobs started", ["host"], **options)
+        self.export_polls = Counter(
+            "export_polls", "Export status polls", ["host", "status"], **options
+        )
+        self.export_seconds = Histogram(
+            "export_seconds",
+            "Time from the first poll to a complete export",
+            ["host"],
+            buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200),
+            **options,
+        )
+        self.downloads = Counter(
+            "downloads", "Files downloaded", ["host", "type"], **options
+        )
+        self.download_bytes = Counter(
+            "download_bytes", "Bytes of downloaded files", ["host", "type"], **options
+        )
+        self.download_seconds = Histogram(
+            "download_seconds", "File download duration", ["host", "type"], **options
+        )
+        self.resources = Counter("resources", "Resources decoded", ["type"], **options)
+
+    def request_end(self, method, url, status, elapsed, nbytes):
+        host = urlsplit(url).netloc
+        self.requests.labels(method, host, str(status)).inc()
+        self.request_seconds.labels(method, host).observe(elapsed)
+        if nbytes:
+            self.response_bytes.labels(host).inc(nbytes)
+
+    def request_error(self, method, url, error, elapsed):
+        self.request_errors.labels(method, urlsplit(url).netloc).inc()
+
+    def request_retry(self, method, url, attempt, delay, status, error):
+        reason = str(status) if status is not None else type(error).__name__
+        self.retries.labels(method, urlsplit(url).netloc, reason).inc()
+
+    def token_refreshed(self, elapsed):
+        self.token_refreshes.inc()
+        self.token_seconds.observe(elapsed)
+
+    def export_started(self, group_id, content_location):
+        self.exports.labels(urlsplit(content_location).netloc).inc()
+
+    def export_polled(self, content_location, status, percent, delay):
+        self.export_polls.labels(urlsplit(content_location).netloc, str(status)).inc()
+
+    def export_completed(self, content_location, elapsed, files):
+        self.export_seconds.labels(urlsplit(content_location).netloc).observe(elapsed)
+
+    def file_downloaded(self, url, type, nbytes, elapsed, resources):
+        host, type = urlsplit(url).netloc, type or ""
+        self.downloads.labels(host, type).inc()
+        self.download_bytes.labels(host, type).inc(nbytes)
+        self.download_seconds.labels(host, type).observe(elapsed)
+        if resources:
+            self.resources.labels(type).inc(resources)
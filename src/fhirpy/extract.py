@@ -0,0 +1,297 @@
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Iterable, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # pragma: no cover
+    pa = None
+    pc = None
+
+# a small FHIRPath subset: field navigation, where() with = / != comparisons
+# joined by "and", and first(). e.g. name.where(use='official').given
+#
+# collections are evaluated the FHIRPath way, navigating into a repeating
+# element flattens it and missing or null values are dropped. Arrow columns
+# are evaluated with pyarrow.compute kernels on a (values, row offsets) pair
+# so no per row python code runs.
+
+
+@dataclass(frozen=True)
+class Condition:
+    path: tuple[str, ...]
+    operator: str
+    value: Any
+
+    def matches(self, item: Any) -> bool:
+        values = [item]
+        for name in self.path:
+            values = _navigate(values, name)
+        if self.operator == "=":
+            return any(value == self.value for value in values)
+        return bool(values) and all(value != self.value for value in values)
+
+
+@dataclass(frozen=True)
+class Field:
+    name: str
+
+
+@dataclass(frozen=True)
+class Where:
+    conditions: tuple[Condition, ...]
+
+
+@dataclass(frozen=True)
+class First:
+    pass
+
+
+def _split_top_level(expression: str, separator: str) -> list[str]:
+    # splits on separator outside of parentheses and quoted strings
+    parts, depth, quoted, start = [], 0, False, 0
+    index = 0
+    while index < len(expression):
+        char = expression[index]
+        if char == "'":
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and expression.startswith(separator, index):
+            parts.append(expression[start:index])
+            index += len(separator)
+            start = index
+            continue
+        index += 1
+    if quoted or depth:
+        raise ValueError(f"Unbalanced expression {expression}")
+    parts.append(expression[start:])
+    return parts
+
+
+def _parse_literal(literal: str) -> Any:
+    literal = literal.strip()
+    if len(literal) >= 2 and literal[0] == literal[-1] == "'":
+        return literal[1:-1]
+    if literal in ("true", "false"):
+        return literal == "true"
+    try:
+        return int(literal)
+    except ValueError:
+        pass
+    try:
+        return float(literal)
+    except ValueError:
+        raise ValueError(f"Invalid literal {literal}")
+
+
+def _parse_condition(condition: str) -> Condition:
+    match = re.fullmatch(r"\s*([A-Za-z_][\w.]*)\s*(!=|=)\s*(.+?)\s*", condition)
+    if match is None:
+        raise ValueError(f"Unsupported where condition {condition}")
+    path, operator, literal = match.groups()
+    return Condition(tuple(path.split(".")), operator, _parse_literal(literal))
+
+
+def parse_path(expression: str) -> tuple:
+    steps: list = []
+    for part in _split_top_level(expression.strip(), "."):
+        part = part.strip()
+        if part == "first()":
+            steps.append(First())
+        elif part.startswith("where(") and part.endswith(")"):
+            conditions = _split_top_level(part[len("where(") : -1], " and ")
+            steps.append(Where(tuple(_parse_condition(c) for c in conditions)))
+        elif re.fullmatch(r"[A-Za-z_]\w*", part):
+            steps.append(Field(part))
+        else:
+            raise ValueError(f"Unsupported path step {part} in {expression}")
+    return tuple(steps)
+
+
+def _navigate(items: list, name: str) -> list:
+    values: list = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        value = item.get(name)
+        if value is None:
+            continue
+        if isinstance(value, list):
+            values.extend(v for v in value if v is not None)
+        else:
+            values.append(value)
+    return values
+
+
+def _as_collection(value: Any) -> list:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+class FHIRPath:
+    def __init__(self, expression: str, steps: Optional[tuple] = None):
+        self.expression = expression
+        self.steps = parse_path(expression) if steps is None else steps
+
+    def tail(self) -> "FHIRPath":
+        # the path without its first step
+        return FHIRPath(self.expression, self.steps[1:])
+
+    def __repr__(self):
+        return f"FHIRPath({self.expression!r})"
+
+    def evaluate(self, resource: Any) -> list:
+        # a list input is treated as a collection, e.g. a Patient.name value
+        items = _as_collection(resource)
+        for step in self.steps:
+            if isinstance(step, Field):
+                items = _navigate(items, step.name)
+            elif isinstance(step, Where):
+                items = [
+                    item
+                    for item in items
+                    if all(condition.matches(item) for condition in step.conditions)
+                ]
+            else:
+                items = items[:1]
+        return items
+
+    def first(self, resource: Any) -> Any:
+        items = self.evaluate(resource)
+        return items[0] if items else None
+
+    def evaluate_batch(self, resources: Iterable[Any], first: bool = False) -> list:
+        if first:
+            return [self.first(resource) for resource in resources]
+        return [self.evaluate(resource) for resource in resources]
+
+    def evaluate_arrow(self, column, first: bool = False):
+        # returns a list array with one collection per row, or with first the
+        # first value of every row and null for empty collections
+        if pa is None:
+            raise ImportError("evaluate_arrow requires pyarrow to be installed")
+        values, offsets = _arrow_collection(column)
+        for step in self.steps:
+            if isinstance(step, Field):
+                values, offsets = _arrow_field(values, offsets, step.name)
+            elif isinstance(step, Where):
+                mask = None
+                for condition in step.conditions:
+                    matches = _arrow_condition(values, condition)
+                    mask = matches if mask is None else pc.and_(mask, matches)
+                values, offsets = _arrow_compact(values, offsets, mask)
+            else:
+                values, offsets = _arrow_first(values, offsets)
+        if first:
+            starts, lengths = offsets[:-1], pc.subtract(offsets[1:], offsets[:-1])
+            index = pc.if_else(pc.greater(lengths, 0), starts, None)
+            return pc.take(values, index)
+        return pa.LargeListArray.from_arrays(offsets, values)
+
+
+@lru_cache(maxsize=1024)
+def compile_path(expression: str) -> FHIRPath:
+    return FHIRPath(expression)
+
+
+def _int64(values: list[int]):
+    return pa.array(values, pa.int64())
+
+
+def _cumulative_offsets(counts):
+    # row offsets from per row counts, with a leading 0
+    return pa.concat_arrays(
+        [_int64([0]), pc.cumulative_sum(pc.cast(counts, pa.int64()))]
+    )
+
+
+def _arrow_collection(column):
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if pa.types.is_list(column.type) or pa.types.is_large_list(column.type):
+        lengths = pc.fill_null(pc.list_value_length(column), 0)
+        values, offsets = column.flatten(), _cumulative_offsets(lengths)
+    else:
+        values = column
+        offsets = _cumulative_offsets(pa.repeat(1, len(column)).cast(pa.int64()))
+    return _arrow_compact(values, offsets, pc.is_valid(values))
+
+
+def _arrow_compact(values, offsets, mask):
+    # keeps the values where mask is true and recomputes the row offsets
+    mask = pc.fill_null(mask, False)
+    kept = _cumulative_offsets(mask)
+    return pc.filter(values, mask), pc.take(kept, offsets)
+
+
+def _arrow_field(values, offsets, name: str):
+    if not pa.types.is_struct(values.type) or values.type.get_field_index(name) == -1:
+        # navigating to a field that doesn't exist gives empty collections
+        return pa.nulls(0, pa.null()), pc.multiply(offsets, 0)
+    child = pc.struct_field(values, name)
+    if pa.types.is_list(child.type) or pa.types.is_large_list(child.type):
+        lengths = pc.fill_null(pc.list_value_length(child), 0)
+        offsets = pc.take(_cumulative_offsets(lengths), offsets)
+        child = child.flatten()
+    return _arrow_compact(child, offsets, pc.is_valid(child))
+
+
+def _arrow_condition(values, condition: Condition):
+    target = values
+    for name in condition.path:
+        if (
+            not pa.types.is_struct(target.type)
+            or target.type.get_field_index(name) == -1
+        ):
+            return pa.repeat(False, len(values))
+        target = pc.struct_field(target, name)
+        if pa.types.is_list(target.type) or pa.types.is_large_list(target.type):
+            raise ValueError(
+                f"where() over the repeating element {name} is not supported "
+                "for Arrow columns"
+            )
+    compare = pc.equal if condition.operator == "=" else pc.not_equal
+    return pc.fill_null(compare(target, condition.value), False)
+
+
+def _arrow_first(values, offsets):
+    starts, lengths = offsets[:-1], pc.subtract(offsets[1:], offsets[:-1])
+    nonempty = pc.greater(lengths, 0)
+    values = pc.take(values, pc.filter(starts, nonempty))
+    return values, _cumulative_offsets(nonempty)
+
+
+class Extractor:
+    # extracts named columns from a batch of resources, every path is compiled
+    # once and then run over the whole batch
+    def __init__(self, columns: dict[str, str], first: bool = True):
+        self.columns = {name: compile_path(path) for name, path in columns.items()}
+        self.first = first
+
+    def extract(self, resources: Iterable[dict]) -> dict[str, list]:
+        resources = list(resources)
+        return {
+            name: path.evaluate_batch(resources, first=self.first)
+            for name, path in self.columns.items()
+        }
+
+    def extract_table(self, table) -> dict[str, Any]:
+        # the first step of each path names a column of the table, the rest
+        # of the path is evaluated on that column with arrow kernels
+        result = {}
+        for name, path in self.columns.items():
+            head = path.steps[0]
+            if not isinstance(head, Field):
+                raise ValueError(f"{path.expression} must start with a column name")
+            if head.name in table.column_names:
+                column = table.column(head.name)
+            else:
+                column = pa.nulls(table.num_rows)
+            result[name] = path.tail().evaluate_arrow(column, first=self.first)
+        return result
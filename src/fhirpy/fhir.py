@@ -1,25 +1,80 @@
+import hashlib
+import itertools
 import json
+import os
+import threading
 import time
-from dataclasses import dataclass, fields
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field, fields
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Optional, Sequence
+from urllib.parse import urlsplit
 
 import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
 from requests.models import PreparedRequest
 
+from .codec import JSONCodec, get_codec, iter_ndjson
+from .compression import (
+    ACCEPT_ENCODING,
+    HashingWriter,
+    compressing_writer,
+    decompress,
+    is_gzip,
+    iter_decompressed,
+)
+from .emr_smart_scopes import resource_types
+from .events import EventHooks
 from .jwks import JWKS
+from .ndjson import NDJSONContent
+from .polling import ExportPoller, ExportProgress, PollPolicy
+from .retry import CircuitBreaker, RetryPolicy, kickoff_policy
+from .state import export_state_key
+
+if TYPE_CHECKING:
+    from .checkpoint import CheckpointStore, ExportCheckpoint
+    from .parallel import ParallelDecoder
+    from .state import ExportStateStore
+    from .token_cache import TokenCache, TokenRefresher
 
 
 class TokenExpired(Exception):
     pass
 
 
-@dataclass
+class ExportExpired(Exception):
+    # the server no longer has the export job or its files (404, 410)
+    pass
+
+
+@dataclass(slots=True)
 class FHIRData:
-    content: list
+    # a list of dicts, or an NDJSONContent that decodes resources on access
+    content: Sequence
     type: str
     url: str
 
 
+@dataclass
+class DownloadResult:
+    url: str
+    type: str
+    data: FHIRData | None = None
+    error: Exception | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class DownloadedFile:
+    url: str
+    path: str
+    size: int
+    sha256: str
+
+
 @dataclass
 class Token:
     # expected parameters
@@ -35,6 +90,9 @@ class Token:
         for k, v in kwargs.items():
             if k in names:
                 setattr(self, k, v)
+        # the class default is evaluated once at import time
+        if "token_created" not in kwargs:
+            self.token_created = int(time.time())
 
 
 @dataclass
@@ -48,6 +106,17 @@ class ExportJob:
             if k in names:
                 setattr(self, k, v)
 
+    @classmethod
+    def from_headers(cls, headers) -> "ExportJob":
+        content_location = headers.get("Content-Location")
+        retry_after = headers.get("Retry-After")
+        params = {
+            "content_location": content_location,
+            # if retry exists add it to dictionary
+            **({"retry_after": int(retry_after)} if retry_after else {}),
+        }
+        return cls(**params)
+
 
 @dataclass
 class Manifest:
@@ -56,44 +125,57 @@ class Manifest:
     transactionTime: str | None = ""
     error: list | None = None
     requiresAccessToken: bool | None = None
+    # Content-Length of output files by url, filled in by FHIRAPI.probe_sizes
+    sizes: dict[str, int] = field(default_factory=dict)
+
+    def __post_init__(self):
+        # outputs grouped by resource type, in manifest order
+        self.by_type: dict[str, list[dict[str, str]]] = {}
+        for output in self.output:
+            self.by_type.setdefault(output["type"], []).append(output)
 
     def list_types(self) -> list[str]:
-        manifest_types = []
-        for _output in self.output:
-            manifest_types.add(_output["type"])
-        manifest_types = list(manifest_types)
+        return list(self.by_type)
 
-        return manifest_types
+    def outputs(self, type: str) -> list[dict[str, str]]:
+        return self.by_type.get(type, [])
+
+    def largest_first(self) -> list[dict[str, str]]:
+        # download order that keeps one large file from running alone at the
+        # end. files of unknown size go first since they may be the largest,
+        # without any sizes the manifest order is kept
+        return sorted(
+            self.output,
+            key=lambda output: -self.sizes.get(output["url"], float("inf")),
+        )
 
 
 class FHIRResponse:
     # TODO make dataclass
-    def __init__(self, response: requests.Response):
+    def __init__(self, response: requests.Response, codec: Optional[JSONCodec] = None):
         self.response = response
+        self.codec = codec or JSONCodec()
+
+    def json(self):
+        # decode the raw body bytes, skipping the bytes to str copy of .text
+        return self.codec.loads(self.response.content)
 
     def Manifest(self) -> Manifest:
-        return Manifest(**self.response.json())
+        return Manifest(**self.json())
 
     def ContentLocation(self) -> str:
         return self.response.headers["Content-Location"]
 
     def Token(self) -> Token:
-        return Token(**self.response.json())
+        return Token(**self.json())
 
     def SmartConfiguration(self) -> dict:
         if self.response.status_code != 200:
             raise Exception("Getting Smart configuration failed")
-        return self.response.json()
+        return self.json()
 
     def ExportJob(self) -> ExportJob:
-        content_location = self.response.headers.get("Content-Location")
-        retry_after = self.response.headers.get("Retry-After")
-        params = {
-            "content_location": content_location,
-            # if retry exists add it to dictionary
-            **({"retry_after": int(retry_after)} if retry_after else {}),
-        }
-        return ExportJob(**params)
+        return ExportJob.from_headers(self.response.headers)
 
 
 @dataclass
@@ -141,11 +223,60 @@ class FHIRRequest:
 
         return {"url": req.url, "headers": headers}
 
+    def export_patients(
+        self,
+        token: str,
+        group_id: str,
+        patients: list[str],
+        params: Optional[dict[str, str]] = None,
+    ):
+        # POST kickoff limited to the given patient ids, the other export
+        # parameters move into the Parameters body
+        parameters: list[dict[str, Any]] = [
+            {"name": name, "valueString": value}
+            for name, value in (params or {}).items()
+        ]
+        parameters += [
+            {"name": "patient", "valueReference": {"reference": f"Patient/{patient}"}}
+            for patient in patients
+        ]
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Prefer": "respond-async",
+            "Accept": "application/fhir+json",
+            "Content-Type": "application/fhir+json",
+        }
+
+        return {
+            "url": f"{self.base_url}Group/{group_id}/$export",
+            "headers": headers,
+            "json": {"resourceType": "Parameters", "parameter": parameters},
+        }
+
+    def group(self, token: str, group_id: str):
+        url = f"{self.base_url}Group/{group_id}"
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/fhir+json",
+        }
+
+        return {"url": url, "headers": headers}
+
     @staticmethod
-    def download_file(url: str, client_assertion: str):
+    def download_file(
+        url: str,
+        client_assertion: str,
+        offset: int = 0,
+        if_range: Optional[str] = None,
+    ):
         headers = {
             "Authorization": f"Bearer {client_assertion}",
             "Accept": "*/*",
+            "Accept-Encoding": ACCEPT_ENCODING,
+            # resume a partial download from the given byte offset
+            **({"Range": f"bytes={offset}-"} if offset else {}),
+            # and get the whole file instead if it changed since
+            **({"If-Range": if_range} if offset and if_range else {}),
         }
         return {"url": url, "headers": headers}
 
@@ -161,8 +292,107 @@ class FHIRRequest:
         return {"url": url, "headers": headers}
 
 
+def validate_token(token: Token | None) -> bool:
+    if token is None:
+        raise Exception("Not authorized")
+    if token.expires_in and token.token_created:
+        # if token expires in less than 5 seconds raise token expired exception
+        if token.token_created + token.expires_in < time.time() + 5:
+            raise TokenExpired("Token expired")
+    return True
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> "hashlib._Hash":
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256
+
+
+def _file_source(url: str, response: requests.Response) -> dict:
+    # what a .part file is downloaded from, a later run only resumes it if
+    # the url and the validators the server sent still match
+    return {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+
+
+def _load_file_source(path: str) -> Optional[dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _if_range(source: dict) -> Optional[str]:
+    # If-Range only takes a strong etag or a date
+    etag = source.get("etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return source.get("last_modified")
+
+
+def _parse_instant(value: str) -> datetime:
+    # fromisoformat only accepts a Z suffix from python 3.11
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def merge_manifests(manifests: list[Manifest], request: str = "") -> Manifest:
+    # the earliest transactionTime is kept, so a _since taken from the merged
+    # manifest never skips changes one of the jobs didn't include
+    times = [
+        manifest.transactionTime for manifest in manifests if manifest.transactionTime
+    ]
+    return Manifest(
+        request=request,
+        output=[output for manifest in manifests for output in manifest.output],
+        transactionTime=min(times, key=_parse_instant) if times else "",
+        error=[error for manifest in manifests for error in manifest.error or []],
+        requiresAccessToken=any(manifest.requiresAccessToken for manifest in manifests),
+    )
+
+
+def _chunks(items: list, size: int) -> list[list]:
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+def create_session(
+    pool_connections: int = 10,
+    pool_maxsize: int = 10,
+    adapter: Optional[BaseAdapter] = None,
+) -> requests.Session:
+    # connections are kept alive and reused for every request to the same host
+    session = requests.Session()
+    if adapter is None:
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize
+        )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 class FHIRAPI:
-    def __init__(self, base_url: str, jwks: JWKS, scopes: list[str]):
+    def __init__(
+        self,
+        base_url: str,
+        jwks: JWKS,
+        scopes: list[str],
+        session: Optional[requests.Session] = None,
+        pool_connections: int = 10,
+        pool_maxsize: int = 10,
+        adapter: Optional[BaseAdapter] = None,
+        token_cache: Optional["TokenCache"] = None,
+        codec: str | JSONCodec = "auto",
+        export_state: Optional["ExportStateStore"] = None,
+        hooks: Optional[EventHooks] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+    ):
         self.base_url = (
             base_url if base_url.endswith("/") else f"{base_url}/"
         )  # add trailing / if it doesn't exist
@@ -170,10 +400,130 @@ class FHIRAPI:
         self.scopes = scopes
         self._smart_configuration: dict | None = None
         self.token: Token | None = None
+        # json backend used for every response and ndjson body
+        self.codec = get_codec(codec)
+        # tokens in the cache are shared with every FHIRAPI using the same cache
+        self.token_cache = token_cache
+        # last transactionTime per export, passed as _since to the next export
+        self.export_state = export_state
+        # instrumentation callbacks, see events.EventHooks
+        self.hooks = hooks or EventHooks()
+        # transient failures (429, 5xx, dropped connections) are retried, a
+        # circuit breaker can be shared by every FHIRAPI talking to a host
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker
+        # a session passed in by the caller is used as is and never closed here
+        self._owns_session = session is None
+        self.session = (
+            session
+            if session is not None
+            else create_session(
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize,
+                adapter=adapter,
+            )
+        )
+
+    def close(self):
+        if self._owns_session:
+            self.session.close()
+
+    def _request(
+        self,
+        method: str,
+        build: Optional[Callable[[], dict]] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        **kwargs,
+    ) -> requests.Response:
+        # every request goes through here, retryable failures are retried per
+        # retry_policy (self.retry_policy by default) and reported to the
+        # circuit breaker. build, if given, makes fresh request kwargs for
+        # every attempt
+        policy = retry_policy or self.retry_policy
+        attempt = 0
+        while True:
+            attempt += 1
+            request = {**build(), **kwargs} if build is not None else kwargs
+            url = request["url"]
+            host = urlsplit(url).netloc
+            probe = self._wait_for_circuit(host)
+            try:
+                response = self._send(method, **request)
+            except Exception as e:
+                if not policy.retry_exception(e):
+                    if probe and self.circuit_breaker is not None:
+                        self.circuit_breaker.release(host)
+                    raise
+                self._record_result(host, ok=False)
+                if attempt >= policy.max_attempts:
+                    raise
+                delay = policy.delay(attempt)
+                self.hooks.request_retry(method, url, attempt, delay, None, e)
+                time.sleep(delay)
+                continue
+
+            retry = policy.retry_status(response.status_code)
+            self._record_result(host, ok=not retry)
+            if not retry or attempt >= policy.max_attempts:
+                return response
+            delay = policy.delay(attempt, response.headers)
+            self.hooks.request_retry(
+                method, url, attempt, delay, response.status_code, None
+            )
+            response.close()
+            time.sleep(delay)
+
+    def _wait_for_circuit(self, host: str) -> bool:
+        # waits while the host's circuit is open, True if this request is
+        # the one probe let through once it is half open
+        if self.circuit_breaker is None:
+            return False
+        return self.circuit_breaker.acquire(host)
+
+    def _record_result(self, host: str, ok: bool):
+        if self.circuit_breaker is None:
+            return
+        if ok:
+            self.circuit_breaker.record_success(host)
+        else:
+            self.circuit_breaker.record_failure(host)
+
+    def _send(self, method: str, **kwargs) -> requests.Response:
+        url = kwargs["url"]
+        self.hooks.request_start(method, url)
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, **kwargs)
+        except Exception as e:
+            self.hooks.request_error(method, url, e, time.perf_counter() - start)
+            raise
+        nbytes = None if kwargs.get("stream") else len(response.content)
+        self.hooks.request_end(
+            method, url, response.status_code, time.perf_counter() - start, nbytes
+        )
+        return response
+
+    def _response_error(self, method: str, response: requests.Response):
+        self.hooks.response_error(
+            method,
+            response.url,
+            response.status_code,
+            response.headers,
+            response.content,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def smart_configuration(self):
         smart_configuration = FHIRResponse(
-            requests.get(**FHIRRequest(self.base_url).smart_configuration(), timeout=1)
+            self._request(
+                "GET", **FHIRRequest(self.base_url).smart_configuration(), timeout=1
+            ),
+            self.codec,
         ).SmartConfiguration()
         self._smart_configuration = smart_configuration
         return smart_configuration
@@ -185,102 +535,785 @@ class FHIRAPI:
         return self._smart_configuration["authorization_endpoint"]
 
     def authorize(self):
-        token_endpoint = self._smart_configuration["token_endpoint"]
-        token = self.jwks.get_jwt(token_endpoint)
-        response = requests.post(
-            **FHIRRequest(self.base_url).authenticate(
+        if self.token_cache is None:
+            self.token = self._request_token()
+        else:
+            self.token = self.token_cache.get_or_refresh(
+                self._token_cache_key(self.token_cache), self._request_token
+            )
+
+    def _token_cache_key(self, token_cache: "TokenCache") -> str:
+        return token_cache.key(self.token_endpoint(), self.jwks.client_id, self.scopes)
+
+    def start_token_refresh(self) -> "TokenRefresher":
+        # refreshes the cached token in the background ahead of its expiry
+        if self.token_cache is None:
+            raise Exception("Background token refresh requires a token cache")
+        return self.token_cache.start_background_refresh(
+            self._token_cache_key(self.token_cache), self._request_token
+        )
+
+    def _request_token(self) -> Token:
+        token_endpoint = self.token_endpoint()
+        start = time.perf_counter()
+        # a retry signs a new client assertion, servers reject a reused jti
+        response = self._request(
+            "POST",
+            build=lambda: FHIRRequest(self.base_url).authenticate(
                 token_endpoint=token_endpoint,
-                client_assertion=token,
+                client_assertion=self.jwks.get_jwt(token_endpoint),
                 scopes=self.scopes,
-            )
+            ),
         )
 
         if response.status_code != 200:
-            if response.headers:
-                print(f"ERROR response.header {response.headers}")
-                print(f"ERROR response.content {response.content}")
+            self._response_error("POST", response)
             raise Exception(
                 f"Authorization failed with status code {response.status_code} "
             )
 
-        self.token = FHIRResponse(response).Token()
+        token = FHIRResponse(response, self.codec).Token()
+        self.hooks.token_refreshed(time.perf_counter() - start)
+        return token
+
+    def export_params(
+        self,
+        group_id: str,
+        params: Optional[dict[str, str]] = None,
+        since: Optional[str] = None,
+        full_refresh: bool = False,
+    ) -> dict[str, str]:
+        # an explicit _since wins, then since, then the recorded transactionTime
+        params = dict(params or {})
+        if full_refresh or "_since" in params:
+            return params
+        if since is None and self.export_state is not None:
+            since = self.export_state.get_since(
+                export_state_key(self.base_url, group_id, params)
+            )
+        if since is not None:
+            params["_since"] = since
+        return params
+
+    def record_export(
+        self,
+        group_id: str,
+        manifest: Manifest,
+        params: Optional[dict[str, str]] = None,
+    ):
+        # call once every file of the manifest has been downloaded
+        if self.export_state is None or not manifest.transactionTime:
+            return
+        params = {k: v for k, v in (params or {}).items() if k != "_since"}
+        self.export_state.set_since(
+            export_state_key(self.base_url, group_id, params), manifest.transactionTime
+        )
 
     def export(
-        self, group_id: str, params: Optional[dict[str, str]] = None
+        self,
+        group_id: str,
+        params: Optional[dict[str, str]] = None,
+        since: Optional[str] = None,
+        full_refresh: bool = False,
     ) -> ExportJob:
         self.reauthorize()
+        params = self.export_params(group_id, params, since, full_refresh)
         if self.token and self.token.access_token:
-            response = requests.get(
+            response = self._request(
+                "GET",
                 **FHIRRequest(self.base_url).export(
                     group_id=group_id, params=params, token=self.token.access_token
                 ),
+                retry_policy=kickoff_policy(self.retry_policy),
                 timeout=500,
             )
             if response.status_code != 202:
-                print(response.headers)
-                print(response.content)
-                print(response.status_code)
+                self._response_error("GET", response)
                 raise Exception("Job not started")
 
-            exportJob = FHIRResponse(response).ExportJob()
+            exportJob = FHIRResponse(response, self.codec).ExportJob()
+            self.hooks.export_started(group_id, exportJob.content_location)
 
             return exportJob
         else:
             raise Exception("Not authorized")
 
-    def validate_token(self) -> bool:
-        if self.token is None:
+    def group_members(self, group_id: str) -> list[str]:
+        # ids of the patients in the group, for splitting an export by patient
+        self.reauthorize()
+        if self.token and self.token.access_token:
+            response = self._request(
+                "GET",
+                **FHIRRequest(self.base_url).group(
+                    token=self.token.access_token, group_id=group_id
+                ),
+            )
+            if response.status_code != 200:
+                raise Exception(
+                    f"Reading group failed with status code {response.status_code}"
+                )
+            members = []
+            for member in FHIRResponse(response, self.codec).json().get("member", []):
+                reference = member.get("entity", {}).get("reference", "")
+                if reference.startswith("Patient/"):
+                    members.append(reference.split("/", 1)[1])
+            return members
+        else:
             raise Exception("Not authorized")
-        if self.token.expires_in and self.token.token_created:
-            # if token expires in less than 5 seconds raise token expired exception
-            if self.token.token_created + self.token.expires_in < time.time() + 5:
-                raise TokenExpired("Token expired")
-        return True
 
-    def wait_for_export(self, job: ExportJob) -> Manifest:
+    def _export_patients(
+        self, group_id: str, patients: list[str], params: dict[str, str]
+    ) -> ExportJob:
+        self.reauthorize()
+        if self.token and self.token.access_token:
+            response = self._request(
+                "POST",
+                **FHIRRequest(self.base_url).export_patients(
+                    token=self.token.access_token,
+                    group_id=group_id,
+                    patients=patients,
+                    params=params,
+                ),
+                retry_policy=kickoff_policy(self.retry_policy),
+                timeout=500,
+            )
+            if response.status_code != 202:
+                self._response_error("POST", response)
+                raise Exception(f"Job not started, status code {response.status_code}")
+            job = FHIRResponse(response, self.codec).ExportJob()
+            self.hooks.export_started(group_id, job.content_location)
+            return job
+        else:
+            raise Exception("Not authorized")
+
+    def split_export(
+        self,
+        group_id: str,
+        params: Optional[dict[str, str]] = None,
+        by: str = "type",
+        types: Optional[list[str]] = None,
+        types_per_job: int = 4,
+        patients_per_job: int = 1000,
+        since: Optional[str] = None,
+        full_refresh: bool = False,
+        max_workers: int = 4,
+    ) -> list[ExportJob]:
+        # kicks off one logical export as several jobs, either one per
+        # types_per_job resource types (defaulting to the types of the
+        # scopes) or one per patients_per_job group members, so the server
+        # prepares them side by side
+        params = self.export_params(group_id, params, since, full_refresh)
+        if by == "type":
+            if types is None:
+                if "_type" in params:
+                    types = [t.strip() for t in params["_type"].split(",")]
+                else:
+                    types = resource_types(self.scopes)
+            if not types:
+                raise Exception("No resource types to split the export by")
+            kickoffs = [
+                lambda chunk=chunk: self.export(
+                    group_id,
+                    params={**params, "_type": ",".join(chunk)},
+                    full_refresh=True,
+                )
+                for chunk in _chunks(types, types_per_job)
+            ]
+        elif by == "patient":
+            patients = self.group_members(group_id)
+            if not patients:
+                raise Exception(f"Group {group_id} has no patient members")
+            kickoffs = [
+                lambda chunk=chunk: self._export_patients(group_id, chunk, params)
+                for chunk in _chunks(patients, patients_per_job)
+            ]
+        else:
+            raise ValueError(f"Unknown split {by}, expected type or patient")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda kickoff: kickoff(), kickoffs))
+
+    def wait_for_exports(
+        self,
+        jobs: list[ExportJob],
+        policy: Optional[PollPolicy] = None,
+        request: str = "",
+    ) -> Manifest:
+        # every job is polled on its own thread, the manifests are merged in
+        # job order once all of them are complete
+        if not jobs:
+            raise Exception("No export jobs to wait for")
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            manifests = list(
+                executor.map(lambda job: self.wait_for_export(job, policy), jobs)
+            )
+        return merge_manifests(manifests, request=request)
+
+    def export_split(
+        self,
+        group_id: str,
+        params: Optional[dict[str, str]] = None,
+        by: str = "type",
+        policy: Optional[PollPolicy] = None,
+        **kwargs,
+    ) -> Manifest:
+        jobs = self.split_export(group_id, params=params, by=by, **kwargs)
+        request = FHIRRequest(self.base_url).export(
+            token="", group_id=group_id, params=params
+        )["url"]
+        return self.wait_for_exports(jobs, policy=policy, request=request)
+
+    def validate_token(self) -> bool:
+        return validate_token(self.token)
+
+    def wait_for_export(
+        self,
+        job: ExportJob,
+        policy: Optional[PollPolicy] = None,
+        progress: Optional[ExportProgress] = None,
+    ) -> Manifest:
+        # progress is updated in place on every poll so callers can read the
+        # percent complete and eta while waiting
         if self.token is None:
             raise Exception("Not authorized")
         if self.token.access_token is None:
             raise Exception("Not authorized")
-        timeout = time.time() + 60 * 10  # 10 minutes from now timeout
+        poller = ExportPoller(policy or PollPolicy(), job.retry_after, progress)
+        start = time.perf_counter()
         while True:
-            if time.time() > timeout:
+            if poller.expired():
                 raise Exception("Timed out waiting for export to finish")
             self.reauthorize()
-            response = requests.get(
+            response = self._request(
+                "GET",
                 **FHIRRequest.export_job_status(
                     content_locaion=job.content_location,
                     client_assertion=self.token.access_token,
-                )
+                ),
             )
-            if response.headers.get("X-Progress"):
-                percent_complete = response.headers.get("X-Progress").split("%")[0]
-                print(f"Percent complete: {percent_complete}")
             if response.status_code == 200:
-                manifest = FHIRResponse(response).Manifest()
+                manifest = FHIRResponse(response, self.codec).Manifest()
+                self.hooks.export_polled(
+                    job.content_location, 200, poller.progress.percent, None
+                )
+                self.hooks.export_completed(
+                    job.content_location,
+                    time.perf_counter() - start,
+                    len(manifest.output),
+                )
                 return manifest
+            elif response.status_code != 202:
+                # expired or deleted jobs (404, 410) and errors left after
+                # the retries never complete, polling on would only time out
+                self._response_error("GET", response)
+                if response.status_code in (404, 410):
+                    raise ExportExpired(
+                        f"Export job {job.content_location} is gone, "
+                        f"status code {response.status_code}"
+                    )
+                raise Exception(
+                    f"Export status failed with status code {response.status_code}"
+                )
             else:
-                time.sleep(job.retry_after)
+                delay = poller.next_delay(response.headers)
+                self.hooks.export_polled(
+                    job.content_location,
+                    response.status_code,
+                    poller.progress.percent,
+                    delay,
+                )
+                time.sleep(delay)
 
     def reauthorize(self):
+        if self.token_cache is not None:
+            # the cache refreshes ahead of expiry, once for all its users
+            self.authorize()
+            return
         try:
             self.validate_token()
         except TokenExpired:
             self.authorize()
 
-    def download_file(self, url: str, type: str) -> FHIRData:
-        self.validate_token()
+    def download_file(
+        self,
+        url: str,
+        type: str,
+        lazy: bool = False,
+    ) -> FHIRData:
+        self.reauthorize()
         if self.token and self.token.access_token:
-            response = requests.get(
+            start = time.perf_counter()
+            response = self._request(
+                "GET",
                 **FHIRRequest.download_file(
                     url=url, client_assertion=self.token.access_token
-                )
+                ),
             )
+            if response.status_code != 200:
+                raise Exception(
+                    f"Download failed with status code {response.status_code}"
+                )
 
-            json_objects = []
-            for line in response.text.splitlines():
-                json_objects.append(json.loads(line))
+            # content codings are decoded by requests, .ndjson.gz files here
+            content = decompress(response.content)
+            json_objects: Sequence
+            if lazy:
+                json_objects = NDJSONContent(content, self.codec)
+            else:
+                json_objects = self.codec.loads_lines(content)
+            self.hooks.file_downloaded(
+                url,
+                type,
+                len(response.content),
+                time.perf_counter() - start,
+                len(json_objects),
+            )
 
             return FHIRData(content=json_objects, type=type, url=url)
         else:
             raise Exception("Not authorized")
+
+    def download_tables(self, url: str, decoder: "ParallelDecoder") -> Iterator:
+        # decodes the file on the decoder's process pool, with the decoder's
+        # default arrow output the batches come back as pyarrow tables
+        self.reauthorize()
+        if not (self.token and self.token.access_token):
+            raise Exception("Not authorized")
+        response = self._request(
+            "GET",
+            **FHIRRequest.download_file(
+                url=url, client_assertion=self.token.access_token
+            ),
+        )
+        if response.status_code != 200:
+            raise Exception(f"Download failed with status code {response.status_code}")
+        # content codings are decoded by requests, .ndjson.gz files here
+        yield from decoder.map_bytes(decompress(response.content))
+
+    def iter_resources(
+        self, url: str, type: str, chunk_size: int = 1024 * 1024
+    ) -> Iterator[dict]:
+        # streams the ndjson body, memory is bounded by chunk_size not the file size
+        self.reauthorize()
+        if self.token and self.token.access_token:
+            start = time.perf_counter()
+            with self._request(
+                "GET",
+                **FHIRRequest.download_file(
+                    url=url, client_assertion=self.token.access_token
+                ),
+                stream=True,
+            ) as response:
+                if response.status_code != 200:
+                    raise Exception(
+                        f"Download failed with status code {response.status_code}"
+                    )
+                nbytes = resources = 0
+
+                def chunks() -> Iterator[bytes]:
+                    nonlocal nbytes
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        nbytes += len(chunk)
+                        yield chunk
+
+                for resource in iter_ndjson(iter_decompressed(chunks()), self.codec):
+                    resources += 1
+                    yield resource
+            self.hooks.file_downloaded(
+                url, type, nbytes, time.perf_counter() - start, resources
+            )
+        else:
+            raise Exception("Not authorized")
+
+    def iter_batches(
+        self, url: str, type: str, batch_size: int = 10000
+    ) -> Iterator[FHIRData]:
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        batch = []
+        for resource in self.iter_resources(url, type):
+            batch.append(resource)
+            if len(batch) == batch_size:
+                yield FHIRData(content=batch, type=type, url=url)
+                batch = []
+        if batch:
+            yield FHIRData(content=batch, type=type, url=url)
+
+    def download_manifest(
+        self,
+        manifest: Manifest,
+        max_workers: int = 4,
+        per_host_limit: Optional[int] = None,
+        file_attempts: int = 2,
+        probe_sizes: bool = False,
+    ) -> Iterator[DownloadResult]:
+        # results are yielded in completion order, a failed file is reported
+        # on its own result and does not stop the remaining downloads. every
+        # file gets file_attempts tries on top of the per request retries.
+        # files are started largest first, probe_sizes learns their sizes
+        if probe_sizes:
+            self.probe_sizes(manifest, max_workers=max_workers)
+        host_semaphores: dict[str, threading.Semaphore] = {}
+        host_lock = threading.Lock()
+
+        def host_semaphore(url: str) -> threading.Semaphore | None:
+            if per_host_limit is None:
+                return None
+            host = urlsplit(url).netloc
+            with host_lock:
+                if host not in host_semaphores:
+                    host_semaphores[host] = threading.Semaphore(per_host_limit)
+                return host_semaphores[host]
+
+        def download(output: dict[str, str]) -> DownloadResult:
+            return self._download_result(
+                output["url"],
+                output["type"],
+                host_semaphore(output["url"]),
+                file_attempts,
+            )
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = [
+                executor.submit(download, output) for output in manifest.largest_first()
+            ]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def probe_sizes(self, manifest: Manifest, max_workers: int = 8) -> dict[str, int]:
+        # HEAD requests for the Content-Length of every output file not yet
+        # in manifest.sizes. sizes only order downloads, so a failed probe
+        # leaves the file unsized instead of raising
+        def probe(url: str) -> Optional[int]:
+            self.reauthorize()
+            if not (self.token and self.token.access_token):
+                raise Exception("Not authorized")
+            kwargs = FHIRRequest.download_file(
+                url=url, client_assertion=self.token.access_token
+            )
+            # the size of the file itself, not of a compressed transfer
+            kwargs["headers"]["Accept-Encoding"] = "identity"
+            try:
+                response = self._request("HEAD", **kwargs)
+            except requests.RequestException:
+                return None
+            length = response.headers.get("Content-Length")
+            if response.status_code != 200 or not (length and length.isdigit()):
+                return None
+            return int(length)
+
+        urls = [
+            output["url"]
+            for output in manifest.output
+            if output["url"] not in manifest.sizes
+        ]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for url, size in zip(urls, executor.map(probe, urls)):
+                if size is not None:
+                    manifest.sizes[url] = size
+        return manifest.sizes
+
+    def _download_result(
+        self,
+        url: str,
+        type: str,
+        semaphore: Optional[threading.Semaphore],
+        attempts: int,
+    ) -> DownloadResult:
+        for attempt in range(1, attempts + 1):
+            try:
+                if semaphore is None:
+                    data = self.download_file(url=url, type=type)
+                else:
+                    with semaphore:
+                        data = self.download_file(url=url, type=type)
+                return DownloadResult(url=url, type=type, data=data)
+            except Exception as e:
+                if attempt >= attempts:
+                    return DownloadResult(url=url, type=type, error=e)
+                time.sleep(self.retry_policy.delay(attempt))
+        raise ValueError("attempts must be at least 1")
+
+    def download_file_to(
+        self,
+        url: str,
+        path: str,
+        chunk_size: int = 1024 * 1024,
+        max_resumes: int = 3,
+        compression: Optional[str] = None,
+    ) -> DownloadedFile:
+        # bytes are written to a .part file and renamed into place once the
+        # download is complete. a .part file left by an earlier run is resumed
+        # if its source, saved next to it, is the same url
+        if compression is not None:
+            return self._download_compressed(
+                url, path, compression, chunk_size, max_resumes
+            )
+        part_path = f"{path}.part"
+        source_path = f"{part_path}.json"
+        source = _load_file_source(source_path)
+        sha256 = None
+        if os.path.exists(part_path) and source and source.get("url") == url:
+            sha256 = hash_file(part_path)
+        resumes = 0
+        start = time.perf_counter()
+        while True:
+            offset = os.path.getsize(part_path) if sha256 is not None else 0
+            try:
+                result = self._download_part(url, part_path, offset, sha256, chunk_size)
+                if result is not None:
+                    sha256 = result
+                    break
+                # the server answered with other bytes, start over
+                sha256 = None
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+            ):
+                resumes += 1
+                if resumes > max_resumes:
+                    raise
+                # the attempt may have restarted the file, rehash what is on disk
+                sha256 = hash_file(part_path) if os.path.exists(part_path) else None
+
+        size = os.path.getsize(part_path)
+        os.replace(part_path, path)
+        if os.path.exists(source_path):
+            os.remove(source_path)
+        self.hooks.file_downloaded(url, None, size, time.perf_counter() - start, None)
+        return DownloadedFile(url=url, path=path, size=size, sha256=sha256.hexdigest())
+
+    def _download_part(
+        self,
+        url: str,
+        part_path: str,
+        offset: int,
+        sha256: Optional["hashlib._Hash"],
+        chunk_size: int,
+    ) -> Optional["hashlib._Hash"]:
+        # returns None when a resumed response doesn't continue the .part file
+        self.reauthorize()
+        if not (self.token and self.token.access_token):
+            raise Exception("Not authorized")
+        source_path = f"{part_path}.json"
+        source = (_load_file_source(source_path) or {}) if offset else {}
+        kwargs = FHIRRequest.download_file(
+            url=url,
+            client_assertion=self.token.access_token,
+            offset=offset,
+            if_range=_if_range(source),
+        )
+        # byte offsets only line up with the file on disk without content coding
+        kwargs["headers"]["Accept-Encoding"] = "identity"
+        with self._request("GET", **kwargs, stream=True) as response:
+            if response.status_code == 416 and offset and sha256 is not None:
+                # the .part file already holds the whole file
+                return sha256
+            if response.status_code == 206 and offset and sha256 is not None:
+                content_range = response.headers.get("Content-Range", "")
+                etag = response.headers.get("ETag")
+                if not content_range.startswith(f"bytes {offset}-") or (
+                    etag and source.get("etag") and etag != source["etag"]
+                ):
+                    os.remove(part_path)
+                    return None
+                mode = "ab"
+            elif response.status_code == 200:
+                # server ignored the range request or the file changed, start over
+                mode, sha256 = "wb", hashlib.sha256()
+                with open(source_path, "w") as f:
+                    json.dump(_file_source(url, response), f)
+            elif response.status_code in (404, 410):
+                raise ExportExpired(
+                    f"Export file {url} is gone, status code {response.status_code}"
+                )
+            else:
+                raise Exception(
+                    f"Download failed with status code {response.status_code}"
+                )
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    sha256.update(chunk)
+        return sha256
+
+    def _download_compressed(
+        self,
+        url: str,
+        path: str,
+        compression: str,
+        chunk_size: int,
+        max_resumes: int,
+    ) -> DownloadedFile:
+        # writes a gzip or zstd file, byte offsets of a compressed stream
+        # can't be resumed so a dropped connection restarts the file
+        part_path = f"{path}.part"
+        start = time.perf_counter()
+        resumes = 0
+        while True:
+            try:
+                written = self._write_compressed(
+                    url, part_path, compression, chunk_size
+                )
+                break
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+            ):
+                resumes += 1
+                if resumes > max_resumes:
+                    raise
+        os.replace(part_path, path)
+        self.hooks.file_downloaded(
+            url, None, written.size, time.perf_counter() - start, None
+        )
+        return DownloadedFile(
+            url=url, path=path, size=written.size, sha256=written.sha256.hexdigest()
+        )
+
+    def _write_compressed(
+        self, url: str, part_path: str, compression: str, chunk_size: int
+    ) -> HashingWriter:
+        self.reauthorize()
+        if not (self.token and self.token.access_token):
+            raise Exception("Not authorized")
+        kwargs = FHIRRequest.download_file(
+            url=url, client_assertion=self.token.access_token
+        )
+        if compression == "gzip":
+            # a gzip coded body can then be written as is
+            kwargs["headers"]["Accept-Encoding"] = "gzip"
+        with self._request("GET", **kwargs, stream=True) as response:
+            if response.status_code in (404, 410):
+                raise ExportExpired(
+                    f"Export file {url} is gone, status code {response.status_code}"
+                )
+            if response.status_code != 200:
+                raise Exception(
+                    f"Download failed with status code {response.status_code}"
+                )
+            encoding = response.headers.get("Content-Encoding", "").strip().lower()
+            if compression == "gzip" and encoding == "gzip":
+                chunks = response.raw.stream(chunk_size, decode_content=False)
+                passthrough = True
+            else:
+                chunks = response.iter_content(chunk_size=chunk_size)
+                first = next(chunks, b"")
+                chunks = itertools.chain([first], chunks)
+                # .ndjson.gz output files are already what we want to write
+                passthrough = compression == "gzip" and is_gzip(first)
+                if not passthrough:
+                    chunks = iter_decompressed(chunks)
+            with open(part_path, "wb") as f:
+                written = HashingWriter(f)
+                if passthrough:
+                    for chunk in chunks:
+                        written.write(chunk)
+                else:
+                    with compressing_writer(written, compression) as writer:
+                        for chunk in chunks:
+                            writer.write(chunk)
+        return written
+
+    def resumable_export(
+        self,
+        group_id: str,
+        directory: str,
+        checkpoint: "CheckpointStore",
+        params: Optional[dict[str, str]] = None,
+        max_workers: int = 4,
+        since: Optional[str] = None,
+        full_refresh: bool = False,
+        probe_sizes: bool = False,
+    ) -> list[DownloadedFile]:
+        # every step is recorded in the checkpoint store so a rerun picks up
+        # polling or downloading where the last run stopped. the _since is
+        # resolved up front so it is part of the checkpoint key
+        params = self.export_params(group_id, params, since, full_refresh)
+        key = FHIRRequest(self.base_url).export(
+            token="", group_id=group_id, params=params
+        )["url"]
+        state = checkpoint.load(key)
+        if state is not None and state.job is not None:
+            try:
+                return self._checkpointed_export(
+                    group_id,
+                    directory,
+                    checkpoint,
+                    key,
+                    params,
+                    state,
+                    max_workers,
+                    probe_sizes,
+                )
+            except ExportExpired:
+                # the server dropped the job or its files since the last run,
+                # its checkpoint can't finish, start a new export
+                checkpoint.delete(key)
+        return self._checkpointed_export(
+            group_id,
+            directory,
+            checkpoint,
+            key,
+            params,
+            None,
+            max_workers,
+            probe_sizes,
+        )
+
+    def _checkpointed_export(
+        self,
+        group_id: str,
+        directory: str,
+        checkpoint: "CheckpointStore",
+        key: str,
+        params: dict[str, str],
+        state: Optional["ExportCheckpoint"],
+        max_workers: int,
+        probe_sizes: bool,
+    ) -> list[DownloadedFile]:
+        job = state.job if state else None
+        manifest = state.manifest if state else None
+        completed = dict(state.files) if state else {}
+
+        if job is None:
+            # params already carry the resolved _since
+            job = self.export(group_id=group_id, params=params, full_refresh=True)
+            checkpoint.save_job(key, job)
+        if manifest is None:
+            manifest = self.wait_for_export(job)
+            if probe_sizes:
+                # saved with the manifest so a rerun keeps the order
+                self.probe_sizes(manifest, max_workers=max_workers)
+            checkpoint.save_manifest(key, manifest)
+
+        os.makedirs(directory, exist_ok=True)
+        # file names keep the manifest index, downloads start largest first
+        indexes = {output["url"]: index for index, output in enumerate(manifest.output)}
+        pending = [
+            (indexes[output["url"]], output)
+            for output in manifest.largest_first()
+            if output["url"] not in completed
+        ]
+
+        def download(index: int, output: dict[str, str]) -> DownloadedFile:
+            path = os.path.join(directory, f"{output['type']}.{index}.ndjson")
+            downloaded = self.download_file_to(output["url"], path)
+            checkpoint.save_file(key, downloaded)
+            return downloaded
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(download, *item) for item in pending]
+            for future in as_completed(futures):
+                downloaded = future.result()
+                completed[downloaded.url] = downloaded
+
+        self.record_export(group_id, manifest, params)
+        # the export is finished, a later run with the same key starts over
+        checkpoint.delete(key)
+        return [completed[output["url"]] for output in manifest.output]
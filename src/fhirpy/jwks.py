@@ -1,18 +1,138 @@
 import json
+import re
+import threading
 import time
 import uuid
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Optional, Sequence
 
 import requests
 from jwcrypto.jwk import JWK, JWKSet
 from jwcrypto.jwt import JWT
 
 
+class JWKSetCache:
+    # keeps the JWK Set from a jku in memory, honoring Cache-Control max-age and
+    # revalidating with ETag; an unknown kid triggers at most one refetch per
+    # min_refetch_interval so a bad token can't be used to flood the jku
+    def __init__(
+        self,
+        jku: str,
+        ttl: float = 300,
+        min_refetch_interval: float = 30,
+        session: Optional[requests.Session] = None,
+    ):
+        self.jku = jku
+        self.ttl = ttl
+        self.min_refetch_interval = min_refetch_interval
+        self.session = session or requests.Session()
+        self._jwk_set: JWKSet | None = None
+        self._keys: dict[str, JWK] = {}
+        self._etag: str | None = None
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def _max_age(self, cache_control: str | None) -> float:
+        if not cache_control:
+            return self.ttl
+        if "no-store" in cache_control or "no-cache" in cache_control:
+            return 0
+        match = re.search(r"max-age=(\d+)", cache_control)
+        return float(match.group(1)) if match else self.ttl
+
+    def refresh(self):
+        with self._refresh_lock:
+            self._fetch()
+
+    def _fetch(self):
+        # the request runs outside _lock so validations keep reading the
+        # cached set meanwhile, _refresh_lock keeps it to one fetch at a time
+        with self._lock:
+            etag, cached = self._etag, self._jwk_set is not None
+        headers = {"If-None-Match": etag} if etag else {}
+        response = self.session.get(self.jku, headers=headers, timeout=5)
+        now = time.time()
+        max_age = self._max_age(response.headers.get("Cache-Control"))
+        if response.status_code == 304 and cached:
+            with self._lock:
+                self._fetched_at = now
+                self._expires_at = now + max_age
+            return
+        if response.status_code != 200:
+            with self._lock:
+                self._fetched_at = now
+            raise Exception(f"Getting JWK Set failed with {response.status_code}")
+
+        jwk_set = JWKSet.from_json(response.text)
+        keys = {key["kid"]: key for key in jwk_set if key.get("kid")}
+        with self._lock:
+            self._keys = keys
+            self._jwk_set = jwk_set
+            self._etag = response.headers.get("ETag")
+            self._fetched_at = now
+            self._expires_at = now + max_age
+
+    def _stale(self) -> bool:
+        with self._lock:
+            return self._jwk_set is None or time.time() >= self._expires_at
+
+    def _refresh_if_stale(self):
+        if not self._stale():
+            return
+        # only block when nothing is cached yet, otherwise a refresh already
+        # in flight is left to finish and the cached set is used meanwhile
+        with self._lock:
+            blocking = self._jwk_set is None
+        if not self._refresh_lock.acquire(blocking=blocking):
+            return
+        try:
+            if self._stale():
+                self._fetch()
+        finally:
+            self._refresh_lock.release()
+
+    def jwk_set(self) -> JWKSet:
+        self._refresh_if_stale()
+        with self._lock:
+            return self._jwk_set
+
+    def get_key(self, kid: str) -> JWK | None:
+        self._refresh_if_stale()
+        with self._lock:
+            key, fetched_at = self._keys.get(kid), self._fetched_at
+        if key is None and time.time() - fetched_at >= self.min_refetch_interval:
+            # the key set may have been rotated since the last fetch
+            with self._refresh_lock:
+                # unless another thread refetched while we waited
+                if self._fetched_at == fetched_at:
+                    self._fetch()
+            with self._lock:
+                key = self._keys.get(kid)
+        return key
+
+
+_jwk_set_caches: dict[str, JWKSetCache] = {}
+_jwk_set_caches_lock = threading.Lock()
+
+
+def get_jwk_set_cache(jku: str) -> JWKSetCache:
+    # one cache per jku shared by every JWKS in the process
+    with _jwk_set_caches_lock:
+        if jku not in _jwk_set_caches:
+            _jwk_set_caches[jku] = JWKSetCache(jku)
+        return _jwk_set_caches[jku]
+
+
 @dataclass(frozen=True)
 class JWKS:
     client_id: str
     jku: str
     json_key: str
+    jwk_set_cache: Optional[JWKSetCache] = field(
+        default=None, compare=False, repr=False
+    )
 
     def get_jwt(self, token_endpoint: str, timeout: int = 5) -> str:
         key = self.get_key(self.json_key)
@@ -35,17 +155,17 @@ class JWKS:
         token.make_signed_token(key)
         return token.serialize()
 
-    def validate(self, jwt_token: dict) -> JWT:
-        jwks_response = requests.get(self.jku)
-        jwks_data = jwks_response.json()
-        jwk_set = JWKSet.from_json(json.dumps(jwks_data))
+    def validate(self, jwt_token: str, algorithms: Sequence[str] = ("ES384",)) -> JWT:
+        jwk_set_cache = self.jwk_set_cache or get_jwk_set_cache(self.jku)
 
         try:
-            jwt = JWT()
+            jwt = JWT(algs=list(algorithms))  # Specify the algorithm used for signing
             jwt.deserialize(jwt_token)
-            jwt.verify(
-                jwk_set, algorithms=["ES384"]
-            )  # Specify the algorithm used for signing
+            kid = jwt.token.jose_header.get("kid")
+            key = jwk_set_cache.get_key(kid) if kid else jwk_set_cache.jwk_set()
+            if key is None:
+                raise Exception(f"Unknown key id {kid}")
+            jwt.validate(key)
 
             # If verification is successful, you can access the JWT claims
             claims = jwt.claims
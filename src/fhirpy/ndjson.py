@@ -0,0 +1,89 @@
+import mmap
+from array import array
+from typing import Any, Iterator, Optional, Sequence, Union, overload
+
+from .codec import JSONCodec, get_codec
+
+WHITESPACE = frozenset(b" \t\r\n")
+
+
+class NDJSONContent(Sequence):
+    # keeps the raw ndjson bytes plus the start and end offset of every line,
+    # resources are decoded from a memoryview slice only when accessed, so a
+    # file costs its own size plus 16 bytes per line instead of a dict tree
+    def __init__(
+        self,
+        data: Union[bytes, bytearray, mmap.mmap],
+        codec: Optional[JSONCodec] = None,
+        starts: Optional[array] = None,
+        ends: Optional[array] = None,
+    ):
+        self._data = data
+        self._view = memoryview(data)
+        self.codec = codec or get_codec()
+        if starts is None or ends is None:
+            starts, ends = index_lines(data)
+        self._starts = starts
+        self._ends = ends
+
+    @classmethod
+    def from_file(cls, path: str, codec: Optional[JSONCodec] = None) -> "NDJSONContent":
+        # memory maps the file so only the pages that are read get loaded
+        with open(path, "rb") as f:
+            if not f.seek(0, 2):
+                return cls(b"", codec)
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(data, codec)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    @overload
+    def __getitem__(self, index: int) -> Any: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "NDJSONContent": ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            # slices share the buffer, only the offsets are copied
+            return NDJSONContent(
+                self._data, self.codec, self._starts[index], self._ends[index]
+            )
+        return self.codec.loads(self.raw(index))
+
+    def raw(self, index: int) -> memoryview:
+        return self._view[self._starts[index] : self._ends[index]]
+
+    def lines(self) -> Iterator[memoryview]:
+        # the undecoded lines, for counting or forwarding resources as is
+        view = self._view
+        for start, end in zip(self._starts, self._ends):
+            yield view[start:end]
+
+    def __iter__(self) -> Iterator[Any]:
+        loads = self.codec.loads
+        for line in self.lines():
+            yield loads(line)
+
+    def __repr__(self):
+        return f"NDJSONContent({len(self)} resources, {len(self._view)} bytes)"
+
+
+def index_lines(data: Union[bytes, bytearray, mmap.mmap]) -> tuple[array, array]:
+    # start and (exclusive) end offset of every non blank line
+    starts, ends = array("Q"), array("Q")
+    size = len(data)
+    start = 0
+    while start < size:
+        end = data.find(b"\n", start)
+        if end == -1:
+            end = size
+        line_end = end - 1 if end > start and data[end - 1] == 13 else end  # \r
+        if line_end > start and (
+            data[start] not in WHITESPACE or data[start:line_end].strip()
+        ):
+            starts.append(start)
+            ends.append(line_end)
+        start = end + 1
+    return starts, ends
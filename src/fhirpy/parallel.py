@@ -0,0 +1,233 @@
+import os
+import sys
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Callable, Iterator, Optional, cast
+
+from .codec import JSONCodec, get_codec
+from .compression import decompress, is_gzip
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover
+    pa = None
+
+# decodes ndjson on all cores. the input is split into line aligned byte
+# ranges and every range is decoded (and optionally transformed) in a worker
+# process. workers read their range straight from the file, or from a shared
+# memory copy of an in memory body, so only offsets are sent to them. batches
+# come back as arrow ipc buffers, which pickle as a few large buffers instead
+# of one object per value. output="dicts" is the slow fallback for code that
+# needs dicts: every dict is pickled in the worker and rebuilt in the parent,
+# which costs about as much as decoding the json there, so it only pays off
+# with a heavy transform.
+#
+#   with ParallelDecoder(transform=flatten) as decoder:
+#       for table in decoder.map_file("Observation.000.ndjson"):
+#           ...
+
+OUTPUTS = ("dicts", "arrow")
+
+
+def split_lines(data: bytes, chunk_size: int) -> list[tuple[int, int]]:
+    # (start, end) ranges of about chunk_size bytes that end after a newline
+    ranges = []
+    start, size = 0, len(data)
+    while start < size:
+        end = data.find(b"\n", start + chunk_size) if start + chunk_size < size else -1
+        end = size if end == -1 else end + 1
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def split_file(path: str, chunk_size: int) -> list[tuple[int, int]]:
+    ranges = []
+    with open(path, "rb") as f:
+        size = f.seek(0, 2)
+        start = 0
+        while start < size:
+            end = start + chunk_size
+            if end >= size:
+                end = size
+            else:
+                # finish the line the range ends in
+                f.seek(end)
+                end += len(f.readline())
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _decode(
+    data: bytes,
+    codec: str,
+    transform: Optional[Callable[[dict], Any]],
+    output: str,
+    schema: Optional["pa.Schema"],
+):
+    resources = get_codec(codec).loads_lines(data)
+    if transform is not None:
+        resources = [transform(resource) for resource in resources]
+    if output == "dicts":
+        return resources
+    table = pa.Table.from_pylist(resources, schema=schema)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def _decode_file(path: str, start: int, end: int, *args):
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return _decode(data, *args)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # workers share the parent's resource tracker (see executor), so the
+    # registration made by attaching is the parent's and its unlink clears it
+    return shared_memory.SharedMemory(name=name)
+
+
+def _decode_shared(name: str, start: int, end: int, *args):
+    memory = _attach(name)
+    try:
+        # buf is only None once the block is closed
+        data = bytes(cast(memoryview, memory.buf)[start:end])
+    finally:
+        memory.close()
+    return _decode(data, *args)
+
+
+class ParallelDecoder:
+    # max_workers defaults to the number of cores. transform runs in the
+    # workers so it must be picklable, i.e. a module level function. the
+    # batches are pyarrow tables, pass schema to skip inference (and
+    # transform to make the resources match it), or lists of dicts with
+    # output="dicts", see above
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        codec: str | JSONCodec = "auto",
+        chunk_size: int = 16 * 1024 * 1024,
+        transform: Optional[Callable[[dict], Any]] = None,
+        output: str = "arrow",
+        schema: Optional["pa.Schema"] = None,
+    ):
+        if output not in OUTPUTS:
+            raise ValueError(f"Unknown output {output}, expected one of {OUTPUTS}")
+        if output == "arrow" and pa is None:
+            raise ImportError(
+                'arrow output requires pyarrow to be installed, or use output="dicts"'
+            )
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # workers build their own codec from its name
+        self.codec = get_codec(codec).name
+        self.chunk_size = chunk_size
+        self.transform = transform
+        self.output = output
+        self.schema = schema
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # started before the workers so they inherit it instead of each
+            # starting a tracker that would unlink the shared memory blocks
+            # they attached to when it exits
+            resource_tracker.ensure_running()
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _result(self, future: Future):
+        result = future.result()
+        if self.output == "arrow":
+            return pa.ipc.open_stream(result).read_all()
+        return result
+
+    def _run(
+        self,
+        function: Callable,
+        source: str,
+        ranges: list[tuple[int, int]],
+        ordered: bool,
+    ) -> Iterator:
+        # keeps at most two ranges per worker in flight, so memory stays
+        # bounded when the consumer is slower than the pool
+        limit = self.max_workers * 2
+        args = (self.codec, self.transform, self.output, self.schema)
+        pending: deque[Future] = deque()
+        try:
+            for start, end in ranges:
+                pending.append(
+                    self.executor.submit(function, source, start, end, *args)
+                )
+                if len(pending) >= limit:
+                    yield from self._collect(pending, ordered)
+            while pending:
+                yield from self._collect(pending, ordered)
+        finally:
+            # the consumer stopped early, let running ranges finish before
+            # their input goes away
+            for future in pending:
+                future.cancel()
+            wait(pending)
+
+    def _collect(self, pending: deque[Future], ordered: bool) -> Iterator:
+        if ordered:
+            yield self._result(pending.popleft())
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.remove(future)
+            yield self._result(future)
+
+    def map_file(self, path: str, ordered: bool = True) -> Iterator:
+        # one batch per range, in file order unless ordered is False
+        with open(path, "rb") as f:
+            compressed = is_gzip(f.read(2))
+        if compressed:
+            # gzip has no random access, decompress once and share the bytes
+            with open(path, "rb") as f:
+                yield from self.map_bytes(decompress(f.read()), ordered)
+            return
+        yield from self._run(
+            _decode_file, path, split_file(path, self.chunk_size), ordered
+        )
+
+    def map_bytes(self, data: bytes, ordered: bool = True) -> Iterator:
+        if not data:
+            return
+        memory = shared_memory.SharedMemory(create=True, size=len(data))
+        try:
+            cast(memoryview, memory.buf)[: len(data)] = data
+            ranges = split_lines(data, self.chunk_size)
+            yield from self._run(_decode_shared, memory.name, ranges, ordered)
+        finally:
+            memory.close()
+            memory.unlink()
+
+    def decode(self, data: bytes) -> list:
+        # every resource of an in memory body, in order. dicts come back
+        # pickled one by one, use map_bytes with output="arrow" for speed
+        if self.output != "dicts":
+            raise ValueError("decode returns resources, use map_bytes for arrow")
+        return [resource for batch in self.map_bytes(data) for resource in batch]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,223 @@
+import json
+import os
+from typing import Any, Callable, Iterable, Optional
+
+from .codec import JSONCodec, get_codec, iter_ndjson
+from .compression import iter_decompressed
+from .fhir import FHIRData
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+    pq = None
+
+INTEGER_TYPES = {"integer", "positiveInt", "unsignedInt"}
+# columns holding a json encoded value carry this key in their field metadata
+JSON_METADATA = {b"fhir_json": b"1"}
+
+
+class FHIRArrowSchema:
+    # compiles the FHIR R4 json schema (examples/epic/fhir_r4_schema.json)
+    # into one fixed arrow schema per resource type, so every file of a type
+    # is written with the same columns whatever subset of fields it contains.
+    # choice types are separate properties (valueQuantity, valueString, ...)
+    # in the json schema and become separate struct fields. Elements nested
+    # deeper than max_depth, contained resources and, unless asked for,
+    # extensions are kept as json strings instead of recursing forever.
+    def __init__(
+        self,
+        schema: dict,
+        max_depth: int = 4,
+        expand_extensions: bool = False,
+        primitive_extensions: bool = False,
+    ):
+        if pa is None:
+            raise ImportError("FHIRArrowSchema requires pyarrow to be installed")
+        self.definitions = schema["definitions"]
+        self.max_depth = max_depth
+        self.expand_extensions = expand_extensions
+        self.primitive_extensions = primitive_extensions
+        # inline choice type primitives (valueInteger, ...) only carry the
+        # pattern of their primitive type
+        self._primitive_patterns = {
+            definition["pattern"]: name
+            for name, definition in self.definitions.items()
+            if "pattern" in definition and "properties" not in definition
+        }
+        self._schemas: dict[str, "pa.Schema"] = {}
+        self._converters: dict[str, Callable[[dict], dict]] = {}
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "FHIRArrowSchema":
+        with open(path) as f:
+            return cls(json.load(f), **kwargs)
+
+    def resource_schema(self, resource_type: str) -> "pa.Schema":
+        if resource_type not in self._schemas:
+            if resource_type not in self.definitions:
+                raise ValueError(f"Unknown resource type {resource_type}")
+            struct = self._definition_type(resource_type, depth=0)
+            self._schemas[resource_type] = pa.schema(list(struct))
+        return self._schemas[resource_type]
+
+    def _definition_type(self, name: str, depth: int) -> "pa.DataType":
+        definition = self.definitions[name]
+        if "properties" not in definition:
+            if name == "ResourceList":
+                return pa.string()
+            return self._primitive_type(name, definition.get("type"))
+        fields = []
+        for property_name, prop in definition["properties"].items():
+            if property_name.startswith("_") and not self.primitive_extensions:
+                continue
+            fields.append(self._property_field(property_name, prop, depth + 1))
+        return pa.struct(fields)
+
+    def _primitive_type(self, name: str, json_type: Optional[str]) -> "pa.DataType":
+        if json_type == "boolean":
+            return pa.bool_()
+        if json_type == "number":
+            return pa.int64() if name in INTEGER_TYPES else pa.float64()
+        return pa.string()
+
+    def _property_field(self, name: str, prop: dict, depth: int) -> "pa.Field":
+        if prop.get("type") == "array":
+            item = self._property_field(name, prop["items"], depth)
+            return pa.field(name, pa.list_(item.type), metadata=item.metadata)
+        if "$ref" not in prop:
+            # const, enum or an inline primitive with a pattern
+            primitive = self._primitive_patterns.get(prop.get("pattern"), name)
+            return pa.field(name, self._primitive_type(primitive, prop.get("type")))
+
+        ref = prop["$ref"].split("/")[-1]
+        definition = self.definitions[ref]
+        is_complex = "properties" in definition or ref == "ResourceList"
+        if is_complex and (
+            depth > self.max_depth
+            or ref == "ResourceList"
+            or (ref == "Extension" and not self.expand_extensions)
+        ):
+            return pa.field(name, pa.string(), metadata=JSON_METADATA)
+        return pa.field(name, self._definition_type(ref, depth))
+
+    def converter(self, resource_type: str) -> Callable[[dict], dict]:
+        # returns a function that json encodes the values of json string
+        # columns, the rest of the resource is handed to arrow unchanged
+        if resource_type not in self._converters:
+            schema = self.resource_schema(resource_type)
+            convert = _struct_converter(pa.struct(list(schema)))
+            self._converters[resource_type] = convert or (lambda resource: resource)
+        return self._converters[resource_type]
+
+
+def _is_json(field: "pa.Field") -> bool:
+    return field.metadata is not None and field.metadata.get(b"fhir_json") == b"1"
+
+
+def _field_converter(field: "pa.Field") -> Optional[Callable[[Any], Any]]:
+    if _is_json(field):
+        if pa.types.is_list(field.type):
+            return lambda values: [json.dumps(value) for value in values]
+        return json.dumps
+    if pa.types.is_list(field.type):
+        item = _field_converter(pa.field("item", field.type.value_type))
+        if item is None:
+            return None
+        return lambda values: [item(value) for value in values]
+    if pa.types.is_struct(field.type):
+        return _struct_converter(field.type)
+    return None
+
+
+def _struct_converter(struct: "pa.StructType") -> Optional[Callable[[dict], dict]]:
+    converters = {}
+    for index in range(struct.num_fields):
+        field = struct.field(index)
+        converter = _field_converter(field)
+        if converter is not None:
+            converters[field.name] = converter
+    if not converters:
+        return None
+
+    def convert(value: dict) -> dict:
+        value = dict(value)
+        for name, converter in converters.items():
+            if value.get(name) is not None:
+                value[name] = converter(value[name])
+        return value
+
+    return convert
+
+
+class ParquetWriter:
+    # streams resources into <directory>/<resourceType>.parquet, buffering at
+    # most row_group_size resources per type before writing a row group
+    def __init__(
+        self,
+        directory: str,
+        schema: FHIRArrowSchema,
+        row_group_size: int = 50000,
+        compression: str = "zstd",
+        codec: str | JSONCodec = "auto",
+    ):
+        self.directory = directory
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.codec = get_codec(codec)
+        self._buffers: dict[str, list[dict]] = {}
+        self._writers: dict[str, "pq.ParquetWriter"] = {}
+        self.rows: dict[str, int] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, resource_type: str) -> str:
+        return os.path.join(self.directory, f"{resource_type}.parquet")
+
+    def write(self, resource: dict):
+        resource_type = resource["resourceType"]
+        buffer = self._buffers.setdefault(resource_type, [])
+        buffer.append(self.schema.converter(resource_type)(resource))
+        if len(buffer) >= self.row_group_size:
+            self._flush(resource_type)
+
+    def write_resources(self, resources: Iterable[dict]):
+        for resource in resources:
+            self.write(resource)
+
+    def write_data(self, data: FHIRData):
+        self.write_resources(data.content)
+
+    def write_ndjson(self, path: str, chunk_size: int = 1024 * 1024):
+        with open(path, "rb") as f:
+            # .ndjson.gz files are decompressed on the fly
+            chunks = iter_decompressed(iter(lambda: f.read(chunk_size), b""))
+            self.write_resources(iter_ndjson(chunks, self.codec))
+
+    def _flush(self, resource_type: str):
+        buffer = self._buffers.get(resource_type)
+        if not buffer:
+            return
+        schema = self.schema.resource_schema(resource_type)
+        table = pa.Table.from_pylist(buffer, schema=schema)
+        if resource_type not in self._writers:
+            self._writers[resource_type] = pq.ParquetWriter(
+                self.path(resource_type), schema, compression=self.compression
+            )
+        self._writers[resource_type].write_table(table)
+        self.rows[resource_type] = self.rows.get(resource_type, 0) + len(buffer)
+        self._buffers[resource_type] = []
+
+    def close(self):
+        for resource_type in list(self._buffers):
+            self._flush(resource_type)
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
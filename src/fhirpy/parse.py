@@ -1,12 +1,16 @@
+from .extract import compile_path
+
+# x is the value of a Patient.name element
+_official_name = compile_path("where(use='official').first()")
+
+
 def get_first_name(x):
-    for item in x:
-        if item["use"] == "official":
-            return item["given"]
+    for item in _official_name.evaluate(x):
+        return item.get("given")
     return None
 
 
 def get_last_name(x):
-    for item in x:
-        if item["use"] == "official":
-            return item["family"]
+    for item in _official_name.evaluate(x):
+        return item.get("family")
     return None
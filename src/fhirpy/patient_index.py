@@ -0,0 +1,250 @@
+import hashlib
+import heapq
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import Any, BinaryIO, Iterable, Iterator, Optional
+
+from .codec import JSONCodec, get_codec
+
+# maps every patient to the ndjson lines that reference it. the index is a
+# file of fixed size records (patient id hash, file, byte offset, length)
+# sorted by hash, so a lookup is a binary search over a memory map and only
+# the matching lines are read. ids are hashed to keep records fixed size,
+# lines are checked against the real id when read so collisions never leak.
+#
+#   writer = PatientIndexWriter("patients.idx")
+#   writer.index_file("Observation.0.ndjson")
+#   writer.close()
+#   for resource in PatientIndex("patients.idx").iter_resources("123"): ...
+
+MAGIC = b"FHIRPIX1"
+RECORD = struct.Struct("<QIQI")
+# elements that place a resource in a patient's compartment
+PATIENT_ELEMENTS = ("subject", "patient", "beneficiary")
+
+
+def patient_hash(patient_id: str) -> int:
+    digest = hashlib.blake2b(patient_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _reference_id(reference: Any) -> Optional[str]:
+    if not isinstance(reference, dict):
+        return None
+    value = reference.get("reference") or ""
+    # relative (Patient/1) or absolute (https://.../Patient/1/_history/2)
+    parts = value.split("/")
+    if "Patient" not in parts:
+        return None
+    index = len(parts) - 1 - parts[::-1].index("Patient")
+    return parts[index + 1] if index + 1 < len(parts) else None
+
+
+def patient_ids(resource: dict) -> set[str]:
+    if resource.get("resourceType") == "Patient":
+        return {resource["id"]} if resource.get("id") else set()
+    ids = set()
+    for element in PATIENT_ELEMENTS:
+        values = resource.get(element)
+        for value in values if isinstance(values, list) else [values]:
+            patient_id = _reference_id(value)
+            if patient_id:
+                ids.add(patient_id)
+    return ids
+
+
+class FileIndexer:
+    # indexes one ndjson file from its chunks as they arrive, e.g. while it
+    # is being downloaded, offsets are counted across chunk boundaries
+    def __init__(self, writer: "PatientIndexWriter", file: int):
+        self.writer = writer
+        self.file = file
+        self._pending = b""
+        self._offset = 0
+
+    def feed(self, chunk: bytes):
+        data = self._pending + chunk if self._pending else chunk
+        start = 0
+        end = data.find(b"\n")
+        while end != -1:
+            self.writer.index_line(self.file, self._offset + start, data[start:end])
+            start = end + 1
+            end = data.find(b"\n", start)
+        self._offset += start
+        self._pending = data[start:]
+
+    def close(self):
+        if self._pending:
+            self.writer.index_line(self.file, self._offset, self._pending)
+        self._offset += len(self._pending)
+        self._pending = b""
+
+
+class PatientIndexWriter:
+    # records are sorted in memory in runs of run_size and the runs merged
+    # into the index on close, so the index can be far larger than memory
+    def __init__(
+        self,
+        path: str,
+        codec: str | JSONCodec = "auto",
+        run_size: int = 1_000_000,
+    ):
+        self.path = path
+        self.codec = get_codec(codec)
+        self.run_size = run_size
+        self.files: list[str] = []
+        self._records: list[tuple[int, int, int, int]] = []
+        self._runs: list[str] = []
+
+    def add_file(self, path: str) -> int:
+        if path.endswith(".gz"):
+            raise ValueError(f"{path} is compressed, line offsets need plain ndjson")
+        self.files.append(os.path.abspath(path))
+        return len(self.files) - 1
+
+    def open_file(self, path: str) -> FileIndexer:
+        return FileIndexer(self, self.add_file(path))
+
+    def index_file(self, path: str, chunk_size: int = 1024 * 1024):
+        indexer = self.open_file(path)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                indexer.feed(chunk)
+        indexer.close()
+
+    def index_files(self, paths: Iterable[str]):
+        for path in paths:
+            self.index_file(path)
+
+    def index_line(self, file: int, offset: int, line: bytes):
+        line = line.rstrip(b"\r")
+        if not line.strip():
+            return
+        for patient_id in patient_ids(self.codec.loads(line)):
+            self._records.append((patient_hash(patient_id), file, offset, len(line)))
+        if len(self._records) >= self.run_size:
+            self._flush_run()
+
+    def _flush_run(self):
+        self._records.sort()
+        fd, path = tempfile.mkstemp(
+            prefix="run", dir=os.path.dirname(os.path.abspath(self.path))
+        )
+        with os.fdopen(fd, "wb") as f:
+            f.writelines(RECORD.pack(*record) for record in self._records)
+        self._runs.append(path)
+        self._records = []
+
+    def _iter_run(self, path: str) -> Iterator[tuple[int, int, int, int]]:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(RECORD.size * 4096), b""):
+                yield from RECORD.iter_unpack(chunk)
+
+    def close(self):
+        self._records.sort()
+        runs = [self._iter_run(path) for path in self._runs] + [iter(self._records)]
+        with open(f"{self.path}.part", "wb") as f:
+            f.write(MAGIC)
+            f.writelines(RECORD.pack(*record) for record in heapq.merge(*runs))
+        with open(f"{self.path}.files.json", "w") as f:
+            json.dump(self.files, f)
+        os.replace(f"{self.path}.part", self.path)
+        for path in self._runs:
+            os.remove(path)
+        self._runs, self._records = [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PatientIndex:
+    def __init__(self, path: str, codec: str | JSONCodec = "auto"):
+        self.path = path
+        self.codec = get_codec(codec)
+        with open(f"{path}.files.json") as f:
+            self.files: list[str] = json.load(f)
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a patient index")
+            size = f.seek(0, 2)
+            self._map = (
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if size > len(MAGIC)
+                else None
+            )
+        self._count = (size - len(MAGIC)) // RECORD.size
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _record(self, index: int) -> tuple[int, int, int, int]:
+        # an empty index has no map and never reads a record
+        if self._map is None:
+            raise ValueError("Patient index is closed")
+        return RECORD.unpack_from(self._map, len(MAGIC) + index * RECORD.size)
+
+    def _first(self, key: int) -> int:
+        # leftmost record with a hash >= key
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._record(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def locations(self, patient_id: str) -> list[tuple[str, int, int]]:
+        # (file, offset, length) of every line that may reference the patient
+        key = patient_hash(patient_id)
+        locations = []
+        index = self._first(key)
+        while index < self._count:
+            record_key, file, offset, length = self._record(index)
+            if record_key != key:
+                break
+            locations.append((self.files[file], offset, length))
+            index += 1
+        return locations
+
+    def iter_lines(self, patient_id: str) -> Iterator[bytes]:
+        for resource, line in self._iter_matches(patient_id):
+            yield line
+
+    def iter_resources(self, patient_id: str) -> Iterator[dict]:
+        for resource, line in self._iter_matches(patient_id):
+            yield resource
+
+    def _iter_matches(self, patient_id: str) -> Iterator[tuple[dict, bytes]]:
+        handles: dict[str, BinaryIO] = {}
+        try:
+            for path, offset, length in self.locations(patient_id):
+                if path not in handles:
+                    handles[path] = open(path, "rb")
+                f = handles[path]
+                f.seek(offset)
+                line = f.read(length)
+                resource = self.codec.loads(line)
+                # drops hash collisions
+                if patient_id in patient_ids(resource):
+                    yield resource, line
+        finally:
+            for f in handles.values():
+                f.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
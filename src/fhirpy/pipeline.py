@@ -0,0 +1,300 @@
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from .fhir import FHIRAPI, FHIRData, Manifest
+from .polling import PollPolicy
+
+# export -> poll -> download -> transform -> sink as stages connected by
+# bounded queues. every stage runs its own worker threads, a stage that
+# falls behind fills its queue and blocks the stage before it, so a slow
+# sink holds back the downloads instead of letting batches pile up in
+# memory. one definition scales by changing the workers (and processes for
+# cpu bound transforms) of each stage.
+#
+#   with ParquetWriter("out", schema) as writer:
+#       stats = (
+#           Pipeline.from_export(fhir_api, "group-1", {"_type": "Patient"})
+#           .download(workers=8)
+#           .transform(drop_narrative, processes=4)
+#           .sink(writer.write_data)
+#           .run()
+#       )
+
+# ends a stage's input, one per worker
+_DONE = object()
+
+
+@dataclass
+class StageStats:
+    items: int = 0
+    outputs: int = 0
+    # seconds spent in the stage function summed over its workers, without
+    # the time spent waiting on a full downstream queue
+    busy: float = 0.0
+    # seconds blocked on a full downstream queue, i.e. backpressure
+    blocked: float = 0.0
+
+
+@dataclass
+class Stage:
+    name: str
+    # takes one item and returns the items passed downstream, or None
+    function: Callable[[Any], Optional[Iterable[Any]]]
+    workers: int = 1
+    queue_size: int = 8
+    # called once the stage's workers are done
+    close: Optional[Callable[[], None]] = None
+    stats: StageStats = field(default_factory=StageStats)
+
+
+def _transform_resources(
+    function: Callable[[dict], Optional[dict]], resources: Iterable[dict]
+) -> list[dict]:
+    # function returns None to drop a resource
+    transformed = (function(resource) for resource in resources)
+    return [resource for resource in transformed if resource is not None]
+
+
+class Pipeline:
+    def __init__(
+        self,
+        source: Iterable[Any],
+        fhir_api: Optional[FHIRAPI] = None,
+        queue_size: int = 8,
+    ):
+        self.source = source
+        self.fhir_api = fhir_api
+        self.queue_size = queue_size
+        self.stages: list[Stage] = []
+        self._on_success: list[Callable[[], None]] = []
+
+    @classmethod
+    def from_manifest(
+        cls, fhir_api: FHIRAPI, manifest: Manifest, queue_size: int = 8
+    ) -> "Pipeline":
+        # the manifest outputs, largest first
+        return cls(manifest.largest_first(), fhir_api, queue_size)
+
+    @classmethod
+    def from_export(
+        cls,
+        fhir_api: FHIRAPI,
+        group_id: str,
+        params: Optional[dict[str, str]] = None,
+        since: Optional[str] = None,
+        full_refresh: bool = False,
+        policy: Optional[PollPolicy] = None,
+        probe_sizes: bool = False,
+        queue_size: int = 8,
+    ) -> "Pipeline":
+        # kicks off and polls the export when the pipeline runs. the export
+        # is recorded for incremental exports only if every stage succeeds
+        params = fhir_api.export_params(group_id, params, since, full_refresh)
+        manifests: list[Manifest] = []
+
+        def outputs() -> Iterator[dict[str, str]]:
+            job = fhir_api.export(group_id=group_id, params=params, full_refresh=True)
+            manifest = fhir_api.wait_for_export(job, policy=policy)
+            if probe_sizes:
+                fhir_api.probe_sizes(manifest)
+            manifests.append(manifest)
+            yield from manifest.largest_first()
+
+        pipeline = cls(outputs(), fhir_api, queue_size)
+        pipeline._on_success.append(
+            lambda: fhir_api.record_export(group_id, manifests[0], params)
+        )
+        return pipeline
+
+    def stage(
+        self,
+        name: str,
+        function: Callable[[Any], Optional[Iterable[Any]]],
+        workers: int = 1,
+        queue_size: Optional[int] = None,
+        close: Optional[Callable[[], None]] = None,
+    ) -> "Pipeline":
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        if any(stage.name == name for stage in self.stages):
+            raise ValueError(f"Duplicate stage name {name}")
+        self.stages.append(
+            Stage(name, function, workers, queue_size or self.queue_size, close)
+        )
+        return self
+
+    def download(
+        self, workers: int = 4, batch_size: int = 10000, name: str = "download"
+    ) -> "Pipeline":
+        # manifest outputs in, FHIRData batches of batch_size resources out.
+        # files are streamed, so a blocked worker also stops reading its file
+        if self.fhir_api is None:
+            raise ValueError("download needs a pipeline with a fhir_api")
+        fhir_api = self.fhir_api
+
+        def download(output: dict[str, str]) -> Iterator[FHIRData]:
+            return fhir_api.iter_batches(output["url"], output["type"], batch_size)
+
+        return self.stage(name, download, workers)
+
+    def transform(
+        self,
+        function: Callable[[dict], Optional[dict]],
+        workers: int = 1,
+        processes: int = 0,
+        name: str = "transform",
+    ) -> "Pipeline":
+        # applies function to every resource of a batch, None drops it. with
+        # processes the batches are transformed on a process pool, function
+        # must then be picklable, i.e. a module level function
+        executor = ProcessPoolExecutor(max_workers=processes) if processes else None
+
+        def transform(data: FHIRData) -> Iterator[FHIRData]:
+            if executor is None:
+                content = _transform_resources(function, data.content)
+            else:
+                content = executor.submit(
+                    _transform_resources, function, list(data.content)
+                ).result()
+            if content:
+                yield FHIRData(content=content, type=data.type, url=data.url)
+
+        return self.stage(
+            name,
+            transform,
+            # one thread per process keeps every process busy
+            max(workers, processes),
+            close=executor.shutdown if executor is not None else None,
+        )
+
+    def sink(
+        self,
+        function: Callable[[Any], None],
+        workers: int = 1,
+        name: str = "sink",
+    ) -> "Pipeline":
+        # more than one worker only for thread safe sinks, ParquetWriter is not
+        def sink(item: Any) -> None:
+            function(item)
+
+        return self.stage(name, sink, workers)
+
+    def run(self) -> dict[str, StageStats]:
+        # returns the stats of every stage, the first error of any stage (or
+        # of the source) stops the pipeline and is raised once it drained.
+        # sources and process pools are used up, so a pipeline runs once
+        if not self.stages:
+            raise ValueError("Pipeline has no stages")
+        for stage in self.stages:
+            stage.stats = StageStats()
+        run = _Run(self.stages)
+        threads = [
+            threading.Thread(target=run.work, args=(index,), name=f"{stage.name}-{n}")
+            for index, stage in enumerate(self.stages)
+            for n in range(stage.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            run.feed(self.source)
+        finally:
+            for thread in threads:
+                thread.join()
+            for stage in self.stages:
+                if stage.close is not None:
+                    stage.close()
+        if run.errors:
+            raise run.errors[0]
+        for callback in self._on_success:
+            callback()
+        return {stage.name: stage.stats for stage in self.stages}
+
+
+class _Run:
+    # the queues and worker loop of one Pipeline.run
+    def __init__(self, stages: list[Stage]):
+        self.stages = stages
+        self.queues: list[queue.Queue] = [
+            queue.Queue(maxsize=stage.queue_size) for stage in stages
+        ]
+        self.errors: list[BaseException] = []
+        self.failed = threading.Event()
+        self._lock = threading.Lock()
+        self._running = [stage.workers for stage in stages]
+
+    def fail(self, error: BaseException):
+        with self._lock:
+            self.errors.append(error)
+        self.failed.set()
+
+    def feed(self, source: Iterable[Any]):
+        try:
+            for item in source:
+                if self.failed.is_set():
+                    break
+                self.queues[0].put(item)
+        except Exception as e:
+            self.fail(e)
+        finally:
+            self._finish(-1)
+
+    def _finish(self, index: int):
+        # the last worker out of stage index ends the input of the next one
+        if index >= 0:
+            with self._lock:
+                self._running[index] -= 1
+                if self._running[index]:
+                    return
+        if index + 1 < len(self.stages):
+            for _ in range(self.stages[index + 1].workers):
+                self.queues[index + 1].put(_DONE)
+
+    def work(self, index: int):
+        stage = self.stages[index]
+        inbox = self.queues[index]
+        outbox = self.queues[index + 1] if index + 1 < len(self.stages) else None
+        try:
+            while True:
+                item = inbox.get()
+                if item is _DONE:
+                    break
+                # after a failure the queue is only drained, so the stages
+                # before this one never block on it
+                if not self.failed.is_set():
+                    self._process(stage, item, outbox)
+        finally:
+            self._finish(index)
+
+    def _process(self, stage: Stage, item: Any, outbox: Optional[queue.Queue]):
+        start = time.perf_counter()
+        blocked = 0.0
+        outputs = 0
+        results = None
+        try:
+            results = stage.function(item)
+            for output in results or ():
+                outputs += 1
+                if outbox is not None:
+                    put = time.perf_counter()
+                    outbox.put(output)
+                    blocked += time.perf_counter() - put
+                if self.failed.is_set():
+                    break
+        except Exception as e:
+            self.fail(e)
+        finally:
+            # a generator left early, e.g. a streamed download, is closed
+            # here so it releases its connection
+            close = getattr(results, "close", None)
+            if close is not None:
+                close()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            stage.stats.items += 1
+            stage.stats.outputs += outputs
+            stage.stats.busy += elapsed - blocked
+            stage.stats.blocked += blocked
@@ -0,0 +1,120 @@
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+def parse_retry_after(
+    value: Optional[str], now: Optional[float] = None
+) -> float | None:
+    # Retry-After is either delay seconds or an HTTP date
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at - (time.time() if now is None else now))
+
+
+def parse_progress(value: Optional[str]) -> float | None:
+    # X-Progress is free text, servers typically send "50%" or "50% complete"
+    if not value:
+        return None
+    match = re.search(r"(\d+(?:\.\d+)?)\s*%", value)
+    if match is None:
+        return None
+    return min(100.0, float(match.group(1)))
+
+
+@dataclass
+class ExportProgress:
+    # (timestamp, percent complete) samples taken from X-Progress headers
+    history: list[tuple[float, float]] = field(default_factory=list)
+    polls: int = 0
+    window: int = 10
+
+    def record(self, percent: float, at: Optional[float] = None):
+        self.history.append((time.time() if at is None else at, percent))
+
+    @property
+    def percent(self) -> float | None:
+        return self.history[-1][1] if self.history else None
+
+    def eta(self) -> float | None:
+        # linear estimate of the seconds left from the most recent samples
+        samples = self.history[-self.window :]
+        if len(samples) < 2:
+            return None
+        (first_time, first_percent), (last_time, last_percent) = samples[0], samples[-1]
+        if last_time <= first_time or last_percent <= first_percent:
+            return None
+        rate = (last_percent - first_percent) / (last_time - first_time)
+        return (100.0 - last_percent) / rate
+
+
+@dataclass
+class PollPolicy:
+    min_interval: float = 1.0
+    max_interval: float = 120.0
+    backoff: float = 1.5
+    # +/- fraction of the delay added at random so many clients don't poll in step,
+    # only + on top of a Retry-After
+    jitter: float = 0.1
+    timeout: float = 60 * 10
+    # first delay, defaults to the Retry-After of the kickoff response
+    initial_interval: Optional[float] = None
+
+
+class ExportPoller:
+    def __init__(
+        self,
+        policy: PollPolicy,
+        retry_after: float,
+        progress: Optional[ExportProgress] = None,
+    ):
+        self.policy = policy
+        self.progress = progress if progress is not None else ExportProgress()
+        self.deadline = time.time() + policy.timeout
+        initial = (
+            policy.initial_interval
+            if policy.initial_interval is not None
+            else retry_after
+        )
+        self._interval = self._clamp(initial)
+
+    def _clamp(self, delay: float) -> float:
+        return min(max(delay, self.policy.min_interval), self.policy.max_interval)
+
+    def expired(self) -> bool:
+        return time.time() > self.deadline
+
+    def next_delay(self, headers) -> float:
+        # called with the headers of every in progress (202) status response
+        self.progress.polls += 1
+        percent = parse_progress(headers.get("X-Progress"))
+        if percent is not None:
+            self.progress.record(percent)
+
+        retry_after = parse_retry_after(headers.get("Retry-After"))
+        if retry_after is not None:
+            # the server asked for this delay, never poll sooner than that so
+            # the jitter is only added on top
+            delay = max(retry_after, self.policy.min_interval)
+            if self.policy.jitter:
+                delay *= 1 + random.uniform(0, self.policy.jitter)
+        else:
+            delay = self._interval
+            eta = self.progress.eta()
+            if eta is not None:
+                delay = self._clamp(min(delay, eta))
+            self._interval = self._clamp(self._interval * self.policy.backoff)
+            if self.policy.jitter:
+                delay *= 1 + random.uniform(-self.policy.jitter, self.policy.jitter)
+        # never sleep past the deadline
+        return max(0.0, min(delay, self.deadline - time.time()))
@@ -0,0 +1,124 @@
+import random
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from typing import Mapping, Optional
+
+import requests
+
+from .polling import parse_retry_after
+
+RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+RETRY_EXCEPTIONS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+@dataclass
+class RetryPolicy:
+    # max_attempts counts the first try, so 1 disables retries
+    max_attempts: int = 5
+    backoff: float = 0.5
+    max_delay: float = 120
+    jitter: float = 0.1
+    statuses: frozenset[int] = RETRY_STATUSES
+    exceptions: tuple[type[BaseException], ...] = field(
+        default_factory=lambda: RETRY_EXCEPTIONS
+    )
+
+    def retry_status(self, status: int) -> bool:
+        return status in self.statuses
+
+    def retry_exception(self, error: BaseException) -> bool:
+        return isinstance(error, self.exceptions)
+
+    def delay(self, attempt: int, headers: Optional[Mapping[str, str]] = None) -> float:
+        # exponential backoff after the attempt-th failure, a Retry-After
+        # header is a floor since the server said when it can take more
+        delay = self.backoff * 2 ** (attempt - 1)
+        if self.jitter:
+            delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        retry_after = parse_retry_after((headers or {}).get("Retry-After"))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return min(delay, self.max_delay)
+
+
+NO_RETRIES = RetryPolicy(max_attempts=1)
+
+
+def kickoff_policy(policy: RetryPolicy) -> RetryPolicy:
+    # export kickoffs start a job on the server, a 5xx may come after the
+    # job was created so only 429, which rejects the request, is retried
+    return replace(policy, statuses=policy.statuses & {429})
+
+
+class CircuitBreaker:
+    # counts consecutive failures per host, after failure_threshold of them
+    # the host's circuit opens and requests to it wait out reset_timeout.
+    # then it is half open: one request goes through as the probe while the
+    # others wait for its result, a success closes the circuit and a failure
+    # opens it again
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures: dict[str, int] = {}
+        self._opened_at: dict[str, float] = {}
+        # when the probe of a half open host was let through
+        self._probing: dict[str, float] = {}
+        self._condition = threading.Condition()
+
+    def is_open(self, host: str) -> bool:
+        return self.wait_time(host) > 0
+
+    def wait_time(self, host: str) -> float:
+        with self._condition:
+            opened_at = self._opened_at.get(host)
+            if opened_at is None:
+                return 0.0
+            return max(0.0, opened_at + self.reset_timeout - time.monotonic())
+
+    def acquire(self, host: str) -> bool:
+        # blocks until a request to host may be sent, returns True when that
+        # request is the probe of a half open circuit
+        with self._condition:
+            while True:
+                opened_at = self._opened_at.get(host)
+                if opened_at is None:
+                    return False
+                now = time.monotonic()
+                if now < opened_at + self.reset_timeout:
+                    self._condition.wait(opened_at + self.reset_timeout - now)
+                    continue
+                probe = self._probing.get(host)
+                # a probe without a result for reset_timeout is given up on
+                if probe is None or now >= probe + self.reset_timeout:
+                    self._probing[host] = now
+                    return True
+                self._condition.wait(probe + self.reset_timeout - now)
+
+    def release(self, host: str):
+        # the probe ended without a result, e.g. on a non retryable error,
+        # the next waiting request becomes the probe
+        with self._condition:
+            if self._probing.pop(host, None) is not None:
+                self._condition.notify_all()
+
+    def record_success(self, host: str):
+        with self._condition:
+            self._failures.pop(host, None)
+            self._opened_at.pop(host, None)
+            self._probing.pop(host, None)
+            self._condition.notify_all()
+
+    def record_failure(self, host: str):
+        with self._condition:
+            failures = self._failures.get(host, 0) + 1
+            self._failures[host] = failures
+            if failures >= self.failure_threshold or host in self._probing:
+                # a failed probe reopens the circuit for another reset_timeout
+                self._opened_at[host] = time.monotonic()
+                self._probing.pop(host, None)
+                self._condition.notify_all()
@@ -0,0 +1,177 @@
+import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, Optional
+from urllib.parse import urlsplit
+
+from .fhir import FHIRAPI, DownloadedFile, Manifest
+from .jwks import JWKS
+from .polling import PollPolicy
+
+
+@dataclass
+class ExportTarget:
+    base_url: str
+    jwks: JWKS
+    scopes: list[str]
+    group_id: str
+    # targets of the same vendor share the vendor's export and download limits
+    vendor: str = "default"
+    params: Optional[dict[str, str]] = None
+    # directory name of the target's files, derived from base_url and group_id
+    name: str = ""
+
+    def __post_init__(self):
+        if not self.name:
+            self.name = re.sub(
+                r"[^A-Za-z0-9_.-]+",
+                "_",
+                f"{urlsplit(self.base_url).netloc}_{self.group_id}",
+            )
+
+
+@dataclass
+class TargetResult:
+    target: ExportTarget
+    manifest: Manifest | None = None
+    files: list[DownloadedFile] = field(default_factory=list)
+    # per-file failures keyed by manifest output url
+    errors: dict[str, BaseException] = field(default_factory=dict)
+    # set when the export itself failed before any download started
+    error: Exception | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.errors
+
+
+def default_api_factory(target: ExportTarget) -> FHIRAPI:
+    return FHIRAPI(base_url=target.base_url, jwks=target.jwks, scopes=target.scopes)
+
+
+class ExportScheduler:
+    # every target is kicked off and polled on its own thread, so waiting on
+    # one EMR never delays another. max_exports caps the targets exporting
+    # (authorizing, kicking off and polling) at once and vendor_export_limits
+    # a vendor's share of them; file downloads from all targets share one
+    # pool of max_downloads workers and vendor_limits caps a vendor's share
+    def __init__(
+        self,
+        targets: list[ExportTarget],
+        directory: str,
+        max_downloads: int = 8,
+        vendor_limits: Optional[dict[str, int]] = None,
+        poll_policy: Optional[PollPolicy] = None,
+        api_factory: Callable[[ExportTarget], FHIRAPI] = default_api_factory,
+        max_exports: Optional[int] = None,
+        vendor_export_limits: Optional[dict[str, int]] = None,
+    ):
+        self.targets = targets
+        self.directory = directory
+        self.max_downloads = max_downloads
+        self.vendor_limits = vendor_limits or {}
+        self.poll_policy = poll_policy
+        self.api_factory = api_factory
+        self.max_exports = max_exports
+        self.vendor_export_limits = vendor_export_limits or {}
+        self._vendor_semaphores = {
+            vendor: threading.BoundedSemaphore(limit)
+            for vendor, limit in self.vendor_limits.items()
+        }
+        self._export_semaphore = (
+            threading.BoundedSemaphore(max_exports) if max_exports else None
+        )
+        self._vendor_export_semaphores = {
+            vendor: threading.BoundedSemaphore(limit)
+            for vendor, limit in self.vendor_export_limits.items()
+        }
+
+    def run(self) -> Iterator[TargetResult]:
+        # results are yielded as each target finishes
+        if not self.targets:
+            return
+        with ThreadPoolExecutor(
+            max_workers=self.max_downloads
+        ) as downloads, ThreadPoolExecutor(max_workers=len(self.targets)) as exports:
+            futures = [
+                exports.submit(self._run_target, target, downloads)
+                for target in self.targets
+            ]
+            for future in as_completed(futures):
+                yield future.result()
+
+    @contextmanager
+    def _export_slot(self, vendor: str) -> Iterator[None]:
+        # the vendor slot is taken first so a target waiting on its vendor
+        # never holds one of the global slots
+        semaphores = [
+            self._vendor_export_semaphores.get(vendor),
+            self._export_semaphore,
+        ]
+        with ExitStack() as stack:
+            for semaphore in semaphores:
+                if semaphore is not None:
+                    stack.enter_context(semaphore)
+            yield
+
+    def _run_target(
+        self, target: ExportTarget, downloads: ThreadPoolExecutor
+    ) -> TargetResult:
+        result = TargetResult(target=target)
+        try:
+            fhir_api = self.api_factory(target)
+        except Exception as e:
+            result.error = e
+            return result
+        try:
+            with self._export_slot(target.vendor):
+                fhir_api.smart_configuration()
+                fhir_api.authorize()
+                job = fhir_api.export(group_id=target.group_id, params=target.params)
+                manifest = fhir_api.wait_for_export(job, policy=self.poll_policy)
+            result.manifest = manifest
+        except Exception as e:
+            result.error = e
+            fhir_api.close()
+            return result
+
+        try:
+            self._download(fhir_api, result, manifest, downloads)
+            if result.ok:
+                fhir_api.record_export(target.group_id, manifest, target.params)
+        finally:
+            fhir_api.close()
+        return result
+
+    def _download(
+        self,
+        fhir_api: FHIRAPI,
+        result: TargetResult,
+        manifest: Manifest,
+        downloads: ThreadPoolExecutor,
+    ):
+        directory = os.path.join(self.directory, result.target.name)
+        os.makedirs(directory, exist_ok=True)
+        semaphore = self._vendor_semaphores.get(result.target.vendor)
+        futures: dict[Future, str] = {}
+        for index, output in enumerate(manifest.output):
+            path = os.path.join(directory, f"{output['type']}.{index}.ndjson")
+            # the vendor slot is taken before submitting so pool workers never
+            # sit blocked on another vendor's limit
+            if semaphore is not None:
+                semaphore.acquire()
+            future = downloads.submit(fhir_api.download_file_to, output["url"], path)
+            if semaphore is not None:
+                future.add_done_callback(lambda _: semaphore.release())
+            futures[future] = output["url"]
+
+        wait(futures)
+        for future, url in futures.items():
+            error = future.exception()
+            if error is not None:
+                result.errors[url] = error
+            else:
+                result.files.append(future.result())
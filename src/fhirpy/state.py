@@ -0,0 +1,116 @@
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional
+
+
+def export_state_key(
+    base_url: str, group_id: str, params: Optional[dict[str, str]] = None
+) -> str:
+    # exports of a group are tracked per set of requested resource types
+    types = (params or {}).get("_type", "")
+    return " ".join(
+        [base_url, group_id, *sorted(t.strip() for t in types.split(",") if t.strip())]
+    )
+
+
+class ExportStateStore(ABC):
+    # last successful transactionTime of every export, used as the _since of
+    # the next export so only resources changed since then are exported
+    @abstractmethod
+    def get_since(self, key: str) -> str | None: ...
+
+    @abstractmethod
+    def set_since(self, key: str, transaction_time: str): ...
+
+    @abstractmethod
+    def delete(self, key: str): ...
+
+
+class MemoryExportStateStore(ExportStateStore):
+    def __init__(self):
+        self._state: dict[str, str] = {}
+
+    def get_since(self, key: str) -> str | None:
+        return self._state.get(key)
+
+    def set_since(self, key: str, transaction_time: str):
+        self._state[key] = transaction_time
+
+    def delete(self, key: str):
+        self._state.pop(key, None)
+
+
+class FileExportStateStore(ExportStateStore):
+    # every export's state in one json document, rewritten atomically
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _read(self) -> dict[str, str]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def _write(self, state: dict[str, str]):
+        with open(f"{self.path}.tmp", "w") as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def get_since(self, key: str) -> str | None:
+        with self._lock:
+            return self._read().get(key)
+
+    def set_since(self, key: str, transaction_time: str):
+        with self._lock:
+            state = self._read()
+            state[key] = transaction_time
+            self._write(state)
+
+    def delete(self, key: str):
+        with self._lock:
+            state = self._read()
+            if state.pop(key, None) is not None:
+                self._write(state)
+
+
+class SQLiteExportStateStore(ExportStateStore):
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS export_state "
+                "(key TEXT PRIMARY KEY, transaction_time TEXT)"
+            )
+
+    def close(self):
+        self._connection.close()
+
+    def get_since(self, key: str) -> str | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT transaction_time FROM export_state WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_since(self, key: str, transaction_time: str):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO export_state (key, transaction_time) "
+                "VALUES (?, ?)",
+                (key, transaction_time),
+            )
+
+    def delete(self, key: str):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM export_state WHERE key = ?", (key,))
@@ -0,0 +1,339 @@
+import gzip
+import itertools
+import json
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# a local stand-in for a SMART backend services + Bulk Data server, for
+# integration tests and benchmarks against real sockets instead of mocks.
+# every export of the server returns the same generated NDJSON files.
+
+
+@dataclass
+class BulkDataServerConfig:
+    types: tuple[str, ...] = ("Patient", "Observation")
+    files_per_type: int = 1
+    resources_per_file: int = 1000
+    # filler bytes added to every resource to control the file size
+    resource_padding: int = 0
+    # status polls answered with 202 before the manifest is returned
+    polls_before_complete: int = 2
+    retry_after: int = 0
+    # seconds slept before answering every request
+    latency: float = 0.0
+    # size of the writes a file download is streamed in
+    chunk_size: int = 64 * 1024
+    # send files with Content-Encoding gzip to clients accepting it
+    gzip_encoding: bool = False
+    # list .ndjson.gz output files with gzip compressed bodies
+    gzip_files: bool = False
+    expires_in: int = 300
+    group_members: int = 10
+    transaction_time: str = "2024-01-01T00:00:00Z"
+
+
+@lru_cache(maxsize=32)
+def generate_ndjson(
+    resource_type: str, count: int, padding: int = 0, seed: int = 0
+) -> bytes:
+    # deterministic resources shaped roughly like real export output
+    lines = []
+    for index in range(count):
+        resource = {
+            "resourceType": resource_type,
+            "id": f"{resource_type.lower()}-{seed}-{index}",
+            "meta": {"versionId": "1", "lastUpdated": "2024-01-01T00:00:00Z"},
+            "identifier": [{"system": "urn:fhirpy:test", "value": str(index)}],
+            "subject": {"reference": f"Patient/{index % 100}"},
+            "text": {"status": "generated", "div": "x" * padding},
+        }
+        lines.append(json.dumps(resource, separators=(",", ":")))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+@lru_cache(maxsize=32)
+def _gzip(data: bytes) -> bytes:
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+@dataclass
+class _Job:
+    params: dict[str, list[str]]
+    polls: int = 0
+
+
+class FakeBulkDataServer:
+    def __init__(
+        self,
+        config: BulkDataServerConfig | None = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.config = config or BulkDataServerConfig()
+        self.host = host
+        self.port = port
+        self.jobs: dict[str, _Job] = {}
+        self.tokens: set[str] = set()
+        # requests served per route, for assertions in tests
+        self.requests: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._server: ThreadingHTTPServer | None = None
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        if self._server is None:
+            raise Exception("Server not started")
+        # port 0 binds a free port, server_port is the one bound
+        return f"http://{self.host}:{self._server.server_port}/"
+
+    def start(self) -> "FakeBulkDataServer":
+        server = self
+
+        class Handler(_BulkDataHandler):
+            bulk_data_server = server
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def count(self, route: str):
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+    def new_job(self, params: dict[str, list[str]]) -> str:
+        job_id = str(next(self._ids))
+        with self._lock:
+            self.jobs[job_id] = _Job(params=params)
+        return job_id
+
+    def job_types(self, job: _Job) -> list[str]:
+        requested = ",".join(job.params.get("_type", [])).split(",")
+        requested = [t.strip() for t in requested if t.strip()]
+        return [t for t in self.config.types if not requested or t in requested]
+
+    def manifest(self, job_id: str) -> dict:
+        job = self.jobs[job_id]
+        output = [
+            {
+                "type": resource_type,
+                "url": (
+                    f"{self.base_url}files/{job_id}/{resource_type}.{index}.ndjson"
+                    + (".gz" if self.config.gzip_files else "")
+                ),
+                "count": self.config.resources_per_file,
+            }
+            for resource_type in self.job_types(job)
+            for index in range(self.config.files_per_type)
+        ]
+        return {
+            "transactionTime": self.config.transaction_time,
+            "request": f"{self.base_url}Group/$export",
+            "requiresAccessToken": True,
+            "output": output,
+            "error": [],
+        }
+
+    def file(self, name: str) -> bytes:
+        resource_type, index = name.split(".")[:2]
+        data = generate_ndjson(
+            resource_type,
+            self.config.resources_per_file,
+            self.config.resource_padding,
+            int(index),
+        )
+        return _gzip(data) if name.endswith(".gz") else data
+
+
+class _BulkDataHandler(BaseHTTPRequestHandler):
+    bulk_data_server: FakeBulkDataServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: dict | None = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_empty(self, status: int, headers: dict | None = None):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def _authorized(self) -> bool:
+        header = self.headers.get("Authorization", "")
+        if header.startswith("Bearer ") and header[7:] in self.bulk_data_server.tokens:
+            return True
+        self._send_empty(401)
+        return False
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_HEAD(self):
+        self._handle("HEAD")
+
+    def _handle(self, method: str):
+        state = self.bulk_data_server
+        if state.config.latency:
+            time.sleep(state.config.latency)
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        body = self._read_body() if method == "POST" else b""
+
+        if parts == [".well-known", "smart-configuration"]:
+            return self._smart_configuration()
+        if parts == ["token"] and method == "POST":
+            return self._token(body)
+        if not self._authorized():
+            return
+        if len(parts) == 3 and parts[0] == "Group" and parts[2] == "$export":
+            return self._kickoff(parse_qs(url.query), body)
+        if len(parts) == 2 and parts[0] == "Group":
+            return self._group(parts[1])
+        if len(parts) == 2 and parts[0] == "status" and parts[1] in state.jobs:
+            return self._status(parts[1])
+        if len(parts) == 3 and parts[0] == "files" and parts[1] in state.jobs:
+            state.count("files")
+            return self._send_file(state.file(parts[2]), body=method != "HEAD")
+        self._send_empty(404)
+
+    def _smart_configuration(self):
+        state = self.bulk_data_server
+        state.count("smart-configuration")
+        self._send_json(
+            200,
+            {
+                "token_endpoint": f"{state.base_url}token",
+                "authorization_endpoint": f"{state.base_url}authorize",
+                "token_endpoint_auth_methods_supported": ["private_key_jwt"],
+                "grant_types_supported": ["client_credentials"],
+            },
+        )
+
+    def _token(self, body: bytes):
+        state = self.bulk_data_server
+        state.count("token")
+        form = parse_qs(body.decode("utf-8"))
+        if not form.get("client_assertion"):
+            return self._send_json(400, {"error": "invalid_client"})
+        access_token = uuid.uuid4().hex
+        with state._lock:
+            state.tokens.add(access_token)
+        self._send_json(
+            200,
+            {
+                "access_token": access_token,
+                "token_type": "bearer",
+                "expires_in": state.config.expires_in,
+                "scope": form.get("scope", [""])[0],
+            },
+        )
+
+    def _kickoff(self, params: dict[str, list[str]], body: bytes):
+        state = self.bulk_data_server
+        state.count("export")
+        if body:
+            # POST kickoff, only the string parameters matter here
+            for parameter in json.loads(body).get("parameter", []):
+                if "valueString" in parameter:
+                    params.setdefault(parameter["name"], []).append(
+                        parameter["valueString"]
+                    )
+        job_id = state.new_job(params)
+        self._send_empty(202, {"Content-Location": f"{state.base_url}status/{job_id}"})
+
+    def _group(self, group_id: str):
+        state = self.bulk_data_server
+        state.count("group")
+        members = [
+            {"entity": {"reference": f"Patient/{index}"}}
+            for index in range(state.config.group_members)
+        ]
+        self._send_json(
+            200, {"resourceType": "Group", "id": group_id, "member": members}
+        )
+
+    def _status(self, job_id: str):
+        state = self.bulk_data_server
+        state.count("status")
+        job = state.jobs[job_id]
+        with state._lock:
+            job.polls += 1
+            polls = job.polls
+        if polls <= state.config.polls_before_complete:
+            percent = int(100 * polls / (state.config.polls_before_complete + 1))
+            return self._send_empty(
+                202,
+                {
+                    "X-Progress": f"{percent}% complete",
+                    "Retry-After": str(state.config.retry_after),
+                },
+            )
+        self._send_json(200, state.manifest(job_id))
+
+    def _send_file(self, data: bytes, body: bool = True):
+        # streams the file in chunk_size writes, honoring a resume Range
+        start = 0
+        encoding = None
+        if self.bulk_data_server.config.gzip_encoding and "gzip" in self.headers.get(
+            "Accept-Encoding", ""
+        ):
+            data, encoding = _gzip(data), "gzip"
+        byte_range = "" if encoding else self.headers.get("Range", "")
+        if byte_range.startswith("bytes=") and byte_range.endswith("-"):
+            start = int(byte_range[len("bytes=") : -1])
+        if start >= len(data) and start:
+            return self._send_empty(416, {"Content-Range": f"bytes */{len(data)}"})
+        self.send_response(206 if start else 200)
+        self.send_header("Content-Type", "application/fhir+ndjson")
+        self.send_header("Content-Length", str(len(data) - start))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        if start:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}"
+            )
+        self.end_headers()
+        if not body:
+            return
+        chunk_size = self.bulk_data_server.config.chunk_size
+        view = memoryview(data)
+        for offset in range(start, len(data), chunk_size):
+            self.wfile.write(view[offset : offset + chunk_size])
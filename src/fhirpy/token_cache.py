@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import fields
+from typing import IO, Callable, ContextManager, Iterator, TypeGuard
+
+from .fhir import Token
+
+# file locks are flock on posix and msvcrt.locking on windows
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore[assignment]
+
+try:
+    import msvcrt
+except ImportError:  # pragma: no cover
+    msvcrt = None  # type: ignore[assignment]
+
+
+def token_expires_at(token: Token) -> float:
+    return token.token_created + token.expires_in
+
+
+def token_to_dict(token: Token) -> dict:
+    # scope has no default and servers don't always return it
+    return {
+        f.name: getattr(token, f.name) for f in fields(Token) if hasattr(token, f.name)
+    }
+
+
+def _lock_file(f: IO):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return
+    f.seek(0)
+    while True:  # pragma: no cover
+        try:
+            # LK_LOCK gives up after about 10 seconds, keep waiting like flock
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+
+def _unlock_file(f: IO):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        return
+    f.seek(0)  # pragma: no cover
+    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)  # pragma: no cover
+
+
+class TokenCache(ABC):
+    # tokens within refresh_margin seconds of expiry are refreshed, concurrent
+    # callers wait on the one refresh in flight instead of each minting a token
+    def __init__(self, refresh_margin: float = 60):
+        self.refresh_margin = refresh_margin
+
+    @staticmethod
+    def key(token_endpoint: str, client_id: str, scopes: list[str]) -> str:
+        return " ".join([token_endpoint, client_id, *sorted(scopes)])
+
+    @abstractmethod
+    def get(self, key: str) -> Token | None: ...
+
+    @abstractmethod
+    def set(self, key: str, token: Token): ...
+
+    @abstractmethod
+    def lock(self, key: str) -> ContextManager[None]: ...
+
+    def margin(self, token: Token) -> float:
+        # at most half the token's lifetime, a token that lives no longer than
+        # refresh_margin would otherwise be refreshed on every request
+        return min(self.refresh_margin, token.expires_in / 2)
+
+    def is_fresh(self, token: Token | None) -> TypeGuard[Token]:
+        return (
+            token is not None
+            and token_expires_at(token) - self.margin(token) > time.time()
+        )
+
+    def get_or_refresh(self, key: str, fetch: Callable[[], Token]) -> Token:
+        token = self.get(key)
+        if self.is_fresh(token):
+            return token
+        with self.lock(key):
+            # another thread or process may have refreshed while we waited
+            token = self.get(key)
+            if self.is_fresh(token):
+                return token
+            token = fetch()
+            self.set(key, token)
+            return token
+
+    def start_background_refresh(
+        self, key: str, fetch: Callable[[], Token]
+    ) -> "TokenRefresher":
+        refresher = TokenRefresher(self, key, fetch)
+        refresher.start()
+        return refresher
+
+
+class MemoryTokenCache(TokenCache):
+    def __init__(self, refresh_margin: float = 60):
+        super().__init__(refresh_margin)
+        self._tokens: dict[str, Token] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def get(self, key: str) -> Token | None:
+        return self._tokens.get(key)
+
+    def set(self, key: str, token: Token):
+        self._tokens[key] = token
+
+    @contextmanager
+    def lock(self, key: str) -> Iterator[None]:
+        with self._guard:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            yield
+
+
+class FileTokenCache(TokenCache):
+    # shares tokens between worker processes on one host, refreshes are
+    # serialized with a lock on a per key lock file
+    def __init__(self, directory: str, refresh_margin: float = 60):
+        if fcntl is None and msvcrt is None:  # pragma: no cover
+            raise ImportError("FileTokenCache requires fcntl or msvcrt file locks")
+        super().__init__(refresh_margin)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def get(self, key: str) -> Token | None:
+        try:
+            with open(f"{self._path(key)}.json") as f:
+                return Token(**json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def set(self, key: str, token: Token):
+        path = f"{self._path(key)}.json"
+        # write then rename so readers never see a partial token file
+        fd = os.open(f"{path}.tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(token_to_dict(token), f)
+        os.replace(f"{path}.tmp", path)
+
+    @contextmanager
+    def lock(self, key: str) -> Iterator[None]:
+        with open(f"{self._path(key)}.lock", "a+") as f:
+            _lock_file(f)
+            try:
+                yield
+            finally:
+                _unlock_file(f)
+
+
+class TokenRefresher(threading.Thread):
+    # keeps the cached token fresh so request paths never wait on a refresh
+    def __init__(
+        self,
+        cache: TokenCache,
+        key: str,
+        fetch: Callable[[], Token],
+        retry_interval: float = 5,
+    ):
+        super().__init__(daemon=True)
+        self.cache = cache
+        self.key = key
+        self.fetch = fetch
+        self.retry_interval = retry_interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                token = self.cache.get_or_refresh(self.key, self.fetch)
+                delay = token_expires_at(token) - self.cache.margin(token) - time.time()
+            except Exception:
+                delay = self.retry_interval
+            self._stopped.wait(max(delay, self.retry_interval))
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,123 @@
+import asyncio
+import json
+
+import pytest
+
+import jwcrypto.jwk as jwk
+from fhirpy import emr_smart_scopes
+from fhirpy.jwks import JWKS
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+from aiohttp.test_utils import TestServer  # noqa: E402
+
+from fhirpy.aio import AsyncFHIRAPI  # noqa: E402
+from fhirpy.fhir import ExportJob  # noqa: E402
+
+pytestmark = pytest.mark.fhirapi
+
+
+@pytest.fixture
+def jwks():
+    key = jwk.JWK.generate(kty="RSA", alg="RS384", size=2048, kid="test")
+    return JWKS(
+        client_id="test_client_id",
+        jku="https://test.com/jwks.json",
+        json_key=key.export_private(),
+    )
+
+
+def bulk_app() -> web.Application:
+    polls = []
+    resources = [{"resourceType": "Patient", "id": str(i)} for i in range(3)]
+
+    async def smart_configuration(request):
+        base = f"{request.scheme}://{request.host}"
+        return web.json_response(
+            {
+                "token_endpoint": f"{base}/token",
+                "authorization_endpoint": f"{base}/authorize",
+            }
+        )
+
+    async def token(request):
+        form = await request.post()
+        assert form["grant_type"] == "client_credentials"
+        return web.json_response({"access_token": "test_token", "expires_in": 300})
+
+    async def export(request):
+        assert request.headers["Authorization"] == "Bearer test_token"
+        base = f"{request.scheme}://{request.host}"
+        return web.Response(
+            status=202,
+            headers={"Content-Location": f"{base}/status", "Retry-After": "0"},
+        )
+
+    async def status(request):
+        polls.append(request)
+        if len(polls) < 2:
+            return web.Response(status=202, headers={"X-Progress": "50%"})
+        base = f"{request.scheme}://{request.host}"
+        return web.json_response(
+            {
+                "transactionTime": "2023-09-20T13:27:58.372-04:00",
+                "request": f"{base}/fhir/Group/test/$export",
+                "requiresAccessToken": True,
+                "output": [{"type": "Patient", "url": f"{base}/files/1"}],
+            }
+        )
+
+    async def download(request):
+        body = "\n".join(json.dumps(resource) for resource in resources)
+        return web.Response(text=body)
+
+    app = web.Application()
+    app.router.add_get("/fhir/.well-known/smart-configuration", smart_configuration)
+    app.router.add_post("/token", token)
+    app.router.add_get("/fhir/Group/{group_id}/$export", export)
+    app.router.add_get("/status", status)
+    app.router.add_get("/files/{file_id}", download)
+    return app
+
+
+def test_async_export_and_download(jwks):
+    async def run():
+        async with TestServer(bulk_app()) as server:
+            base_url = str(server.make_url("/fhir"))
+            async with AsyncFHIRAPI(
+                base_url=base_url, jwks=jwks, scopes=emr_smart_scopes.ECW()
+            ) as fhir_api:
+                await fhir_api.smart_configuration()
+                await fhir_api.authorize()
+                job = await fhir_api.export(group_id="test")
+                manifest = await fhir_api.wait_for_export(job)
+                data = await fhir_api.download_file(**manifest.output[0])
+                batches = [
+                    batch
+                    async for batch in fhir_api.iter_batches(
+                        manifest.output[0]["url"], "Patient", batch_size=2
+                    )
+                ]
+        return manifest, data, batches
+
+    manifest, data, batches = asyncio.run(run())
+
+    assert manifest.output[0]["type"] == "Patient"
+    assert [resource["id"] for resource in data.content] == ["0", "1", "2"]
+    assert [len(batch.content) for batch in batches] == [2, 1]
+
+
+def test_async_wait_for_expired_export(jwks):
+    async def run():
+        async with TestServer(bulk_app()) as server:
+            base_url = str(server.make_url("/fhir"))
+            async with AsyncFHIRAPI(
+                base_url=base_url, jwks=jwks, scopes=emr_smart_scopes.ECW()
+            ) as fhir_api:
+                await fhir_api.smart_configuration()
+                await fhir_api.authorize()
+                job = ExportJob(content_location=str(server.make_url("/expired")))
+                await fhir_api.wait_for_export(job)
+
+    with pytest.raises(Exception, match="status code 404"):
+        asyncio.run(run())
@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from fhirpy.checkpoint import (
+    CheckpointStore,
+    FileCheckpointStore,
+    SQLiteCheckpointStore,
+)
+from fhirpy.fhir import DownloadedFile, ExportJob, Manifest
+
+pytestmark = pytest.mark.fhirapi
+
+
+@pytest.fixture(params=["file", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "file":
+        return FileCheckpointStore(str(tmp_path / "checkpoints"))
+    return SQLiteCheckpointStore(str(tmp_path / "checkpoints.db"))
+
+
+@pytest.fixture
+def manifest():
+    with open("tests/fhir_api/manifest.json") as f:
+        return Manifest(**json.load(f))
+
+
+def test_incomplete_store():
+    class PartialStore(CheckpointStore):
+        def load(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        PartialStore()
+
+
+def test_empty_checkpoint(store):
+    assert store.load("missing") is None
+
+
+def test_checkpoint_round_trip(store, manifest):
+    key = "https://fhir.test.com/Group/test/$export"
+    job = ExportJob(content_location="https://fhir.test.com/status", retry_after=5)
+    downloaded = DownloadedFile(
+        url=manifest.output[0]["url"], path="Provenance.0.ndjson", size=10, sha256="0"
+    )
+
+    store.save_job(key, job)
+    store.save_manifest(key, manifest)
+    store.save_file(key, downloaded)
+    checkpoint = store.load(key)
+
+    assert checkpoint.job == job
+    assert checkpoint.manifest == manifest
+    assert checkpoint.files == {downloaded.url: downloaded}
+
+
+def test_checkpoint_delete(store):
+    key = "https://fhir.test.com/Group/test/$export"
+    store.save_job(key, ExportJob(content_location="https://fhir.test.com/status"))
+    store.delete(key)
+
+    assert store.load(key) is None
@@ -0,0 +1,60 @@
+import pytest
+
+from fhirpy.codec import (
+    CODECS,
+    JSONCodec,
+    NDJSONDecoder,
+    get_codec,
+    iter_ndjson,
+)
+
+pytestmark = pytest.mark.fhirapi
+
+NDJSON = b'{"resourceType": "Patient", "id": "1"}\n\n{"resourceType": "Patient", "id": "2"}\n'
+
+
+@pytest.fixture(params=list(CODECS))
+def codec(request):
+    try:
+        return get_codec(request.param)
+    except ImportError:
+        pytest.skip(f"{request.param} is not installed")
+
+
+def test_loads(codec):
+    assert codec.loads(b'{"id": "1"}') == {"id": "1"}
+    assert codec.loads('{"id": "1"}') == {"id": "1"}
+    assert codec.loads(memoryview(b'{"id": "1"}')) == {"id": "1"}
+
+
+def test_dumps_round_trip(codec):
+    resource = {"resourceType": "Patient", "name": [{"given": ["Jöhn"]}]}
+    assert codec.loads(codec.dumps(resource)) == resource
+
+
+def test_loads_lines(codec):
+    assert [resource["id"] for resource in codec.loads_lines(NDJSON)] == ["1", "2"]
+
+
+def test_ndjson_decoder_split_chunks(codec):
+    decoder = NDJSONDecoder(codec)
+    resources = []
+    for index in range(0, len(NDJSON), 7):
+        resources.extend(decoder.feed(NDJSON[index : index + 7]))
+    resources.extend(decoder.close())
+
+    assert resources == JSONCodec().loads_lines(NDJSON)
+
+
+def test_iter_ndjson_without_trailing_newline(codec):
+    chunks = [b'{"id": "1"}\n{"id"', b': "2"}']
+    assert list(iter_ndjson(chunks, codec)) == [{"id": "1"}, {"id": "2"}]
+
+
+def test_get_codec():
+    assert isinstance(get_codec("auto"), JSONCodec)
+    assert get_codec("json").name == "json"
+    codec = JSONCodec()
+    assert get_codec(codec) is codec
+    with pytest.raises(ValueError):
+        get_codec("unknown")
@@ -0,0 +1,66 @@
+import gzip
+import io
+
+import pytest
+
+from fhirpy.compression import (
+    Decompressor,
+    HashingWriter,
+    compressing_writer,
+    decompress,
+    iter_decompressed,
+)
+
+pytestmark = pytest.mark.fhirapi
+
+NDJSON = b'{"resourceType": "Patient", "id": "1"}\n' * 100
+
+
+def split(data: bytes, size: int) -> list[bytes]:
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def test_decompress():
+    assert decompress(gzip.compress(NDJSON)) == NDJSON
+    assert decompress(NDJSON) == NDJSON
+
+
+def test_iter_decompressed_plain_passthrough():
+    assert b"".join(iter_decompressed(split(NDJSON, 1))) == NDJSON
+
+
+def test_iter_decompressed_gzip_members():
+    # concatenated gzip members, fed one byte at a time
+    data = gzip.compress(NDJSON[:1000]) + gzip.compress(NDJSON[1000:])
+    assert b"".join(iter_decompressed(split(data, 1))) == NDJSON
+    assert b"".join(iter_decompressed(split(data, 4096))) == NDJSON
+
+
+def test_decompressor_short_stream():
+    decompressor = Decompressor()
+    assert decompressor.feed(b"{") == b""
+    assert decompressor.flush() == b"{"
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_compressing_writer(compression):
+    if compression == "zstd":
+        zstandard = pytest.importorskip("zstandard")
+    f = io.BytesIO()
+    written = HashingWriter(f)
+    with compressing_writer(written, compression) as writer:
+        writer.write(NDJSON)
+
+    assert written.size == len(f.getvalue()) < len(NDJSON)
+    if compression == "gzip":
+        assert gzip.decompress(f.getvalue()) == NDJSON
+    else:
+        assert (
+            zstandard.ZstdDecompressor().decompressobj().decompress(f.getvalue())
+            == NDJSON
+        )
+
+
+def test_compressing_writer_unknown():
+    with pytest.raises(ValueError):
+        compressing_writer(HashingWriter(io.BytesIO()), "lz4")
@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+from fhirpy.dedupe import Deduplicator, deduplicate
+
+pytestmark = pytest.mark.fhirapi
+
+
+def resource(resource_type, id, version=None, last_updated=None, **fields):
+    meta = {}
+    if version is not None:
+        meta["versionId"] = version
+    if last_updated is not None:
+        meta["lastUpdated"] = last_updated
+    return {"resourceType": resource_type, "id": id, "meta": meta, **fields}
+
+
+def write_ndjson(path, resources):
+    path.write_text("".join(json.dumps(r) + "\r\n" for r in resources))
+    return str(path)
+
+
+def read_ndjson(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_deduplicate(tmp_path):
+    first = write_ndjson(
+        tmp_path / "1.Provenance.ndjson",
+        [
+            resource("Provenance", "a", "1", note="old"),
+            resource("Provenance", "b", "2", note="newest"),
+            resource("Patient", "p", last_updated="2024-01-02T00:00:00Z", note="new"),
+        ],
+    )
+    second = write_ndjson(
+        tmp_path / "2.Provenance.ndjson",
+        [
+            resource("Provenance", "a", "2", note="new"),
+            resource("Provenance", "b", "1", note="old"),
+            # earlier instant in another timezone
+            resource("Patient", "p", last_updated="2024-01-01T18:00:00-05:00"),
+            resource("Provenance", "c", note="only"),
+        ],
+    )
+
+    paths = deduplicate([first, second], str(tmp_path / "out"), codec="json")
+
+    provenance = read_ndjson(paths["Provenance"])
+    assert [(r["id"], r.get("note")) for r in provenance] == [
+        ("b", "newest"),
+        ("a", "new"),
+        ("c", "only"),
+    ]
+    assert [r.get("note") for r in read_ndjson(paths["Patient"])] == ["new"]
+
+
+def test_ties_keep_the_last_copy(tmp_path):
+    first = write_ndjson(tmp_path / "1.ndjson", [resource("Patient", "p", note="1")])
+    second = write_ndjson(tmp_path / "2.ndjson", [resource("Patient", "p", note="2")])
+    index_path = str(tmp_path / "index.sqlite")
+
+    with Deduplicator(index_path=index_path, batch_size=1) as deduplicator:
+        deduplicator.add_files([first, second])
+        assert deduplicator.lines == 2
+        assert deduplicator.counts() == {"Patient": 1}
+        path = deduplicator.write_type("Patient", str(tmp_path / "Patient.ndjson"))
+
+    assert read_ndjson(path) == [resource("Patient", "p", note="2")]
+
+
+def test_reused_index(tmp_path):
+    index_path = str(tmp_path / "index.sqlite")
+    a = write_ndjson(
+        tmp_path / "a.ndjson",
+        [resource("Patient", "0", note="a0"), resource("Patient", "2", note="a2")],
+    )
+    b = write_ndjson(
+        tmp_path / "b.ndjson",
+        [resource("Patient", "1", note="b1"), resource("Patient", "2", note="b2")],
+    )
+
+    deduplicate([a], str(tmp_path / "first"), index_path=index_path)
+    paths = deduplicate([b], str(tmp_path / "second"), index_path=index_path)
+
+    assert read_ndjson(paths["Patient"]) == [
+        resource("Patient", "1", note="b1"),
+        resource("Patient", "2", note="b2"),
+    ]
+
+def test_compressed_input_rejected(tmp_path):
+    with Deduplicator() as deduplicator:
+        with pytest.raises(ValueError):
+            deduplicator.add_file(str(tmp_path / "Patient.ndjson.gz"))
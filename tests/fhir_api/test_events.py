@@ -0,0 +1,122 @@
+import logging
+
+import jwcrypto.jwk as jwk
+import pytest
+
+from fhirpy import emr_smart_scopes
+from fhirpy.events import EventHooks, PrometheusHooks
+from fhirpy.fhir import FHIRAPI
+from fhirpy.jwks import JWKS
+from fhirpy.polling import PollPolicy
+from fhirpy.testing import BulkDataServerConfig, FakeBulkDataServer
+
+pytestmark = pytest.mark.fhirapi
+
+FAST_POLLING = PollPolicy(min_interval=0, max_interval=0.01, jitter=0)
+
+
+class RecordingHooks(EventHooks):
+    def __init__(self):
+        self.events = []
+
+    def request_end(self, method, url, status, elapsed, nbytes):
+        self.events.append(("request", method, status, nbytes))
+
+    def token_refreshed(self, elapsed):
+        self.events.append(("token",))
+
+    def export_started(self, group_id, content_location):
+        self.events.append(("export", group_id))
+
+    def export_polled(self, content_location, status, percent, delay):
+        self.events.append(("poll", status, percent))
+
+    def export_completed(self, content_location, elapsed, files):
+        self.events.append(("complete", files))
+
+    def file_downloaded(self, url, type, nbytes, elapsed, resources):
+        self.events.append(("file", type, resources))
+
+
+@pytest.fixture(scope="module")
+def json_key():
+    key = jwk.JWK.generate(kty="RSA", alg="RS384", size=2048, kid="test")
+    return key.export_private()
+
+
+@pytest.fixture
+def server():
+    config = BulkDataServerConfig(types=("Patient",), resources_per_file=20)
+    with FakeBulkDataServer(config) as server:
+        yield server
+
+
+def connect(server, json_key, hooks):
+    jwks = JWKS(client_id="test", jku="https://test.com/jwks.json", json_key=json_key)
+    fhir_api = FHIRAPI(server.base_url, jwks, emr_smart_scopes.ECW(), hooks=hooks)
+    fhir_api.smart_configuration()
+    fhir_api.authorize()
+    return fhir_api
+
+
+def run_export(fhir_api):
+    manifest = fhir_api.wait_for_export(fhir_api.export("test"), policy=FAST_POLLING)
+    for output in manifest.output:
+        list(fhir_api.iter_resources(output["url"], output["type"]))
+
+
+def test_events(server, json_key):
+    hooks = RecordingHooks()
+    with connect(server, json_key, hooks) as fhir_api:
+        run_export(fhir_api)
+
+    events = [event for event in hooks.events if event[0] != "request"]
+    assert events == [
+        ("token",),
+        ("export", "test"),
+        ("poll", 202, 33.0),
+        ("poll", 202, 66.0),
+        ("poll", 200, 66.0),
+        ("complete", 1),
+        ("file", "Patient", 20),
+    ]
+    requests = [event for event in hooks.events if event[0] == "request"]
+    assert [event[1:3] for event in requests[:3]] == [
+        ("GET", 200),
+        ("POST", 200),
+        ("GET", 202),
+    ]
+    # streamed bodies are counted by file_downloaded
+    assert requests[-1][3] is None
+
+
+def test_error_response_is_logged(server, json_key, caplog):
+    with connect(server, json_key, EventHooks()) as fhir_api:
+        fhir_api.base_url = f"{server.base_url}missing/"
+        with caplog.at_level(logging.WARNING, logger="fhirpy"):
+            with pytest.raises(Exception, match="Job not started"):
+                fhir_api.export("test")
+
+    assert "failed with status 404" in caplog.text
+
+
+def test_prometheus_hooks(server, json_key):
+    prometheus_client = pytest.importorskip("prometheus_client")
+    registry = prometheus_client.CollectorRegistry()
+    with connect(server, json_key, PrometheusHooks(registry=registry)) as fhir_api:
+        run_export(fhir_api)
+
+    host = server.base_url.split("/")[2]
+    value = registry.get_sample_value
+    assert value("fhirpy_token_refreshes_total") == 1
+    assert value("fhirpy_export_polls_total", {"host": host, "status": "202"}) == 2
+    assert value("fhirpy_resources_total", {"type": "Patient"}) == 20
+    assert (
+        value(
+            "fhirpy_requests_total", {"method": "POST", "host": host, "status": "200"}
+        )
+        == 1
+    )
+    assert (
+        value("fhirpy_download_seconds_count", {"host": host, "type": "Patient"}) == 1
+    )
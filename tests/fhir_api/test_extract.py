@@ -0,0 +1,95 @@
+import pytest
+
+from fhirpy.extract import Extractor, First, compile_path, parse_path
+
+pytestmark = pytest.mark.fhirapi
+
+PATIENTS = [
+    {
+        "resourceType": "Patient",
+        "id": "1",
+        "name": [
+            {"use": "usual", "given": ["Johnny"]},
+            {"use": "official", "given": ["John", "Q"], "family": "Doe"},
+        ],
+        "address": [{"city": "Denver"}],
+    },
+    {"resourceType": "Patient", "id": "2", "name": [{"given": ["Jane"]}]},
+    {"resourceType": "Patient", "id": "3"},
+]
+
+
+def test_parse_path():
+    steps = parse_path("name.where(use='official' and family != 'x').first()")
+    assert len(steps) == 3
+    assert isinstance(steps[-1], First)
+    with pytest.raises(ValueError):
+        parse_path("name.exists(")
+
+
+def test_compile_path_is_cached():
+    assert compile_path("name.given") is compile_path("name.given")
+
+
+def test_evaluate():
+    path = compile_path("name.where(use='official').given")
+
+    assert path.evaluate(PATIENTS[0]) == ["John", "Q"]
+    assert path.evaluate(PATIENTS[1]) == []
+    assert path.evaluate(PATIENTS[2]) == []
+    assert compile_path("name.given.first()").evaluate(PATIENTS[0]) == ["Johnny"]
+    assert compile_path("name.where(use != 'usual').family").evaluate(PATIENTS[0]) == [
+        "Doe"
+    ]
+
+
+def test_extractor():
+    extractor = Extractor(
+        {
+            "id": "id",
+            "first_name": "name.where(use='official').given",
+            "city": "address.city",
+        }
+    )
+
+    assert extractor.extract(PATIENTS) == {
+        "id": ["1", "2", "3"],
+        "first_name": ["John", None, None],
+        "city": ["Denver", None, None],
+    }
+
+
+def test_extractor_all_values():
+    extractor = Extractor({"given": "name.given"}, first=False)
+
+    assert extractor.extract(PATIENTS) == {
+        "given": [["Johnny", "John", "Q"], ["Jane"], []]
+    }
+
+
+def test_extract_table_matches_python():
+    pa = pytest.importorskip("pyarrow")
+    table = pa.Table.from_pylist(PATIENTS)
+    columns = {
+        "id": "id",
+        "first_name": "name.where(use='official').given",
+        "given": "name.given",
+        "family": "name.where(use='official').first().family",
+        "missing": "telecom.value",
+    }
+
+    for first in (True, False):
+        extractor = Extractor(columns, first=first)
+        arrow = {
+            name: column.to_pylist()
+            for name, column in extractor.extract_table(table).items()
+        }
+        assert arrow == extractor.extract(PATIENTS)
+
+
+def test_evaluate_arrow_list_column():
+    pa = pytest.importorskip("pyarrow")
+    names = pa.Table.from_pylist(PATIENTS).column("name")
+    path = compile_path("where(use='official').given")
+
+    assert path.evaluate_arrow(names).to_pylist() == [["John", "Q"], [], []]
@@ -1,14 +1,32 @@
+import hashlib
+import io
 import json
+import os
 import time
 from urllib.parse import urljoin
 
 import pytest
+import requests
 import requests_mock
 
 from fhirpy import emr_smart_scopes
 import jwcrypto.jwk as jwk
-from fhirpy.fhir import FHIRAPI, FHIRRequest, TokenExpired
+from fhirpy.checkpoint import FileCheckpointStore
+from fhirpy.fhir import (
+    FHIRAPI,
+    ExportJob,
+    FHIRRequest,
+    Manifest,
+    TokenExpired,
+    merge_manifests,
+)
 from fhirpy.jwks import JWKS
+from fhirpy.ndjson import NDJSONContent
+from fhirpy.parallel import ParallelDecoder
+from fhirpy.polling import ExportProgress, PollPolicy
+from fhirpy.retry import CircuitBreaker, RetryPolicy
+from fhirpy.state import MemoryExportStateStore
+from fhirpy.token_cache import MemoryTokenCache
 
 pytestmark = pytest.mark.fhirapi
 
@@ -122,3 +140,762 @@ def test_valid_expired_token(base_url, generate_keys):
         fhir_api.validate_token()
     except TokenExpired:
         assert True
+
+
+@pytest.fixture
+def authorized_api(base_url, generate_keys):
+    client_id = "test_client_id"
+    private_json_key = generate_keys[0]
+    jku = "https://test.com/jwks.json"
+    jwks = JWKS(client_id=client_id, jku=jku, json_key=private_json_key)
+    scopes = emr_smart_scopes.ECW()
+    fhir_api = FHIRAPI(base_url=base_url, jwks=jwks, scopes=scopes)
+
+    with requests_mock.Mocker() as mock:
+        with open("tests/fhir_api/smart-configuration.json") as f:
+            expected_mart_config_json = json.load(f)
+        mock.get(
+            FHIRRequest(base_url).smart_configuration()["url"],
+            json=expected_mart_config_json,
+        )
+        _ = fhir_api.smart_configuration()
+        mock.post(
+            fhir_api.token_endpoint(),
+            json={"access_token": "test_access_token", "expires_in": 300},
+        )
+        fhir_api.authorize()
+
+    return fhir_api
+
+
+@pytest.fixture
+def ndjson_url(base_url):
+    return f"{base_url}bulkdata/download?file_name=1.Patient.ndjson"
+
+
+@pytest.fixture
+def ndjson_body():
+    resources = [{"resourceType": "Patient", "id": str(i)} for i in range(5)]
+    return "\n".join(json.dumps(resource) for resource in resources) + "\n"
+
+
+def test_iter_resources(authorized_api, ndjson_url, ndjson_body):
+    with requests_mock.Mocker() as mock:
+        mock.get(ndjson_url, text=ndjson_body)
+        resources = list(authorized_api.iter_resources(ndjson_url, "Patient"))
+
+    assert [resource["id"] for resource in resources] == ["0", "1", "2", "3", "4"]
+    assert resources == [json.loads(line) for line in ndjson_body.splitlines()]
+
+
+def test_iter_batches(authorized_api, ndjson_url, ndjson_body):
+    with requests_mock.Mocker() as mock:
+        mock.get(ndjson_url, text=ndjson_body)
+        batches = list(authorized_api.iter_batches(ndjson_url, "Patient", batch_size=2))
+
+    assert [len(batch.content) for batch in batches] == [2, 2, 1]
+    assert all(batch.type == "Patient" for batch in batches)
+    assert all(batch.url == ndjson_url for batch in batches)
+
+
+def test_iter_resources_failed_download(authorized_api, ndjson_url):
+    with requests_mock.Mocker() as mock:
+        mock.get(ndjson_url, status_code=404)
+        with pytest.raises(Exception):
+            list(authorized_api.iter_resources(ndjson_url, "Patient"))
+
+
+def test_session_is_reused(authorized_api, ndjson_url, ndjson_body):
+    with requests_mock.Mocker() as mock:
+        mock.get(ndjson_url, text=ndjson_body)
+        authorized_api.download_file(ndjson_url, "Patient")
+        authorized_api.download_file(ndjson_url, "Patient")
+
+    assert mock.call_count == 2
+    assert isinstance(authorized_api.session, requests.Session)
+
+
+def test_custom_session(base_url, generate_keys):
+    jwks = JWKS(
+        client_id="test_client_id",
+        jku="https://test.com/jwks.json",
+        json_key=generate_keys[0],
+    )
+    session = requests.Session()
+    session.headers["X-Tenant"] = "test"
+
+    with FHIRAPI(
+        base_url=base_url, jwks=jwks, scopes=emr_smart_scopes.ECW(), session=session
+    ) as fhir_api:
+        assert fhir_api.session is session
+        with requests_mock.Mocker() as mock:
+            with open("tests/fhir_api/smart-configuration.json") as f:
+                mock.get(
+                    FHIRRequest(base_url).smart_configuration()["url"],
+                    json=json.load(f),
+                )
+            fhir_api.smart_configuration()
+
+        assert mock.last_request.headers["X-Tenant"] == "test"
+
+
+def test_custom_adapter(base_url, generate_keys):
+    jwks = JWKS(
+        client_id="test_client_id",
+        jku="https://test.com/jwks.json",
+        json_key=generate_keys[0],
+    )
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=32)
+    fhir_api = FHIRAPI(
+        base_url=base_url, jwks=jwks, scopes=emr_smart_scopes.ECW(), adapter=adapter
+    )
+
+    assert fhir_api.session.get_adapter(base_url) is adapter
+
+
+def test_download_file_lazy(authorized_api, ndjson_url, ndjson_body):
+    with requests_mock.Mocker() as mock:
+        mock.get(ndjson_url, text=ndjson_body)
+        data = authorized_api.download_file(ndjson_url, "Patient", lazy=True)
+
+    assert isinstance(data.content, NDJSONContent)
+    assert len(data.content) == 5
+    assert data.content[3] == {"resourceType": "Patient", "id": "3"}
+    assert list(data.content) == [json.loads(line) for line in ndjson_body.splitlines()]
+
+
+def test_download_tables(authorized_api, ndjson_url, ndjson_body):
+    pytest.importorskip("pyarrow")
+    with requests_mock.Mocker() as mock, ParallelDecoder(
+        max_workers=2, chunk_size=40
+    ) as decoder:
+        mock.get(ndjson_url, text=ndjson_body)
+        tables = list(authorized_api.download_tables(ndjson_url, decoder))
+
+    assert len(tables) > 1
+    assert [row for table in tables for row in table.to_pylist()] == [
+        json.loads(line) for line in ndjson_body.splitlines()
+    ]
+
+
+def test_request_retries_throttled_responses(
+    authorized_api, ndjson_url, ndjson_body, monkeypatch
+):
+    delays = []
+    monkeypatch.setattr("fhirpy.fhir.time.sleep", delays.append)
+    authorized_api.retry_policy = RetryPolicy(backoff=1, jitter=0)
+
+    with requests_mock.Mocker() as mock:
+        mock.get(
+            ndjson_url,
+            [
+                {"status_code": 429, "headers": {"Retry-After": "7"}},
+                {"status_code": 503},
+                {"text": ndjson_body},
+            ],
+        )
+        data = authorized_api.download_file(ndjson_url, "Patient")
+
+    assert len(data.content) == 5
+    assert delays == [7, 2]
+
+
+def test_request_gives_up_after_max_attempts(authorized_api, ndjson_url, monkeypatch):
+    monkeypatch.setattr("fhirpy.fhir.time.sleep", lambda delay: None)
+    authorized_api.retry_policy = RetryPolicy(max_attempts=3)
+    # the third attempt waits out the open circuit and fails as its probe
+    authorized_api.circuit_breaker = CircuitBreaker(
+        failure_threshold=2, reset_timeout=0.2
+    )
+
+    with requests_mock.Mocker() as mock:
+        mock.get(ndjson_url, status_code=503)
+        with pytest.raises(Exception, match="status code 503"):
+            authorized_api.download_file(ndjson_url, "Patient")
+
+    assert mock.call_count == 3
+    assert authorized_api.circuit_breaker.is_open("staging-fhir.ecwcloud.com")
+
+
+def test_download_manifest(authorized_api, monkeypatch):
+    # the 5xx responses are retried, skip the backoff sleeps
+    monkeypatch.setattr("fhirpy.fhir.time.sleep", lambda delay: None)
+    with open("tests/fhir_api/manifest.json") as f:
+        manifest = Manifest(**json.load(f))
+    failed_url = manifest.output[0]["url"]
+
+    with requests_mock.Mocker() as mock:
+        for output in manifest.output:
+            body = json.dumps({"resourceType": output["type"], "id": "1"})
+            mock.get(output["url"], text=body)
+        mock.get(failed_url, status_code=500, text="not json")
+        results = list(
+            authorized_api.download_manifest(manifest, max_workers=4, per_host_limit=2)
+        )
+
+    assert len(results) == len(manifest.output)
+    assert {result.url for result in results} == {
+        output["url"] for output in manifest.output
+    }
+    failed = [result for result in results if not result.ok]
+    assert [result.url for result in failed] == [failed_url]
+    for result in results:
+        if result.ok:
+            assert result.data.content == [{"resourceType": result.type, "id": "1"}]
+
+
+def test_download_manifest_largest_first(authorized_api, base_url):
+    output = [
+        {"type": "Patient", "url": f"{base_url}/files/{i}.ndjson"} for i in range(4)
+    ]
+    manifest = Manifest(request="", output=output)
+    sizes = [10, 40, None, 20]
+
+    with requests_mock.Mocker() as mock:
+        for item, size in zip(output, sizes):
+            headers = {"Content-Length": str(size)} if size else {}
+            mock.head(item["url"], headers=headers)
+            mock.get(item["url"], text='{"resourceType": "Patient", "id": "1"}')
+        results = list(
+            authorized_api.download_manifest(manifest, max_workers=1, probe_sizes=True)
+        )
+        downloaded = [r.url for r in mock.request_history if r.method == "GET"]
+
+    assert all(result.ok for result in results)
+    assert manifest.sizes == {
+        output[0]["url"]: 10,
+        output[1]["url"]: 40,
+        output[3]["url"]: 20,
+    }
+    # the unsized file first, then by decreasing size
+    assert downloaded == [output[i]["url"] for i in (2, 1, 3, 0)]
+
+
+class DroppedConnection(io.BytesIO):
+    # returns the first read and then fails like a dropped connection
+    def read(self, *args, **kwargs):
+        if self.tell():
+            raise requests.exceptions.ConnectionError("connection dropped")
+        return super().read(4)
+
+
+def range_matcher(offset, if_range=None):
+    return lambda request: (
+        request.headers.get("Range") == f"bytes={offset}-"
+        and request.headers.get("If-Range") == if_range
+    )
+
+
+def content_range(body, offset):
+    return {"Content-Range": f"bytes {offset}-{len(body) - 1}/{len(body)}"}
+
+
+def test_download_file_to(authorized_api, ndjson_url, ndjson_body, tmp_path):
+    path = tmp_path / "Patient.ndjson"
+    body = ndjson_body.encode()
+
+    with requests_mock.Mocker() as mock:
+        mock.get(ndjson_url, content=body)
+        downloaded = authorized_api.download_file_to(ndjson_url, str(path))
+
+    assert path.read_bytes() == body
+    assert downloaded.size == len(body)
+    assert downloaded.sha256 == hashlib.sha256(body).hexdigest()
+    assert not os.path.exists(f"{path}.part")
+    assert not os.path.exists(f"{path}.part.json")
+
+
+def test_download_file_to_resumes(authorized_api, ndjson_url, ndjson_body, tmp_path):
+    path = tmp_path / "Patient.ndjson"
+    body = ndjson_body.encode()
+
+    with requests_mock.Mocker() as mock:
+        mock.get(ndjson_url, body=DroppedConnection(body))
+        mock.get(
+            ndjson_url,
+            additional_matcher=range_matcher(4),
+            status_code=206,
+            headers=content_range(body, 4),
+            content=body[4:],
+        )
+        downloaded = authorized_api.download_file_to(
+            ndjson_url, str(path), chunk_size=4
+        )
+
+    assert path.read_bytes() == body
+    assert downloaded.sha256 == hashlib.sha256(body).hexdigest()
+    assert mock.call_count == 2
+
+
+def dropped_download(api, url, path, body, headers=None):
+    # an earlier run that died after the first 4 bytes
+    with requests_mock.Mocker() as mock:
+        mock.get(url, body=DroppedConnection(body), headers=headers or {})
+        with pytest.raises(requests.exceptions.RequestException):
+            api.download_file_to(url, str(path), chunk_size=4, max_resumes=0)
+    with open(f"{path}.part", "rb") as f:
+        assert f.read() == body[:4]
+
+
+def test_download_file_to_resumes_part_file(
+    authorized_api, ndjson_url, ndjson_body, tmp_path
+):
+    path = tmp_path / "Patient.ndjson"
+    body = ndjson_body.encode()
+    dropped_download(authorized_api, ndjson_url, path, body, {"ETag": '"v1"'})
+
+    with requests_mock.Mocker() as mock:
+        mock.get(
+            ndjson_url,
+            additional_matcher=range_matcher(4, '"v1"'),
+            status_code=206,
+            headers={"ETag": '"v1"', **content_range(body, 4)},
+            content=body[4:],
+        )
+        downloaded = authorized_api.download_file_to(ndjson_url, str(path))
+
+    assert path.read_bytes() == body
+    assert downloaded.size == len(body)
+    assert downloaded.sha256 == hashlib.sha256(body).hexdigest()
+    assert not os.path.exists(f"{path}.part.json")
+
+
+def test_download_file_to_restarts_when_range_ignored(
+    authorized_api, ndjson_url, ndjson_body, tmp_path
+):
+    path = tmp_path / "Patient.ndjson"
+    body = ndjson_body.encode()
+    dropped_download(authorized_api, ndjson_url, path, b"stale" + body)
+
+    with requests_mock.Mocker() as mock:
+        mock.get(ndjson_url, content=body)
+        downloaded = authorized_api.download_file_to(ndjson_url, str(path))
+
+    assert path.read_bytes() == body
+    assert downloaded.sha256 == hashlib.sha256(body).hexdigest()
+
+
+def test_download_file_to_restarts_part_file_of_other_url(
+    authorized_api, ndjson_url, ndjson_body, tmp_path
+):
+    path = tmp_path / "Patient.ndjson"
+    body = ndjson_body.encode()
+    other_url = ndjson_url.replace("Patient", "Observation")
+    dropped_download(authorized_api, other_url, path, b"stale" + body)
+
+    with requests_mock.Mocker() as mock:
+        mock.get(ndjson_url, content=body)
+        downloaded = authorized_api.download_file_to(ndjson_url, str(path))
+
+    assert "Range" not in mock.last_request.headers
+    assert path.read_bytes() == body
+    assert downloaded.sha256 == hashlib.sha256(body).hexdigest()
+
+
+def test_download_file_to_restarts_changed_file(
+    authorized_api, ndjson_url, ndjson_body, tmp_path
+):
+    path = tmp_path / "Patient.ndjson"
+    body = ndjson_body.encode()
+    last_modified = "Wed, 01 Jan 2025 00:00:00 GMT"
+    dropped_download(
+        authorized_api,
+        ndjson_url,
+        path,
+        b"stale" + body,
+        {"ETag": 'W/"v1"', "Last-Modified": last_modified},
+    )
+
+    with requests_mock.Mocker() as mock:
+        # the If-Range date no longer matches, the server sends the new file
+        mock.get(ndjson_url, content=body)
+        downloaded = authorized_api.download_file_to(ndjson_url, str(path))
+
+    assert mock.last_request.headers["Range"] == "bytes=4-"
+    assert mock.last_request.headers["If-Range"] == last_modified
+    assert path.read_bytes() == body
+    assert downloaded.sha256 == hashlib.sha256(body).hexdigest()
+
+
+def test_download_file_to_restarts_on_wrong_content_range(
+    authorized_api, ndjson_url, ndjson_body, tmp_path
+):
+    path = tmp_path / "Patient.ndjson"
+    body = ndjson_body.encode()
+    dropped_download(authorized_api, ndjson_url, path, b"stale" + body)
+
+    with requests_mock.Mocker() as mock:
+        mock.get(ndjson_url, content=body)
+        mock.get(
+            ndjson_url,
+            additional_matcher=range_matcher(4),
+            status_code=206,
+            headers=content_range(body, 0),
+            content=body,
+        )
+        downloaded = authorized_api.download_file_to(ndjson_url, str(path))
+
+    assert mock.call_count == 2
+    assert path.read_bytes() == body
+    assert downloaded.sha256 == hashlib.sha256(body).hexdigest()
+
+
+def test_resumable_export(authorized_api, base_url, tmp_path, monkeypatch):
+    # the 5xx responses are retried, skip the backoff sleeps
+    monkeypatch.setattr("fhirpy.fhir.time.sleep", lambda delay: None)
+    with open("tests/fhir_api/manifest.json") as f:
+        manifest_json = json.load(f)
+    outputs = manifest_json["output"]
+    store = FileCheckpointStore(str(tmp_path / "checkpoints"))
+    status_url = f"{base_url}$export-poll-location?job_id=test"
+    export_url = f"{base_url}Group/test/$export"
+
+    with requests_mock.Mocker() as mock:
+        mock.get(
+            export_url,
+            status_code=202,
+            headers={"Content-Location": status_url, "Retry-After": "0"},
+        )
+        mock.get(status_url, json=manifest_json)
+        for output in outputs:
+            mock.get(output["url"], text=json.dumps({"resourceType": output["type"]}))
+        mock.get(outputs[0]["url"], status_code=500)
+        with pytest.raises(Exception):
+            authorized_api.resumable_export("test", str(tmp_path / "data"), store)
+
+    # the rerun skips the kickoff, the status poll and completed files
+    with requests_mock.Mocker() as mock:
+        mock.get(outputs[0]["url"], text=json.dumps({"resourceType": "Provenance"}))
+        downloaded = authorized_api.resumable_export(
+            "test", str(tmp_path / "data"), store
+        )
+
+    assert mock.call_count == 1
+    assert [file.url for file in downloaded] == [output["url"] for output in outputs]
+    assert all(os.path.exists(file.path) for file in downloaded)
+
+
+def test_resumable_export_twice(authorized_api, base_url, tmp_path):
+    with open("tests/fhir_api/manifest.json") as f:
+        manifest_json = json.load(f)
+    outputs = manifest_json["output"]
+    store = FileCheckpointStore(str(tmp_path / "checkpoints"))
+    status_url = f"{base_url}$export-poll-location?job_id=test"
+    export_url = f"{base_url}Group/test/$export"
+
+    for run in range(2):
+        with requests_mock.Mocker() as mock:
+            mock.get(
+                export_url,
+                status_code=202,
+                headers={"Content-Location": status_url, "Retry-After": "0"},
+            )
+            mock.get(status_url, json=manifest_json)
+            for output in outputs:
+                mock.get(output["url"], text=json.dumps({"run": run}))
+            downloaded = authorized_api.resumable_export(
+                "test", str(tmp_path / "data"), store
+            )
+
+        # a finished export is not resumed, every run exports again
+        assert mock.call_count == len(outputs) + 2
+        with open(downloaded[0].path) as f:
+            assert json.load(f) == {"run": run}
+    assert os.listdir(tmp_path / "checkpoints") == []
+
+
+@pytest.mark.parametrize("expired", ["job", "files"])
+def test_resumable_export_restarts_expired_export(
+    authorized_api, base_url, tmp_path, monkeypatch, expired
+):
+    monkeypatch.setattr("fhirpy.fhir.time.sleep", lambda delay: None)
+    with open("tests/fhir_api/manifest.json") as f:
+        manifest_json = json.load(f)
+    outputs = manifest_json["output"]
+    store = FileCheckpointStore(str(tmp_path / "checkpoints"))
+    status_url = f"{base_url}$export-poll-location?job_id=old"
+    new_status_url = f"{base_url}$export-poll-location?job_id=new"
+    export_url = f"{base_url}Group/test/$export"
+    new_outputs = [{**output, "url": output["url"] + "-new"} for output in outputs]
+
+    # the first run stops polling (job) or downloading (files)
+    with requests_mock.Mocker() as mock:
+        mock.get(
+            export_url,
+            status_code=202,
+            headers={"Content-Location": status_url, "Retry-After": "0"},
+        )
+        if expired == "job":
+            mock.get(status_url, status_code=500)
+        else:
+            mock.get(status_url, json=manifest_json)
+            for output in outputs:
+                mock.get(output["url"], text="{}")
+            mock.get(outputs[0]["url"], status_code=500)
+        with pytest.raises(Exception):
+            authorized_api.resumable_export("test", str(tmp_path / "data"), store)
+
+    # by the rerun the server dropped the old job and its files
+    with requests_mock.Mocker() as mock:
+        mock.get(status_url, status_code=410)
+        for output in outputs:
+            mock.get(output["url"], status_code=404)
+        mock.get(
+            export_url,
+            status_code=202,
+            headers={"Content-Location": new_status_url, "Retry-After": "0"},
+        )
+        mock.get(new_status_url, json={**manifest_json, "output": new_outputs})
+        for output in new_outputs:
+            mock.get(output["url"], text="{}")
+        downloaded = authorized_api.resumable_export(
+            "test", str(tmp_path / "data"), store
+        )
+
+    assert [file.url for file in downloaded] == [o["url"] for o in new_outputs]
+    assert os.listdir(tmp_path / "checkpoints") == []
+
+def test_incremental_export(authorized_api, base_url):
+    with open("tests/fhir_api/manifest.json") as f:
+        manifest = Manifest(**json.load(f))
+    authorized_api.export_state = MemoryExportStateStore()
+    export_url = f"{base_url}Group/test/$export"
+    headers = {"Content-Location": f"{base_url}status", "Retry-After": "0"}
+
+    with requests_mock.Mocker() as mock:
+        mock.get(export_url, status_code=202, headers=headers)
+        authorized_api.export("test")
+        authorized_api.record_export("test", manifest)
+        authorized_api.export("test")
+        authorized_api.export("test", full_refresh=True)
+        authorized_api.export("test", params={"_type": "Patient"})
+
+    queries = [request.qs for request in mock.request_history]
+    assert "_since" not in queries[0]
+    assert queries[1]["_since"] == [manifest.transactionTime.lower()]
+    assert "_since" not in queries[2]
+    # a different set of types is tracked separately
+    assert "_since" not in queries[3]
+
+
+def test_merge_manifests():
+    first = Manifest(
+        request="a",
+        output=[{"type": "Patient", "url": "1"}],
+        transactionTime="2024-01-02T00:00:00Z",
+    )
+    second = Manifest(
+        request="b",
+        output=[{"type": "Encounter", "url": "2"}],
+        transactionTime="2024-01-01T20:00:00-05:00",
+        error=[{"type": "OperationOutcome", "url": "3"}],
+        requiresAccessToken=True,
+    )
+    merged = merge_manifests([first, second], request="export")
+
+    assert merged.output == first.output + second.output
+    assert merged.error == second.error
+    assert merged.transactionTime == "2024-01-02T00:00:00Z"
+    assert merged.requiresAccessToken is True
+
+
+def test_export_split_by_type(authorized_api, base_url, monkeypatch):
+    monkeypatch.setattr("fhirpy.fhir.time.sleep", lambda delay: None)
+    types = ["Patient", "Encounter", "Condition"]
+    export_url = f"{base_url}Group/test/$export"
+
+    def kickoff(request, context):
+        context.headers["Content-Location"] = (
+            f"{base_url}status/{request.qs['_type'][0]}"
+        )
+        return ""
+
+    def status(request, context):
+        resource_types = request.path.rsplit("/", 1)[1].split(",")
+        return {
+            "request": request.url,
+            "transactionTime": "2024-01-01T00:00:00Z",
+            "output": [
+                {"type": t, "url": f"{base_url}{t}.ndjson"} for t in resource_types
+            ],
+        }
+
+    with requests_mock.Mocker() as mock:
+        # the most recently registered matcher wins
+        mock.get(requests_mock.ANY, json=status)
+        mock.get(export_url, status_code=202, text=kickoff)
+        manifest = authorized_api.export_split("test", types=types, types_per_job=2)
+
+    kickoffs = [r for r in mock.request_history if r.path.endswith("$export")]
+    assert sorted(r.qs["_type"][0] for r in kickoffs) == [
+        "condition",
+        "patient,encounter",
+    ]
+    assert sorted(output["type"].lower() for output in manifest.output) == [
+        "condition",
+        "encounter",
+        "patient",
+    ]
+    assert manifest.request == export_url
+
+
+def test_export_split_by_patient(authorized_api, base_url):
+    group = {
+        "resourceType": "Group",
+        "member": [{"entity": {"reference": f"Patient/{i}"}} for i in range(5)],
+    }
+    with open("tests/fhir_api/manifest.json") as f:
+        manifest_json = json.load(f)
+    export_url = f"{base_url}Group/test/$export"
+    headers = {"Content-Location": f"{base_url}status", "Retry-After": "0"}
+
+    with requests_mock.Mocker() as mock:
+        mock.get(f"{base_url}Group/test", json=group)
+        mock.post(export_url, status_code=202, headers=headers)
+        mock.get(f"{base_url}status", json=manifest_json)
+        jobs = authorized_api.split_export("test", by="patient", patients_per_job=2)
+        manifest = authorized_api.wait_for_exports(jobs)
+
+    bodies = [r.json() for r in mock.request_history if r.method == "POST"]
+    patients = [
+        [p["valueReference"]["reference"] for p in body["parameter"]] for body in bodies
+    ]
+    assert sorted(patients) == [
+        ["Patient/0", "Patient/1"],
+        ["Patient/2", "Patient/3"],
+        ["Patient/4"],
+    ]
+    assert len(manifest.output) == 3 * len(manifest_json["output"])
+
+
+def test_export_kickoff_is_not_retried_on_5xx(authorized_api, base_url, monkeypatch):
+    delays = []
+    monkeypatch.setattr("fhirpy.fhir.time.sleep", delays.append)
+    export_url = f"{base_url}Group/test/$export"
+    headers = {"Content-Location": f"{base_url}status", "Retry-After": "0"}
+
+    with requests_mock.Mocker() as mock:
+        mock.post(export_url, status_code=503)
+        with pytest.raises(Exception, match="status code 503"):
+            authorized_api._export_patients("test", ["1"], {})
+        assert mock.call_count == 1
+
+        # a 429 rejects the kickoff without starting a job, so it is retried
+        mock.get(
+            export_url,
+            [
+                {"status_code": 429, "headers": {"Retry-After": "1"}},
+                {"status_code": 202, "headers": headers},
+            ],
+        )
+        authorized_api.export("test")
+
+    assert mock.call_count == 3
+    assert delays == [1]
+
+
+def test_wait_for_export_polling(authorized_api, base_url, monkeypatch):
+    with open("tests/fhir_api/manifest.json") as f:
+        manifest_json = json.load(f)
+    status_url = f"{base_url}$export-poll-location?job_id=test"
+    delays = []
+    monkeypatch.setattr("fhirpy.fhir.time.sleep", delays.append)
+
+    with requests_mock.Mocker() as mock:
+        mock.get(
+            status_url,
+            [
+                {"status_code": 202, "headers": {"X-Progress": "10%"}},
+                {"status_code": 202, "headers": {"Retry-After": "7"}},
+                {"status_code": 200, "json": manifest_json},
+            ],
+        )
+        progress = ExportProgress()
+        manifest = authorized_api.wait_for_export(
+            ExportJob(content_location=status_url, retry_after=2),
+            policy=PollPolicy(jitter=0),
+            progress=progress,
+        )
+
+    assert manifest == Manifest(**manifest_json)
+    assert delays == [2, 7]
+    assert progress.polls == 2
+    assert progress.percent == 10.0
+
+
+@pytest.mark.parametrize("status_code", [404, 410, 400])
+def test_wait_for_export_failed_job(authorized_api, base_url, monkeypatch, status_code):
+    status_url = f"{base_url}$export-poll-location?job_id=test"
+    monkeypatch.setattr("fhirpy.fhir.time.sleep", lambda delay: None)
+
+    with requests_mock.Mocker() as mock:
+        mock.get(status_url, status_code=status_code)
+        with pytest.raises(Exception, match=f"status code {status_code}"):
+            authorized_api.wait_for_export(ExportJob(content_location=status_url))
+
+    assert mock.call_count == 1
+
+
+def test_wait_for_export_timeout(authorized_api, base_url, monkeypatch):
+    status_url = f"{base_url}$export-poll-location?job_id=test"
+    monkeypatch.setattr("fhirpy.fhir.time.sleep", lambda delay: None)
+
+    with requests_mock.Mocker() as mock:
+        mock.get(status_url, status_code=202)
+        with pytest.raises(Exception, match="Timed out"):
+            authorized_api.wait_for_export(
+                ExportJob(content_location=status_url),
+                policy=PollPolicy(timeout=0),
+            )
+
+
+def test_token_cache_shared_between_apis(base_url, generate_keys):
+    jwks = JWKS(
+        client_id="test_client_id",
+        jku="https://test.com/jwks.json",
+        json_key=generate_keys[0],
+    )
+    cache = MemoryTokenCache()
+    apis = [
+        FHIRAPI(
+            base_url=base_url,
+            jwks=jwks,
+            scopes=emr_smart_scopes.ECW(),
+            token_cache=cache,
+        )
+        for _ in range(3)
+    ]
+
+    with requests_mock.Mocker() as mock:
+        with open("tests/fhir_api/smart-configuration.json") as f:
+            smart_configuration = json.load(f)
+        mock.get(
+            FHIRRequest(base_url).smart_configuration()["url"],
+            json=smart_configuration,
+        )
+        token_request = mock.post(
+            smart_configuration["token_endpoint"],
+            json={"access_token": "test_access_token", "expires_in": 300},
+        )
+        for fhir_api in apis:
+            fhir_api.smart_configuration()
+            fhir_api.authorize()
+
+    assert token_request.call_count == 1
+    assert all(fhir_api.token.access_token == "test_access_token" for fhir_api in apis)
+
+
+def test_download_file_reauthorizes(authorized_api, ndjson_url, ndjson_body):
+    authorized_api.token.token_created = int(time.time()) - 600
+
+    with requests_mock.Mocker() as mock:
+        token_request = mock.post(
+            authorized_api.token_endpoint(),
+            json={"access_token": "new_access_token", "expires_in": 300},
+        )
+        mock.get(ndjson_url, text=ndjson_body)
+        data = authorized_api.download_file(ndjson_url, "Patient")
+
+    assert token_request.call_count == 1
+    assert len(data.content) == 5
+    assert mock.last_request.headers["Authorization"] == "Bearer new_access_token"
@@ -93,7 +93,56 @@ def test_download_file():
         "headers": {
             "Authorization": f"Bearer {client_assertion}",
             "Accept": "*/*",
+            "Accept-Encoding": "gzip, deflate",
         },
     }
 
     assert params == expect_params
+
+
+def test_download_file_with_offset():
+    client_assertion = "test_token"
+    url = "https://fhir.test.com/fhir/r4/FFBJCD/$dummmy=dummy.ndjson"  # noqa: E501
+    params = FHIRRequest.download_file(
+        url=url, client_assertion=client_assertion, offset=1024
+    )
+
+    expect_params = {
+        "url": url,
+        "headers": {
+            "Authorization": f"Bearer {client_assertion}",
+            "Accept": "*/*",
+            "Accept-Encoding": "gzip, deflate",
+            "Range": "bytes=1024-",
+        },
+    }
+
+    assert params == expect_params
+
+
+def test_export_patients():
+    base_url = "https://fhir.test.com/fhir/r4/FFBJCD/"
+    params = FHIRRequest(base_url).export_patients(
+        token="test_token",
+        group_id="test_group_id",
+        patients=["1", "2"],
+        params={"_type": "Patient"},
+    )
+
+    assert params["url"] == f"{base_url}Group/test_group_id/$export"
+    assert params["headers"]["Content-Type"] == "application/fhir+json"
+    assert params["json"] == {
+        "resourceType": "Parameters",
+        "parameter": [
+            {"name": "_type", "valueString": "Patient"},
+            {"name": "patient", "valueReference": {"reference": "Patient/1"}},
+            {"name": "patient", "valueReference": {"reference": "Patient/2"}},
+        ],
+    }
+
+
+def test_resource_types():
+    types = emr_smart_scopes.resource_types(emr_smart_scopes.ECW())
+    assert "Group" not in types
+    assert types[:2] == ["Medication", "AllergyIntolerance"]
+    assert emr_smart_scopes.resource_types(emr_smart_scopes.AdvancedMD()) == []
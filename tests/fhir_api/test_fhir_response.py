@@ -128,3 +128,28 @@ def test_parse_unknown_params_manifest():
 # def test_token(fhir_response):
 #     token = fhir_response.Token()
 #     assert token is None  # Replace with the expected value
+
+
+def test_manifest_types():
+    with open("tests/fhir_api/manifest.json") as f:
+        manifest = Manifest(**json.load(f))
+
+    types = manifest.list_types()
+    assert types[:3] == ["Provenance", "Goal", "Practitioner"]
+    assert len(types) == len(set(types))
+    assert [output["type"] for output in manifest.outputs("Condition")] == [
+        "Condition"
+    ] * 4
+    assert manifest.outputs("Claim") == []
+
+
+def test_manifest_largest_first():
+    output = [
+        {"type": "Patient", "url": f"https://fhir.test.com/{i}"} for i in range(4)
+    ]
+    manifest = Manifest(request="", output=output)
+    # without sizes the manifest order is kept
+    assert manifest.largest_first() == output
+
+    manifest.sizes = {output[0]["url"]: 10, output[1]["url"]: 30, output[3]["url"]: 20}
+    assert manifest.largest_first() == [output[2], output[1], output[3], output[0]]
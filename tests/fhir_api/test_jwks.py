@@ -0,0 +1,132 @@
+import json
+import threading
+import time
+
+import pytest
+import requests
+import requests_mock
+
+import jwcrypto.jwk as jwk
+from fhirpy.jwks import JWKS, JWKSetCache
+from jwcrypto.jwt import JWT
+
+pytestmark = pytest.mark.fhirapi
+
+JKU = "https://test.com/.well-known/jwks.json"
+
+
+@pytest.fixture
+def signing_key():
+    return jwk.JWK.generate(kty="EC", crv="P-384", kid="test_kid")
+
+
+@pytest.fixture
+def jwk_set(signing_key):
+    return {"keys": [signing_key.export_public(as_dict=True)]}
+
+
+def signed_token(key, kid="test_kid"):
+    token = JWT(header={"alg": "ES384", "kid": kid}, claims={"sub": "test_client_id"})
+    token.make_signed_token(key)
+    return token.serialize()
+
+
+def test_cache_fetches_once(jwk_set):
+    cache = JWKSetCache(JKU)
+
+    with requests_mock.Mocker() as mock:
+        jku = mock.get(JKU, json=jwk_set, headers={"Cache-Control": "max-age=600"})
+        first = cache.get_key("test_kid")
+        second = cache.get_key("test_kid")
+
+    assert jku.call_count == 1
+    assert first is second
+    assert first["kid"] == "test_kid"
+
+
+def test_cache_revalidates_with_etag(jwk_set):
+    cache = JWKSetCache(JKU, ttl=0)
+
+    with requests_mock.Mocker() as mock:
+        mock.get(JKU, json=jwk_set, headers={"ETag": '"v1"'})
+        key = cache.get_key("test_kid")
+        mock.get(JKU, status_code=304)
+        revalidated = cache.get_key("test_kid")
+
+    assert mock.last_request.headers["If-None-Match"] == '"v1"'
+    assert revalidated is key
+
+
+def test_unknown_kid_refetch_is_rate_limited(jwk_set):
+    cache = JWKSetCache(JKU, min_refetch_interval=60)
+
+    with requests_mock.Mocker() as mock:
+        jku = mock.get(JKU, json=jwk_set)
+        assert cache.get_key("test_kid") is not None
+        assert cache.get_key("unknown_kid") is None
+        assert cache.get_key("unknown_kid") is None
+
+    assert jku.call_count == 1
+
+
+def test_unknown_kid_refetches_rotated_keys(jwk_set):
+    cache = JWKSetCache(JKU, min_refetch_interval=0)
+    rotated_key = jwk.JWK.generate(kty="EC", crv="P-384", kid="rotated_kid")
+
+    with requests_mock.Mocker() as mock:
+        mock.get(JKU, json=jwk_set)
+        cache.get_key("test_kid")
+        mock.get(JKU, json={"keys": [rotated_key.export_public(as_dict=True)]})
+        key = cache.get_key("rotated_kid")
+
+    assert key["kid"] == "rotated_kid"
+
+
+def test_validate_uses_cached_keys(signing_key, jwk_set):
+    jwks = JWKS(
+        client_id="test_client_id",
+        jku=JKU,
+        json_key=json.dumps(signing_key.export_private(as_dict=True)),
+        jwk_set_cache=JWKSetCache(JKU),
+    )
+
+    with requests_mock.Mocker() as mock:
+        jku = mock.get(JKU, json=jwk_set)
+        for _ in range(3):
+            jwt = jwks.validate(signed_token(signing_key))
+            assert json.loads(jwt.claims) == {"sub": "test_client_id"}
+
+    assert jku.call_count == 1
+
+
+class SlowSession:
+    # the first request answers at once, later ones wait for release
+    def __init__(self, jwk_set):
+        self.jwk_set = jwk_set
+        self.release = threading.Event()
+        self.calls = 0
+
+    def get(self, url, headers=None, timeout=None):
+        self.calls += 1
+        if self.calls > 1:
+            self.release.wait(5)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(self.jwk_set).encode("utf-8")
+        return response
+
+
+def test_refresh_does_not_block_cached_reads(jwk_set):
+    session = SlowSession(jwk_set)
+    cache = JWKSetCache(JKU, ttl=0, session=session)
+    key = cache.get_key("test_kid")
+
+    refresher = threading.Thread(target=cache.refresh)
+    refresher.start()
+    while session.calls < 2:
+        time.sleep(0.001)
+    # the stale set is served while the refetch is in flight
+    assert cache.get_key("test_kid")["kid"] == key["kid"]
+    assert session.calls == 2
+    session.release.set()
+    refresher.join()
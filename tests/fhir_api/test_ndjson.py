@@ -0,0 +1,56 @@
+import pytest
+
+from fhirpy.codec import JSONCodec
+from fhirpy.ndjson import NDJSONContent, index_lines
+
+pytestmark = pytest.mark.fhirapi
+
+NDJSON = (
+    b'{"resourceType": "Patient", "id": "0"}\r\n'
+    b"\n"
+    b'{"resourceType": "Patient", "id": "1"}\n'
+    b"   \n"
+    b'{"resourceType": "Patient", "id": "2"}'
+)
+
+
+def test_index_lines_skips_blank_lines():
+    starts, ends = index_lines(NDJSON)
+    assert [NDJSON[start:end] for start, end in zip(starts, ends)] == [
+        b'{"resourceType": "Patient", "id": "0"}',
+        b'{"resourceType": "Patient", "id": "1"}',
+        b'{"resourceType": "Patient", "id": "2"}',
+    ]
+
+
+def test_content_sequence():
+    content = NDJSONContent(NDJSON, JSONCodec())
+    assert len(content) == 3
+    assert content[1] == {"resourceType": "Patient", "id": "1"}
+    assert content[-1]["id"] == "2"
+    assert [resource["id"] for resource in content] == ["0", "1", "2"]
+    assert bytes(content.raw(0)) == b'{"resourceType": "Patient", "id": "0"}'
+
+
+def test_content_slice_shares_buffer():
+    content = NDJSONContent(NDJSON, JSONCodec())
+    tail = content[1:]
+    assert isinstance(tail, NDJSONContent)
+    assert [resource["id"] for resource in tail] == ["1", "2"]
+    assert tail._data is content._data
+
+
+def test_content_index_error():
+    with pytest.raises(IndexError):
+        NDJSONContent(NDJSON, JSONCodec())[3]
+
+
+def test_content_from_file(tmp_path):
+    path = tmp_path / "Patient.ndjson"
+    path.write_bytes(NDJSON)
+    content = NDJSONContent.from_file(str(path))
+    assert [resource["id"] for resource in content] == ["0", "1", "2"]
+
+    empty = tmp_path / "empty.ndjson"
+    empty.write_bytes(b"")
+    assert len(NDJSONContent.from_file(str(empty))) == 0
@@ -0,0 +1,119 @@
+import gzip
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from fhirpy.parallel import ParallelDecoder, split_file, split_lines
+
+pa = pytest.importorskip("pyarrow")
+
+pytestmark = pytest.mark.fhirapi
+
+
+def add_flag(resource):
+    return {**resource, "flag": True}
+
+
+def lines(count):
+    return b"".join(
+        json.dumps({"resourceType": "Observation", "id": str(i)}).encode() + b"\n"
+        for i in range(count)
+    )
+
+
+@pytest.fixture(scope="module")
+def decoder():
+    with ParallelDecoder(max_workers=2, chunk_size=100, output="dicts") as decoder:
+        yield decoder
+
+
+def test_split_lines():
+    data = lines(10)
+    ranges = split_lines(data, 100)
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start and data[end - 1 : end] == b"\n"
+    assert split_lines(b"", 100) == []
+    assert split_lines(b'{"id": "1"}', 100) == [(0, 11)]
+
+
+def test_split_file(tmp_path):
+    data = lines(10)
+    path = tmp_path / "Observation.ndjson"
+    path.write_bytes(data)
+    assert split_file(str(path), 100) == split_lines(data, 100)
+
+
+def test_map_file_ordered(decoder, tmp_path):
+    path = tmp_path / "Observation.ndjson"
+    path.write_bytes(lines(50))
+    batches = list(decoder.map_file(str(path)))
+    assert len(batches) > 1
+    assert [r["id"] for batch in batches for r in batch] == [str(i) for i in range(50)]
+
+
+def test_map_file_unordered(decoder, tmp_path):
+    path = tmp_path / "Observation.ndjson"
+    path.write_bytes(lines(50))
+    ids = [
+        r["id"] for batch in decoder.map_file(str(path), ordered=False) for r in batch
+    ]
+    assert sorted(ids, key=int) == [str(i) for i in range(50)]
+
+
+def test_map_gzip_file(decoder, tmp_path):
+    path = tmp_path / "Observation.ndjson.gz"
+    path.write_bytes(gzip.compress(lines(20)))
+    assert sum(len(batch) for batch in decoder.map_file(str(path))) == 20
+
+
+def test_decode_with_transform():
+    with ParallelDecoder(
+        max_workers=2, chunk_size=100, transform=add_flag, output="dicts"
+    ) as decoder:
+        resources = decoder.decode(lines(30))
+    assert [r["id"] for r in resources] == [str(i) for i in range(30)]
+    assert all(r["flag"] for r in resources)
+
+
+def test_arrow_output():
+    schema = pa.schema([("resourceType", pa.string()), ("id", pa.string())])
+    with ParallelDecoder(max_workers=2, chunk_size=100, schema=schema) as decoder:
+        tables = list(decoder.map_bytes(lines(30)))
+        with pytest.raises(ValueError):
+            decoder.decode(lines(1))
+    table = pa.concat_tables(tables)
+    assert table.schema == schema
+    assert table.column("id").to_pylist() == [str(i) for i in range(30)]
+
+
+def test_invalid_output():
+    with pytest.raises(ValueError):
+        ParallelDecoder(output="pickle")
+
+
+def test_shared_memory_is_released_once():
+    # the workers must not unregister or unlink the parent's shared memory,
+    # the resource tracker reports either on stderr
+    script = (
+        "from fhirpy.parallel import ParallelDecoder\n"
+        'data = b\'{"id": "1"}\\n\' * 100\n'
+        "with ParallelDecoder(max_workers=2, chunk_size=100) as decoder:\n"
+        "    for _ in range(2):\n"
+        "        tables = list(decoder.map_bytes(data))\n"
+        "        assert sum(table.num_rows for table in tables) == 100\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONPATH": "src"},
+        timeout=60,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert "resource_tracker" not in result.stderr
+    assert "KeyError" not in result.stderr
@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from fhirpy.fhir import FHIRData
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+
+from fhirpy.parquet import FHIRArrowSchema, ParquetWriter  # noqa: E402
+
+pytestmark = pytest.mark.fhirapi
+
+
+@pytest.fixture(scope="module")
+def schema():
+    return FHIRArrowSchema.load("examples/epic/fhir_r4_schema.json")
+
+
+def test_resource_schema(schema):
+    patient = schema.resource_schema("Patient")
+
+    assert patient.field("id").type == pa.string()
+    assert patient.field("active").type == pa.bool_()
+    assert patient.field("multipleBirthInteger").type == pa.int64()
+    assert pa.types.is_list(patient.field("name").type)
+    assert schema.resource_schema("Patient") is patient
+    # primitive extension elements are left out by default
+    assert "_active" not in patient.names
+
+
+def test_unknown_resource_type(schema):
+    with pytest.raises(ValueError):
+        schema.resource_schema("NotAResource")
+
+
+def test_writer_uses_one_schema_per_type(schema, tmp_path):
+    observations = [
+        {
+            "resourceType": "Observation",
+            "id": "1",
+            "status": "final",
+            "valueQuantity": {"value": 5, "unit": "mg"},
+            "extension": [{"url": "https://test.com", "valueString": "test"}],
+        },
+        {"resourceType": "Observation", "id": "2", "valueString": "positive"},
+        {"resourceType": "Patient", "id": "3", "active": True},
+    ]
+
+    with ParquetWriter(str(tmp_path), schema, row_group_size=1) as writer:
+        writer.write_data(FHIRData(content=observations, type="mixed", url=""))
+
+    table = pq.read_table(tmp_path / "Observation.parquet")
+    assert table.schema == schema.resource_schema("Observation")
+    assert pq.ParquetFile(tmp_path / "Observation.parquet").num_row_groups == 2
+    assert table.column("valueQuantity").to_pylist()[0]["value"] == 5.0
+    assert table.column("valueString").to_pylist() == [None, "positive"]
+    assert json.loads(table.column("extension").to_pylist()[0][0]) == {
+        "url": "https://test.com",
+        "valueString": "test",
+    }
+    assert writer.rows == {"Observation": 2, "Patient": 1}
+
+
+def test_write_ndjson(schema, tmp_path):
+    path = tmp_path / "Patient.ndjson"
+    with open(path, "w") as f:
+        for index in range(5):
+            f.write(json.dumps({"resourceType": "Patient", "id": str(index)}) + "\n")
+
+    with ParquetWriter(str(tmp_path / "parquet"), schema) as writer:
+        writer.write_ndjson(str(path), chunk_size=16)
+
+    table = pq.read_table(tmp_path / "parquet" / "Patient.parquet")
+    assert table.column("id").to_pylist() == ["0", "1", "2", "3", "4"]
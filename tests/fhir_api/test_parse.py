@@ -32,3 +32,14 @@ def test_get_last_name_no_official():
 def test_get_last_name_empty():
     data = []
     assert get_last_name(data) is None
+
+
+def test_get_first_name_without_use():
+    data = [{"given": "Johnny"}, {"use": "official", "given": "John", "family": "Doe"}]
+    assert get_first_name(data) == "John"
+    assert get_last_name(data) == "Doe"
+
+
+def test_get_first_name_missing():
+    assert get_first_name(None) is None
+    assert get_last_name(float("nan")) is None
@@ -0,0 +1,109 @@
+import json
+
+import pytest
+
+import fhirpy.patient_index
+from fhirpy.patient_index import PatientIndex, PatientIndexWriter, patient_ids
+
+pytestmark = pytest.mark.fhirapi
+
+
+def write_ndjson(path, resources):
+    path.write_text("".join(json.dumps(r) + "\n" for r in resources))
+    return str(path)
+
+
+@pytest.fixture
+def files(tmp_path):
+    patients = write_ndjson(
+        tmp_path / "Patient.ndjson",
+        [{"resourceType": "Patient", "id": str(i)} for i in range(3)],
+    )
+    observations = write_ndjson(
+        tmp_path / "Observation.ndjson",
+        [
+            {
+                "resourceType": "Observation",
+                "id": f"o{i}",
+                "subject": {"reference": f"Patient/{i % 3}"},
+            }
+            for i in range(9)
+        ],
+    )
+    claims = write_ndjson(
+        tmp_path / "Coverage.ndjson",
+        [
+            {
+                "resourceType": "Coverage",
+                "id": "c1",
+                "beneficiary": {"reference": "https://fhir.test.com/Patient/1"},
+            }
+        ],
+    )
+    return [patients, observations, claims]
+
+
+def test_patient_ids():
+    assert patient_ids({"resourceType": "Patient", "id": "1"}) == {"1"}
+    assert patient_ids(
+        {
+            "resourceType": "Encounter",
+            "subject": {"reference": "Patient/1/_history/2"},
+            "patient": [{"reference": "Patient/2"}, {"display": "no reference"}],
+        }
+    ) == {"1", "2"}
+    assert (
+        patient_ids(
+            {"resourceType": "Observation", "subject": {"reference": "Group/1"}}
+        )
+        == set()
+    )
+
+
+@pytest.mark.parametrize("run_size", [2, 1_000_000])
+def test_patient_index(files, tmp_path, run_size):
+    path = str(tmp_path / "patients.idx")
+    with PatientIndexWriter(path, run_size=run_size) as writer:
+        writer.index_files(files)
+
+    with PatientIndex(path) as index:
+        assert len(index) == 13
+        resources = list(index.iter_resources("1"))
+        assert [r["id"] for r in resources] == ["1", "o1", "o4", "o7", "c1"]
+        assert (
+            list(index.iter_lines("2"))[0] == b'{"resourceType": "Patient", "id": "2"}'
+        )
+        assert index.locations("missing") == []
+
+
+def test_streamed_chunks_match_file_offsets(files, tmp_path):
+    path = str(tmp_path / "patients.idx")
+    with PatientIndexWriter(path) as writer:
+        indexer = writer.open_file(files[1])
+        with open(files[1], "rb") as f:
+            data = f.read()
+        for i in range(0, len(data), 7):
+            indexer.feed(data[i : i + 7])
+        indexer.close()
+
+    with PatientIndex(path) as index:
+        assert [r["id"] for r in index.iter_resources("0")] == ["o0", "o3", "o6"]
+
+
+def test_hash_collisions_are_dropped(files, tmp_path, monkeypatch):
+    monkeypatch.setattr(fhirpy.patient_index, "patient_hash", lambda patient_id: 1)
+    path = str(tmp_path / "patients.idx")
+    with PatientIndexWriter(path) as writer:
+        writer.index_files(files)
+
+    with PatientIndex(path) as index:
+        assert len(index.locations("0")) == 13
+        assert [r["id"] for r in index.iter_resources("0")] == ["0", "o0", "o3", "o6"]
+
+
+def test_empty_index(tmp_path):
+    path = str(tmp_path / "patients.idx")
+    PatientIndexWriter(path).close()
+    with PatientIndex(path) as index:
+        assert len(index) == 0
+        assert list(index.iter_resources("1")) == []
@@ -0,0 +1,158 @@
+import threading
+import time
+
+import jwcrypto.jwk as jwk
+import pytest
+
+from fhirpy import emr_smart_scopes
+from fhirpy.fhir import FHIRAPI
+from fhirpy.jwks import JWKS
+from fhirpy.pipeline import Pipeline
+from fhirpy.polling import PollPolicy
+from fhirpy.state import MemoryExportStateStore
+from fhirpy.testing import BulkDataServerConfig, FakeBulkDataServer
+
+pytestmark = pytest.mark.fhirapi
+
+FAST_POLLING = PollPolicy(min_interval=0, max_interval=0.01, jitter=0)
+
+
+def tag(resource):
+    return {**resource, "tag": True}
+
+
+def drop_odd(resource):
+    return resource if int(resource["id"].rsplit("-", 1)[-1]) % 2 == 0 else None
+
+
+@pytest.fixture(scope="module")
+def server():
+    config = BulkDataServerConfig(
+        types=["Patient", "Observation"], files_per_type=2, resources_per_file=50
+    )
+    with FakeBulkDataServer(config) as server:
+        yield server
+
+
+@pytest.fixture
+def fhir_api(server):
+    key = jwk.JWK.generate(kty="RSA", alg="RS384", size=2048, kid="test")
+    jwks = JWKS(
+        client_id="test",
+        jku="https://test.com/jwks.json",
+        json_key=key.export_private(),
+    )
+    with FHIRAPI(
+        server.base_url,
+        jwks,
+        emr_smart_scopes.ECW(),
+        export_state=MemoryExportStateStore(),
+    ) as fhir_api:
+        fhir_api.smart_configuration()
+        fhir_api.authorize()
+        yield fhir_api
+
+
+def test_export_pipeline(fhir_api):
+    batches = []
+    stats = (
+        Pipeline.from_export(
+            fhir_api, "test", {"_type": "Patient,Observation"}, policy=FAST_POLLING
+        )
+        .download(workers=2, batch_size=20)
+        .transform(tag, workers=2)
+        .sink(batches.append)
+        .run()
+    )
+
+    resources = [resource for batch in batches for resource in batch.content]
+    assert len(resources) == 200
+    assert all(resource["tag"] for resource in resources)
+    assert {batch.type for batch in batches} == {"Patient", "Observation"}
+    assert stats["download"].items == 4
+    assert stats["download"].outputs == stats["sink"].items == len(batches)
+    # the next export of the group is incremental
+    assert "_since" in fhir_api.export_params("test", {"_type": "Patient,Observation"})
+
+
+def test_transform_on_processes(fhir_api):
+    resources = []
+    (
+        Pipeline.from_export(
+            fhir_api, "test", {"_type": "Patient"}, policy=FAST_POLLING
+        )
+        .download(workers=2)
+        .transform(drop_odd, processes=2)
+        .sink(lambda batch: resources.extend(batch.content))
+        .run()
+    )
+
+    assert len(resources) == 50
+
+
+def test_backpressure():
+    in_flight = 0
+    most_in_flight = 0
+    lock = threading.Lock()
+
+    def produce(item):
+        nonlocal in_flight, most_in_flight
+        for n in range(5):
+            with lock:
+                in_flight += 1
+                most_in_flight = max(most_in_flight, in_flight)
+            yield n
+
+    def slow_sink(item):
+        nonlocal in_flight
+        time.sleep(0.001)
+        with lock:
+            in_flight -= 1
+
+    stats = (
+        Pipeline(range(20), queue_size=2)
+        .stage("produce", produce, workers=2)
+        .sink(slow_sink)
+        .run()
+    )
+
+    assert stats["sink"].items == 100
+    assert stats["produce"].blocked > 0
+    # the queue plus one item per worker of each stage
+    assert most_in_flight <= 2 + 2 + 1
+
+
+def test_errors_stop_the_pipeline(fhir_api):
+    def fail(batch):
+        raise ValueError("sink failed")
+
+    params = {"_type": "Patient"}
+    pipeline = (
+        Pipeline.from_export(fhir_api, "failing", params, policy=FAST_POLLING)
+        .download()
+        .sink(fail)
+    )
+    with pytest.raises(ValueError, match="sink failed"):
+        pipeline.run()
+    # a failed run is not recorded
+    assert "_since" not in fhir_api.export_params("failing", params)
+
+
+def test_source_errors_are_raised():
+    def source():
+        yield 1
+        raise RuntimeError("export failed")
+
+    with pytest.raises(RuntimeError, match="export failed"):
+        Pipeline(source()).sink(lambda item: None).run()
+
+
+def test_invalid_stages():
+    with pytest.raises(ValueError):
+        Pipeline([]).run()
+    with pytest.raises(ValueError):
+        Pipeline([]).download()
+    with pytest.raises(ValueError):
+        Pipeline([]).sink(print).sink(print)
+    with pytest.raises(ValueError):
+        Pipeline([]).stage("empty", print, workers=0)
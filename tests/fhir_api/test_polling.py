@@ -0,0 +1,92 @@
+from email.utils import formatdate
+
+import pytest
+
+from fhirpy.polling import (
+    ExportPoller,
+    ExportProgress,
+    PollPolicy,
+    parse_progress,
+    parse_retry_after,
+)
+
+pytestmark = pytest.mark.fhirapi
+
+
+def test_parse_retry_after_seconds():
+    assert parse_retry_after("120") == 120.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+
+
+def test_parse_retry_after_http_date():
+    now = 1_700_000_000
+    value = formatdate(now + 30, usegmt=True)
+
+    assert parse_retry_after(value, now=now) == 30.0
+
+
+def test_parse_progress():
+    assert parse_progress("50%") == 50.0
+    assert parse_progress("12.5% complete") == 12.5
+    assert parse_progress("in progress") is None
+    assert parse_progress(None) is None
+
+
+def test_progress_eta():
+    progress = ExportProgress()
+    progress.record(10.0, at=100.0)
+    assert progress.eta() is None
+
+    progress.record(30.0, at=110.0)
+
+    assert progress.percent == 30.0
+    assert progress.eta() == pytest.approx(35.0)
+
+
+def test_poller_backoff_with_ceiling():
+    policy = PollPolicy(min_interval=1, max_interval=4, backoff=2, jitter=0)
+    poller = ExportPoller(policy, retry_after=1)
+
+    delays = [poller.next_delay({}) for _ in range(4)]
+
+    assert delays == [1, 2, 4, 4]
+    assert poller.progress.polls == 4
+
+
+def test_poller_honors_retry_after():
+    policy = PollPolicy(min_interval=1, max_interval=4, jitter=0)
+    poller = ExportPoller(policy, retry_after=1)
+
+    assert poller.next_delay({"Retry-After": "30"}) == 30
+
+
+def test_poller_uses_eta():
+    policy = PollPolicy(min_interval=1, max_interval=120, jitter=0)
+    poller = ExportPoller(policy, retry_after=120)
+    poller.progress.record(50.0, at=0.0)
+    poller.progress.record(90.0, at=40.0)
+
+    assert poller.next_delay({}) == pytest.approx(10.0)
+
+
+def test_poller_jitter():
+    policy = PollPolicy(min_interval=1, max_interval=100, jitter=0.1)
+    poller = ExportPoller(policy, retry_after=10)
+
+    assert 9 <= poller.next_delay({}) <= 11
+
+
+def test_poller_jitter_never_undercuts_retry_after(monkeypatch):
+    policy = PollPolicy(min_interval=1, max_interval=100, jitter=0.1)
+    poller = ExportPoller(policy, retry_after=1)
+    monkeypatch.setattr("fhirpy.polling.random.uniform", lambda a, b: a)
+
+    assert poller.next_delay({"Retry-After": "10"}) == 10
+    monkeypatch.setattr("fhirpy.polling.random.uniform", lambda a, b: b)
+    assert poller.next_delay({"Retry-After": "10"}) == pytest.approx(11)
+
+def test_poller_deadline():
+    poller = ExportPoller(PollPolicy(timeout=0, jitter=0), retry_after=10)
+
+    assert poller.next_delay({}) == 0.0
@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from fhirpy.retry import CircuitBreaker, RetryPolicy
+
+pytestmark = pytest.mark.fhirapi
+
+
+def test_retry_policy_backoff():
+    policy = RetryPolicy(backoff=1, max_delay=5, jitter=0)
+    assert [policy.delay(attempt) for attempt in range(1, 5)] == [1, 2, 4, 5]
+
+
+def test_retry_policy_honors_retry_after():
+    policy = RetryPolicy(backoff=1, max_delay=60, jitter=0)
+    assert policy.delay(1, {"Retry-After": "30"}) == 30
+    # a Retry-After shorter than the backoff doesn't shorten it
+    assert policy.delay(3, {"Retry-After": "1"}) == 4
+    assert policy.delay(1, {"Retry-After": "600"}) == 60
+
+
+def test_retry_policy_classification():
+    policy = RetryPolicy()
+    assert policy.retry_status(429) and policy.retry_status(503)
+    assert not policy.retry_status(404)
+    assert policy.retry_exception(requests.ConnectionError())
+    assert not policy.retry_exception(ValueError())
+
+
+def test_circuit_breaker(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("fhirpy.retry.time.monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+
+    breaker.record_failure("a")
+    assert not breaker.is_open("a")
+    breaker.record_failure("a")
+    assert breaker.wait_time("a") == 10
+    assert not breaker.is_open("b")
+
+    now[0] += 10
+    assert not breaker.is_open("a")
+    # a failed probe reopens the circuit, a success closes it
+    breaker.record_failure("a")
+    assert breaker.is_open("a")
+    breaker.record_success("a")
+    assert not breaker.is_open("a")
+
+
+def test_half_open_circuit_lets_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.3)
+    breaker.record_failure("a")
+    results = []
+    lock = threading.Lock()
+
+    def request():
+        probe = breaker.acquire("a")
+        with lock:
+            results.append(probe)
+
+    threads = [threading.Thread(target=request) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while not results and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    # only the probe is through, the others wait for its result
+    assert results == [True]
+
+    breaker.record_success("a")
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [False, False, False, False, True]
+
+
+def test_failed_probe_reopens_the_circuit():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.05)
+    for _ in range(3):
+        breaker.record_failure("a")
+    assert breaker.acquire("a") is True
+    breaker.record_failure("a")
+    assert breaker.is_open("a")
+    # a probe that ends without a result hands the probe to the next request
+    assert breaker.acquire("a") is True
+    breaker.release("a")
+    assert breaker.acquire("a") is True
@@ -0,0 +1,165 @@
+import json
+import threading
+import time
+
+import pytest
+import requests_mock
+
+import jwcrypto.jwk as jwk
+from fhirpy import emr_smart_scopes
+from fhirpy.fhir import FHIRAPI
+from fhirpy.jwks import JWKS
+from fhirpy.polling import PollPolicy
+from fhirpy.scheduler import ExportScheduler, ExportTarget
+
+pytestmark = pytest.mark.fhirapi
+
+
+@pytest.fixture
+def jwks():
+    key = jwk.JWK.generate(kty="RSA", alg="RS384", size=2048, kid="test")
+    return JWKS(
+        client_id="test_client_id",
+        jku="https://test.com/jwks.json",
+        json_key=key.export_private(),
+    )
+
+
+class ConcurrencyCounter:
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, request, context):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(0.05)
+        with self.lock:
+            self.active -= 1
+        return json.dumps({"resourceType": "Patient", "id": "1"})
+
+
+def mock_bulk_server(mock, base_url, files, download=None, fail_export=False):
+    mock.get(
+        f"{base_url}.well-known/smart-configuration",
+        json={
+            "token_endpoint": f"{base_url}token",
+            "authorization_endpoint": f"{base_url}authorize",
+        },
+    )
+    mock.post(
+        f"{base_url}token", json={"access_token": "test_token", "expires_in": 300}
+    )
+    mock.get(
+        f"{base_url}Group/test/$export",
+        status_code=500 if fail_export else 202,
+        headers={"Content-Location": f"{base_url}status"},
+    )
+    outputs = [
+        {"type": "Patient", "url": f"{base_url}files/{index}"} for index in range(files)
+    ]
+    mock.get(
+        f"{base_url}status",
+        json={"request": f"{base_url}Group/test/$export", "output": outputs},
+    )
+    for output in outputs:
+        mock.get(output["url"], text=download)
+
+
+def test_scheduler(jwks, tmp_path):
+    epic = ExportTarget(
+        base_url="https://epic.test.com/fhir/",
+        jwks=jwks,
+        scopes=emr_smart_scopes.EPIC(),
+        group_id="test",
+        vendor="epic",
+    )
+    ecw = ExportTarget(
+        base_url="https://ecw.test.com/fhir/",
+        jwks=jwks,
+        scopes=emr_smart_scopes.ECW(),
+        group_id="test",
+        vendor="ecw",
+    )
+    epic_downloads = ConcurrencyCounter()
+
+    with requests_mock.Mocker() as mock:
+        mock_bulk_server(mock, epic.base_url, files=4, download=epic_downloads)
+        mock_bulk_server(mock, ecw.base_url, files=2, download='{"id": "1"}')
+        scheduler = ExportScheduler(
+            [epic, ecw],
+            directory=str(tmp_path),
+            max_downloads=4,
+            vendor_limits={"epic": 1},
+            poll_policy=PollPolicy(jitter=0),
+        )
+        results = {result.target.vendor: result for result in scheduler.run()}
+
+    assert results["epic"].ok and results["ecw"].ok
+    assert len(results["epic"].files) == 4
+    assert len(results["ecw"].files) == 2
+    assert epic_downloads.peak == 1
+    assert (tmp_path / "epic.test.com_test" / "Patient.0.ndjson").exists()
+
+
+@pytest.mark.parametrize(
+    "limits, peak",
+    [({"vendor_export_limits": {"epic": 1}}, 1), ({"max_exports": 2}, 2)],
+)
+def test_scheduler_export_limits(jwks, tmp_path, monkeypatch, limits, peak):
+    targets = [
+        ExportTarget(
+            base_url=f"https://epic.test.com/fhir/tenant{index}/",
+            jwks=jwks,
+            scopes=emr_smart_scopes.EPIC(),
+            group_id="test",
+            vendor="epic",
+            name=f"tenant{index}",
+        )
+        for index in range(4)
+    ]
+    # requests_mock serializes the requests, count the polls around it
+    polls = ConcurrencyCounter()
+    wait_for_export = FHIRAPI.wait_for_export
+
+    def counted_wait_for_export(self, *args, **kwargs):
+        polls(None, None)
+        return wait_for_export(self, *args, **kwargs)
+
+    monkeypatch.setattr(FHIRAPI, "wait_for_export", counted_wait_for_export)
+
+    with requests_mock.Mocker() as mock:
+        for target in targets:
+            mock_bulk_server(mock, target.base_url, files=1)
+        scheduler = ExportScheduler(
+            targets,
+            directory=str(tmp_path),
+            poll_policy=PollPolicy(jitter=0),
+            **limits,
+        )
+        results = list(scheduler.run())
+
+    assert all(result.ok for result in results)
+    assert polls.peak == peak
+
+
+def test_scheduler_export_failure(jwks, tmp_path, monkeypatch):
+    # the 5xx responses are retried, skip the backoff sleeps
+    monkeypatch.setattr("fhirpy.fhir.time.sleep", lambda delay: None)
+    target = ExportTarget(
+        base_url="https://ecw.test.com/fhir/",
+        jwks=jwks,
+        scopes=emr_smart_scopes.ECW(),
+        group_id="test",
+    )
+
+    with requests_mock.Mocker() as mock:
+        mock_bulk_server(mock, target.base_url, files=1, fail_export=True)
+        results = list(ExportScheduler([target], directory=str(tmp_path)).run())
+
+    assert len(results) == 1
+    assert not results[0].ok
+    assert results[0].manifest is None
+    assert str(results[0].error) == "Job not started"
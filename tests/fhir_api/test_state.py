@@ -0,0 +1,48 @@
+import pytest
+
+from fhirpy.state import (
+    ExportStateStore,
+    FileExportStateStore,
+    MemoryExportStateStore,
+    SQLiteExportStateStore,
+    export_state_key,
+)
+
+pytestmark = pytest.mark.fhirapi
+
+
+@pytest.fixture(params=["memory", "file", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryExportStateStore()
+    if request.param == "file":
+        return FileExportStateStore(str(tmp_path / "state" / "exports.json"))
+    return SQLiteExportStateStore(str(tmp_path / "exports.db"))
+
+
+def test_incomplete_store():
+    class PartialStore(ExportStateStore):
+        def get_since(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        PartialStore()
+
+
+def test_export_state_key_sorts_types():
+    base_url = "https://fhir.test.com/"
+    assert export_state_key(base_url, "g", {"_type": "Patient,Encounter"}) == (
+        export_state_key(base_url, "g", {"_type": "Encounter, Patient"})
+    )
+    assert export_state_key(base_url, "g") != export_state_key(
+        base_url, "g", {"_type": "Patient"}
+    )
+
+
+def test_state_round_trip(store):
+    assert store.get_since("missing") is None
+    store.set_since("key", "2024-01-01T00:00:00Z")
+    store.set_since("key", "2024-01-02T00:00:00Z")
+    assert store.get_since("key") == "2024-01-02T00:00:00Z"
+    store.delete("key")
+    assert store.get_since("key") is None
@@ -0,0 +1,136 @@
+import gzip
+
+import jwcrypto.jwk as jwk
+import pytest
+
+from fhirpy import emr_smart_scopes
+from fhirpy.fhir import FHIRAPI
+from fhirpy.jwks import JWKS
+from fhirpy.polling import PollPolicy
+from fhirpy.testing import BulkDataServerConfig, FakeBulkDataServer, generate_ndjson
+
+pytestmark = pytest.mark.fhirapi
+
+FAST_POLLING = PollPolicy(min_interval=0, max_interval=0.01, jitter=0)
+
+
+@pytest.fixture(scope="module")
+def json_key():
+    key = jwk.JWK.generate(kty="RSA", alg="RS384", size=2048, kid="test")
+    return key.export_private()
+
+
+@pytest.fixture
+def server():
+    config = BulkDataServerConfig(resources_per_file=50, files_per_type=2)
+    with FakeBulkDataServer(config) as server:
+        yield server
+
+
+@pytest.fixture
+def fhir_api(server, json_key):
+    jwks = JWKS(client_id="test", jku="https://test.com/jwks.json", json_key=json_key)
+    with FHIRAPI(server.base_url, jwks, emr_smart_scopes.ECW()) as fhir_api:
+        fhir_api.smart_configuration()
+        fhir_api.authorize()
+        yield fhir_api
+
+
+def test_export_end_to_end(server, fhir_api):
+    job = fhir_api.export("test", params={"_type": "Patient"})
+    manifest = fhir_api.wait_for_export(job, policy=FAST_POLLING)
+    results = list(fhir_api.download_manifest(manifest))
+
+    assert server.requests["status"] == server.config.polls_before_complete + 1
+    assert [output["type"] for output in manifest.output] == ["Patient", "Patient"]
+    assert all(result.ok for result in results)
+    assert sum(len(result.data.content) for result in results) == 100
+
+
+def test_probe_sizes(server, fhir_api, tmp_path):
+    job = fhir_api.export("test", params={"_type": "Patient,Observation"})
+    manifest = fhir_api.wait_for_export(job, policy=FAST_POLLING)
+    sizes = fhir_api.probe_sizes(manifest)
+
+    assert server.requests["files"] == len(manifest.output)
+    for index, output in enumerate(manifest.output):
+        path = str(tmp_path / f"{index}.ndjson")
+        assert (
+            sizes[output["url"]] == fhir_api.download_file_to(output["url"], path).size
+        )
+
+
+def test_download_file_to_resumes_with_range(server, fhir_api, tmp_path):
+    job = fhir_api.export("test")
+    url = fhir_api.wait_for_export(job, policy=FAST_POLLING).output[0]["url"]
+    body = generate_ndjson("Patient", 50, 0, 0)
+    path = tmp_path / "Patient.ndjson"
+    (tmp_path / "Patient.ndjson.part").write_bytes(body[:100])
+
+    downloaded = fhir_api.download_file_to(url, str(path))
+
+    assert path.read_bytes() == body
+    assert downloaded.size == len(body)
+
+
+def test_unauthorized_request(server, fhir_api):
+    fhir_api.token.access_token = "invalid"
+    with pytest.raises(Exception):
+        fhir_api.export("test")
+
+
+@pytest.fixture
+def gzip_server():
+    config = BulkDataServerConfig(
+        types=("Patient",), resources_per_file=50, gzip_encoding=True
+    )
+    with FakeBulkDataServer(config) as server:
+        yield server
+
+
+def test_compressed_download_passthrough(gzip_server, json_key, tmp_path):
+    jwks = JWKS(client_id="test", jku="https://test.com/jwks.json", json_key=json_key)
+    with FHIRAPI(gzip_server.base_url, jwks, emr_smart_scopes.ECW()) as fhir_api:
+        fhir_api.smart_configuration()
+        fhir_api.authorize()
+        job = fhir_api.export("test")
+        url = fhir_api.wait_for_export(job, policy=FAST_POLLING).output[0]["url"]
+        resources = list(fhir_api.iter_resources(url, "Patient"))
+        gz = fhir_api.download_file_to(
+            url, str(tmp_path / "Patient.ndjson.gz"), compression="gzip"
+        )
+
+    body = generate_ndjson("Patient", 50, 0, 0)
+    assert len(resources) == 50
+    # the gzip coded body is written as sent, without recompressing
+    assert (tmp_path / "Patient.ndjson.gz").read_bytes() == gzip.compress(
+        body, compresslevel=6, mtime=0
+    )
+    assert gz.size == (tmp_path / "Patient.ndjson.gz").stat().st_size
+
+
+def test_gzip_output_files(json_key, tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    config = BulkDataServerConfig(
+        types=("Patient",), resources_per_file=50, gzip_files=True
+    )
+    jwks = JWKS(client_id="test", jku="https://test.com/jwks.json", json_key=json_key)
+    with FakeBulkDataServer(config) as server, FHIRAPI(
+        server.base_url, jwks, emr_smart_scopes.ECW()
+    ) as fhir_api:
+        fhir_api.smart_configuration()
+        fhir_api.authorize()
+        job = fhir_api.export("test")
+        url = fhir_api.wait_for_export(job, policy=FAST_POLLING).output[0]["url"]
+        data = fhir_api.download_file(url, "Patient")
+        streamed = list(fhir_api.iter_resources(url, "Patient"))
+        zst = fhir_api.download_file_to(
+            url, str(tmp_path / "Patient.ndjson.zst"), compression="zstd"
+        )
+
+    assert url.endswith(".ndjson.gz")
+    assert data.content == streamed
+    assert len(streamed) == 50
+    with open(zst.path, "rb") as f:
+        body = zstandard.ZstdDecompressor().stream_reader(f).read()
+    assert body == generate_ndjson("Patient", 50, 0, 0)
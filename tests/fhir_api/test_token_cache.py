@@ -0,0 +1,132 @@
+import threading
+import time
+
+import pytest
+
+from fhirpy.fhir import Token
+from fhirpy.token_cache import FileTokenCache, MemoryTokenCache, TokenCache
+
+pytestmark = pytest.mark.fhirapi
+
+
+@pytest.fixture(params=["memory", "file"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        return MemoryTokenCache(refresh_margin=60)
+    return FileTokenCache(str(tmp_path / "tokens"), refresh_margin=60)
+
+
+def test_incomplete_cache():
+    class PartialCache(TokenCache):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        PartialCache()
+
+
+class TokenEndpoint:
+    def __init__(self, expires_in=300, delay=0.0, age=0):
+        self.calls = 0
+        self.expires_in = expires_in
+        self.delay = delay
+        # seconds since the server issued the token
+        self.age = age
+        self.lock = threading.Lock()
+
+    def __call__(self) -> Token:
+        with self.lock:
+            self.calls += 1
+            calls = self.calls
+        time.sleep(self.delay)
+        return Token(
+            access_token=f"token_{calls}",
+            expires_in=self.expires_in,
+            token_created=int(time.time()) - self.age,
+        )
+
+
+def test_token_created_at_instantiation():
+    token = Token(access_token="test_token")
+    assert abs(token.token_created - time.time()) < 2
+
+
+def test_cache_key():
+    key = MemoryTokenCache.key("https://test.com/token", "client", ["b.read", "a.read"])
+    assert key == MemoryTokenCache.key(
+        "https://test.com/token", "client", ["a.read", "b.read"]
+    )
+
+
+def test_get_or_refresh_reuses_token(cache):
+    fetch = TokenEndpoint()
+
+    first = cache.get_or_refresh("key", fetch)
+    second = cache.get_or_refresh("key", fetch)
+
+    assert fetch.calls == 1
+    assert first.access_token == second.access_token == "token_1"
+
+
+def test_get_or_refresh_refreshes_within_margin(cache):
+    # a token expiring inside the refresh margin is replaced proactively
+    fetch = TokenEndpoint(expires_in=300, age=260)
+
+    cache.get_or_refresh("key", fetch)
+    token = cache.get_or_refresh("key", fetch)
+
+    assert fetch.calls == 2
+    assert token.access_token == "token_2"
+
+
+@pytest.mark.parametrize("expires_in", [30, 60])
+def test_short_lived_token_is_reused(cache, expires_in):
+    # the margin is capped at half the lifetime of tokens shorter than it
+    fetch = TokenEndpoint(expires_in=expires_in)
+
+    cache.get_or_refresh("key", fetch)
+    token = cache.get_or_refresh("key", fetch)
+
+    assert fetch.calls == 1
+    assert token.access_token == "token_1"
+
+
+def test_single_flight_refresh(cache):
+    fetch = TokenEndpoint(delay=0.1)
+    tokens = []
+
+    def worker():
+        tokens.append(cache.get_or_refresh("key", fetch).access_token)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert fetch.calls == 1
+    assert tokens == ["token_1"] * 8
+
+
+def test_file_cache_shared_between_instances(tmp_path):
+    fetch = TokenEndpoint()
+    FileTokenCache(str(tmp_path)).get_or_refresh("key", fetch)
+
+    token = FileTokenCache(str(tmp_path)).get_or_refresh("key", fetch)
+
+    assert fetch.calls == 1
+    assert token.access_token == "token_1"
+
+
+def test_background_refresh():
+    cache = MemoryTokenCache(refresh_margin=0)
+    fetch = TokenEndpoint(expires_in=0)
+
+    refresher = cache.start_background_refresh("key", fetch)
+    refresher.retry_interval = 0.01
+    time.sleep(0.1)
+    refresher.stop()
+    refresher.join()
+
+    assert fetch.calls >= 1
+    assert cache.get("key") is not None